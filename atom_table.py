@@ -0,0 +1,680 @@
+"""
+Columnar (structure-of-arrays) storage for PDB atoms.
+
+Every ATOM/HETATM field is kept in one NumPy array per column instead of
+one dict per atom: coordinates and float fields as float arrays, serial and
+resSeq as integer arrays and all string fields as categorical columns
+(integer codes into a small list of distinct values). AtomTable behaves as
+a sequence of dict-like AtomView objects, so code written for the list of
+dicts produced by pdb_utils.parse_atom keeps working. Like slices of such a
+list, slices of a table are lists of AtomViews of the same atoms. Copies
+and subset views of a table share its columns; a column is only copied
+when one of the tables sharing it modifies it.
+"""
+from collections.abc import MutableMapping
+import hashlib
+import itertools
+import json
+import mmap
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only required for the columnar backend
+    np = None
+
+
+ATOM_KEYS = ('record', 'serial', 'name', 'altLoc', 'resName', 'chainID',
+             'resSeq', 'iCode', 'x', 'y', 'z', 'occupancy', 'tempFactor',
+             'element', 'charge', 'extras')
+STRING_KEYS = ('record', 'name', 'altLoc', 'resName', 'chainID', 'iCode',
+               'element', 'charge', 'extras')
+INT_KEYS = ('serial', 'resSeq')
+FLOAT_KEYS = ('occupancy', 'tempFactor')
+COORD_KEYS = ('x', 'y', 'z')
+# pdb_utils.ATOM_FORMATS for AtomTables, whose string fields are formatted
+# once per distinct value with STRING_FORMATS
+TABLE_ATOM_FORMAT = ("%s%5d %s%s%s %s%4d%s   "
+                     "%8.3f%8.3f%8.3f%6.2f%6.2f          %s%s%s")
+STRING_FORMATS = {'record': '%-6s', 'altLoc': '%-1s', 'resName': '%3s',
+                  'chainID': '%-1s', 'iCode': '%-1s', 'element': '%2s',
+                  'charge': '%2s', 'extras': '%s'}
+NAME_FORMATS = (' %-3s', '%4s')
+
+
+# Versions of AtomTables (and list-backend Pdbs), unique across all of them.
+# next() of an itertools.count is atomic, so threads never share a version.
+_versions = itertools.count(1)
+
+
+def next_version():
+    """New version number, greater than all previous ones"""
+    return next(_versions)
+
+
+def check_numpy():
+    if np is None:
+        raise ImportError("The columnar atom backend requires numpy")
+
+
+class Categorical(object):
+    """String column stored as integer codes into a list of categories"""
+
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = list(categories)
+        self.lookup = {value: code
+                       for code, value in enumerate(self.categories)}
+
+    @classmethod
+    def from_values(cls, values):
+        lookup = {}
+        codes = np.fromiter((lookup.setdefault(value, len(lookup))
+                             for value in values),
+                            dtype=np.int32, count=len(values))
+        return cls(codes, lookup.keys())
+
+    def code(self, value):
+        """Code of value, adding it as a new category if necessary"""
+        if value not in self.lookup:
+            self.lookup[value] = len(self.categories)
+            self.categories.append(value)
+        return self.lookup[value]
+
+    def __getitem__(self, row):
+        return self.categories[self.codes[row]]
+
+    def __setitem__(self, rows, value):
+        self.codes[rows] = self.code(value)
+
+    def matches(self, condition):
+        """Boolean mask of rows whose value fulfills condition"""
+        matching = [code for code, value in enumerate(self.categories)
+                    if condition(value)]
+        return np.isin(self.codes, matching)
+
+    def take(self, rows):
+        return Categorical(self.codes[rows], self.categories)
+
+    def copy(self):
+        return Categorical(self.codes.copy(), self.categories)
+
+
+class AtomTable(object):
+    """
+    Sequence of atoms stored column-wise. Removed atoms are only flagged
+    as such, so AtomViews obtained before a removal stay valid. version
+    changes with every modification or removal of atoms.
+    """
+
+    def __init__(self, columns, coords, alive=None):
+        check_numpy()
+        self.columns = columns
+        self.coords = coords
+        self.alive = (np.ones(len(coords), dtype=bool)
+                      if alive is None else alive)
+        self._rows = None
+        self._shared = set()  # keys of columns shared with other tables
+        self.signature = None  # digest of the non-coordinate fields parsed
+        self.version = next_version()
+
+    @classmethod
+    def from_atoms(cls, atoms, dtype=None):
+        """Builds the table from an iterable of atom mappings"""
+        check_numpy()
+        atoms = list(atoms)
+        coords = np.array([[atom[key] for key in COORD_KEYS]
+                           for atom in atoms],
+                          dtype=dtype or np.float64).reshape(-1, 3)
+        columns = {key: Categorical.from_values([atom[key] for atom in atoms])
+                   for key in STRING_KEYS}
+        columns.update({key: np.array([atom[key] for atom in atoms],
+                                      dtype=np.int32)
+                        for key in INT_KEYS})
+        columns.update({key: np.array([atom[key] for atom in atoms],
+                                      dtype=coords.dtype)
+                        for key in FLOAT_KEYS})
+        return cls(columns, coords)
+
+    def rows(self):
+        """Indices of atoms that have not been removed"""
+        if self._rows is None:
+            self._rows = np.flatnonzero(self.alive)
+        return self._rows
+
+    def __len__(self):
+        return len(self.rows())
+
+    def __iter__(self):
+        return (AtomView(self, row) for row in self.rows())
+
+    def __getitem__(self, index):
+        """
+        AtomView of atom index or list of AtomViews of the atoms selected
+        by index (slice, mask or indices), which modify this table.
+        take copies atoms into a new table instead.
+        """
+        if isinstance(index, (int, np.integer)):
+            return AtomView(self, self.rows()[index])
+        return [AtomView(self, row) for row in self.rows()[index].tolist()]
+
+    def __eq__(self, other):
+        try:
+            return (len(self) == len(other) and
+                    all(a == b for a, b in zip(self, other)))
+        except TypeError:
+            return NotImplemented
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __repr__(self):
+        return "<AtomTable of {} atoms>".format(len(self))
+
+    def get_value(self, row, key):
+        if key in COORD_KEYS:
+            return float(self.coords[row, COORD_KEYS.index(key)])
+        column = self.columns[key]
+        if key in STRING_KEYS:
+            return column[row]
+        if key in INT_KEYS:
+            return int(column[row])
+        return float(column[row])
+
+    def set_value(self, rows, key, value):
+        if key in COORD_KEYS:
+            self._own('coords')
+            self.coords[rows, COORD_KEYS.index(key)] = value
+        elif key in self.columns:
+            self._own(key)
+            self.columns[key][rows] = value
+        else:
+            raise KeyError(key)
+        self.version = next_version()
+
+    def _own(self, key):
+        """Copies column key (or 'coords') if it is shared"""
+        if key not in self._shared:
+            return
+        self._shared.discard(key)
+        if key == 'coords':
+            self.coords = self.coords.copy()
+        else:
+            self.columns[key] = self.columns[key].copy()
+
+    def column(self, key):
+        """Values of column key for all atoms, as a NumPy array"""
+        rows = self.rows()
+        if key in COORD_KEYS:
+            return self.coords[rows, COORD_KEYS.index(key)]
+        column = self.columns[key]
+        if key in STRING_KEYS:
+            return np.array(column.categories, dtype=object)[
+                column.codes[rows]]
+        return column[rows]
+
+    def mask(self, key, condition):
+        """
+        Boolean mask (over atoms, not removed ones) of atoms whose value of
+        key fulfills condition. String columns evaluate condition once per
+        distinct value.
+        """
+        if key in STRING_KEYS:
+            return self.columns[key].matches(condition)[self.rows()]
+        return np.fromiter(map(condition, self.column(key)), dtype=bool,
+                           count=len(self))
+
+    def mask_of(self, atoms):
+        """Boolean mask selecting atoms (AtomViews of this table)"""
+        return np.isin(self.rows(), [atom.row for atom in atoms])
+
+    def isin(self, key, values):
+        values = set(values)
+        if key in STRING_KEYS:
+            return self.mask(key, values.__contains__)
+        return np.isin(self.column(key), list(values))
+
+    def contains(self, key, substring):
+        return self.mask(key, lambda value: substring in value)
+
+    def groups(self, keys):
+        """
+        List of (values, atoms) of the atoms grouped by their values of
+        keys, in order of first appearance: a tuple of the values and a list
+        of AtomViews of the atoms of every group
+        """
+        rows = self.rows()
+        if not len(rows):
+            return []
+        # Categorical codes stand in for string values
+        columns = [self.columns[key].codes[rows] if key in STRING_KEYS
+                   else self.column(key) for key in keys]
+        order = np.lexsort(columns[::-1])
+        starts = np.zeros(len(rows), dtype=bool)
+        starts[0] = True
+        for column in columns:
+            column = column[order]
+            starts[1:] |= column[1:] != column[:-1]
+        starts = np.flatnonzero(starts)
+        # lexsort is stable, so every group starts with its first atom
+        firsts = order[starts]
+        values = list(zip(*[
+            [self.columns[key].categories[code]
+             for code in column[firsts].tolist()] if key in STRING_KEYS
+            else self.column(key)[firsts].tolist() for key, column in
+            zip(keys, columns)]))
+        views = list(map(AtomView, itertools.repeat(self, len(rows)),
+                         rows[order].tolist()))
+        bounds = starts.tolist() + [len(rows)]
+        return [(values[group], views[bounds[group]:bounds[group + 1]])
+                for group in np.argsort(firsts).tolist()]
+
+    def modify(self, mask, key, value):
+        """Sets key to value for all atoms selected by mask"""
+        self.set_value(self.rows()[mask], key, value)
+
+    def take(self, index):
+        """New table with atoms selected by index (mask, slice or indices)"""
+        rows = self.rows()[index]
+        columns = {key: (column.take(rows) if key in STRING_KEYS
+                         else column[rows])
+                   for key, column in self.columns.items()}
+        return AtomTable(columns, self.coords[rows])
+
+    def copy(self):
+        return self.view()
+
+    def view(self, index=slice(None), coords=None):
+        """
+        New table with atoms selected by index sharing the columns with this
+        one. Shared columns are copied by the first table modifying them.
+        coords (one row per row of this table) replaces the coordinates,
+        e.g. with another frame of the same atoms.
+        """
+        alive = np.zeros_like(self.alive)
+        alive[self.rows()[index]] = True
+        shared = set(self.columns)
+        if coords is None:
+            coords = self.coords
+            shared.add('coords')
+        table = AtomTable(dict(self.columns), coords, alive)
+        table.signature = self.signature
+        table._shared = set(shared)
+        self._shared |= shared
+        return table
+
+    def remove(self, atom):
+        """Removes atom (an AtomView of this table or an equal mapping)"""
+        if isinstance(atom, AtomView) and atom.table is self:
+            row = atom.row
+        else:
+            row = next((view.row for view in self if view == atom), None)
+        if row is None or not self.alive[row]:
+            raise ValueError("atom not in table")
+        self.remove_rows(np.searchsorted(self.rows(), row))
+
+    def remove_rows(self, index):
+        """Removes the atoms selected by index (mask, slice or indices)"""
+        self.alive[self.rows()[index]] = False
+        self._rows = None
+        self.version = next_version()
+
+    def coordinates(self):
+        """(atoms, 3) array of atom coordinates"""
+        return self.coords[self.rows()]
+
+    def lines(self):
+        """PDB lines of the atoms as pdb_utils.dump_atom writes them"""
+        rows = self.rows()
+        columns = []
+        for key in ATOM_KEYS:
+            if key not in STRING_KEYS:
+                columns.append(self.column(key).tolist())
+                continue
+            column = self.columns[key]
+            if key == 'name':
+                values = [NAME_FORMATS[len(name) > 2] % name
+                          for name in column.categories]
+            else:
+                values = [STRING_FORMATS[key] % value
+                          for value in column.categories]
+            columns.append(np.array(values, dtype=object)[
+                column.codes[rows]].tolist())
+        return list(map(TABLE_ATOM_FORMAT.__mod__, zip(*columns)))
+
+    def write_order(self, ter):
+        """
+        Indices into atoms+ter in the order pdb_utils.Pdb writes them: by
+        resSeq, record and serial, atoms without serial last
+        """
+        records = self.columns['record'].categories
+        # Ranks of the record names in string order
+        ranks = {record: rank for rank, record in enumerate(
+            sorted(set(records) | {entry['record'] for entry in ter}))}
+        record = np.array([ranks[value] for value in records],
+                          dtype=np.int64)[self.columns['record'].codes[
+                              self.rows()]]
+        record = np.concatenate([record, np.array(
+            [ranks[entry['record']] for entry in ter], dtype=np.int64)])
+        resSeq = np.concatenate([self.column('resSeq'), np.array(
+            [entry['resSeq'] for entry in ter], dtype=np.int64)])
+        serial = np.concatenate([self.column('serial'), np.array(
+            [entry['serial'] or 0 for entry in ter], dtype=np.int64)])
+        serial = np.where(serial == 0, 99999999, serial)
+        # lexsort is stable like sorted, its last key is the primary one
+        return np.lexsort((serial, record, resSeq)).tolist()
+
+    def to_tuples(self):
+        """List of (value, ...) tuples of all atoms, in ATOM_KEYS order"""
+        return list(zip(*[self.column(key).tolist() for key in ATOM_KEYS]))
+
+    def to_atoms(self):
+        """List of plain atom dicts"""
+        return [dict(zip(ATOM_KEYS, values)) for values in self.to_tuples()]
+
+
+class AtomView(MutableMapping):
+    """Dict-like view of a single atom of an AtomTable"""
+
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, key):
+        try:
+            return self.table.get_value(self.row, key)
+        except (KeyError, ValueError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.table.set_value(self.row, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError("Atom fields cannot be deleted")
+
+    def __iter__(self):
+        return iter(ATOM_KEYS)
+
+    def __len__(self):
+        return len(ATOM_KEYS)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return dict(self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+# Binary cache files: prefix (magic, format version, length of the JSON
+# header), JSON header and arrays, each starting at a multiple of
+# CACHE_ALIGNMENT bytes from the start of the file
+CACHE_MAGIC = b'PDBTABLE'
+CACHE_VERSION = 1
+CACHE_PREFIX = struct.Struct('<8sIQ')
+CACHE_ALIGNMENT = 64
+
+
+def write_cache(file, table, metadata=None):
+    """
+    Writes table and JSON-serializable metadata to the binary file (opened
+    for writing bytes). Removed atoms are left out.
+    """
+    rows = table.rows()
+    arrays = {'coords': table.coords[rows]}
+    categories = {}
+    for key, column in table.columns.items():
+        if key in STRING_KEYS:
+            arrays[key] = column.codes[rows]
+            categories[key] = column.categories
+        else:
+            arrays[key] = column[rows]
+
+    entries = {}
+    offset = 0
+    for key, array in arrays.items():
+        array = arrays[key] = np.ascontiguousarray(
+            array, dtype=array.dtype.newbyteorder('<'))
+        entries[key] = {'dtype': array.dtype.str, 'shape': array.shape,
+                        'offset': offset}
+        offset = aligned(offset + array.nbytes)
+    header = json.dumps({'arrays': entries, 'categories': categories,
+                         'signature': table.signature,
+                         'metadata': metadata}).encode()
+
+    file.write(CACHE_PREFIX.pack(CACHE_MAGIC, CACHE_VERSION, len(header)))
+    file.write(header)
+    position = CACHE_PREFIX.size + len(header)
+    for key, array in arrays.items():
+        start = aligned(CACHE_PREFIX.size + len(header)) + \
+            entries[key]['offset']
+        file.write(b'\0' * (start - position))
+        file.write(array.tobytes())
+        position = start + array.nbytes
+
+
+def read_cache(filename):
+    """
+    (AtomTable, metadata) written by write_cache. The file is memory-mapped
+    and the columns of the table are read-only arrays backed by the map,
+    copied only when they are modified. Raises ValueError if filename is
+    not a cache file of this version.
+    """
+    check_numpy()
+    with open(filename, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) < CACHE_PREFIX.size:
+        raise ValueError("{} is not a PDB cache file".format(filename))
+    magic, version, length = CACHE_PREFIX.unpack_from(buffer)
+    if magic != CACHE_MAGIC:
+        raise ValueError("{} is not a PDB cache file".format(filename))
+    if version != CACHE_VERSION:
+        raise ValueError("{} has cache format version {}, expected {}"
+                         .format(filename, version, CACHE_VERSION))
+    header = json.loads(buffer[CACHE_PREFIX.size:
+                               CACHE_PREFIX.size + length])
+    start = aligned(CACHE_PREFIX.size + length)
+
+    def array(key):
+        entry = header['arrays'][key]
+        shape = tuple(entry['shape'])
+        return np.frombuffer(buffer, dtype=entry['dtype'],
+                             count=int(np.prod(shape)),
+                             offset=start + entry['offset']).reshape(shape)
+
+    columns = {key: (Categorical(array(key), header['categories'][key])
+                     if key in STRING_KEYS else array(key))
+               for key in header['arrays'] if key != 'coords'}
+    table = AtomTable(columns, array('coords'))
+    table.signature = header['signature']
+    # The arrays are read-only, copy them on write
+    table._shared = set(columns) | {'coords'}
+    return table, header['metadata']
+
+
+def aligned(offset):
+    return -(-offset // CACHE_ALIGNMENT) * CACHE_ALIGNMENT
+
+
+# Fixed-width (start, end) columns of ATOM/HETATM records, see
+# http://www.wwpdb.org/documentation/file-format-content/format33/sect9.html
+STRING_COLUMNS = {'record': (0, 6), 'name': (12, 16), 'altLoc': (16, 17),
+                  'resName': (17, 20), 'chainID': (21, 22), 'iCode': (26, 27),
+                  'element': (76, 78), 'charge': (78, 80)}
+# (start, end, decimals) of numeric columns
+NUMBER_COLUMNS = {'serial': (6, 11, 0), 'resSeq': (22, 26, 0),
+                  'x': (30, 38, 3), 'y': (38, 46, 3), 'z': (46, 54, 3),
+                  'occupancy': (54, 60, 2), 'tempFactor': (60, 66, 2)}
+EXTRAS_START = 80
+# Columns of everything but the coordinates, which models sharing their
+# topology have in common, see parse_pdb_buffer
+TOPOLOGY_COLUMNS = ((0, 30), (54, EXTRAS_START))
+RECORD_KEYS = {b'ATOM  ': 'atoms', b'HETATM': 'atoms',
+               b'TER   ': 'ter', b'CONECT': 'conect'}
+
+
+def parse_pdb_buffer(buffer, dtype=None, topology=None):
+    """
+    Parses a whole PDB file held in buffer (bytes, mmap, ...) at once.
+    Line boundaries and record names are found with array operations and
+    every fixed-width ATOM/HETATM column is decoded for all atoms in a
+    single conversion. Returns (AtomTable, ter_lines, conect_lines,
+    other_lines) where the *_lines are lists of str including newlines.
+    If topology (a table returned before, e.g. for the first model of an
+    ensemble) has the same atom records apart from the coordinates, only
+    the coordinates are decoded and the table returned is a view of
+    topology with its own coordinates.
+    """
+    check_numpy()
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if (data == ord('\r')).any():
+        # Same universal newlines translation as files opened in text mode
+        data = np.frombuffer(bytes(data).replace(b'\r\n', b'\n')
+                             .replace(b'\r', b'\n'), dtype=np.uint8)
+
+    ends = np.flatnonzero(data == ord('\n')) + 1
+    if len(data) and data[-1] != ord('\n'):
+        ends = np.append(ends, len(data))
+    starts = np.concatenate(([0], ends[:-1])).astype(np.intp)
+    lengths = ends - starts - (data[ends - 1] == ord('\n'))
+
+    record_names, record_codes = unique_strings(
+        fixed_width_block(data, starts, lengths, 6))
+    line_keys = np.array([RECORD_KEYS.get(name, 'other')
+                          for name in record_names] or ['other'])[record_codes]
+
+    def lines(key):
+        selected = line_keys == key
+        return [bytes(data[start:end]).decode()
+                for start, end in zip(starts[selected], ends[selected])]
+
+    is_atom = line_keys == 'atoms'
+    atom_lengths = lengths[is_atom]
+    block = fixed_width_block(data, starts[is_atom], atom_lengths,
+                              EXTRAS_START)
+    extras = extras_column(data, starts[is_atom], ends[is_atom],
+                           atom_lengths)
+    digest = hashlib.sha1()
+    for start, end in TOPOLOGY_COLUMNS:
+        digest.update(np.ascontiguousarray(block[:, start:end]).tobytes())
+    digest.update(extras.codes.tobytes())
+    digest.update(json.dumps(extras.categories).encode())
+    signature = digest.hexdigest()
+    float_dtype = dtype or np.float64
+    coords = np.stack([decode_number(block[:, start:end], decimals)
+                       for start, end, decimals in
+                       map(NUMBER_COLUMNS.get, COORD_KEYS)],
+                      axis=1).astype(float_dtype).reshape(-1, 3)
+    if topology is not None and topology.signature == signature:
+        return (topology.view(coords=coords),
+                lines('ter'), lines('conect'), lines('other'))
+
+    columns = {key: Categorical(*reversed(unique_strings(block[:, start:end],
+                                                         strip=True)))
+               for key, (start, end) in STRING_COLUMNS.items()}
+    columns['extras'] = extras
+
+    numbers = {key: decode_number(block[:, start:end], decimals)
+               for key, (start, end, decimals) in NUMBER_COLUMNS.items()
+               if key not in COORD_KEYS}
+    columns.update({key: numbers[key].astype(np.int32) for key in INT_KEYS})
+    columns.update({key: numbers[key].astype(float_dtype)
+                    for key in FLOAT_KEYS})
+
+    table = AtomTable(columns, coords)
+    table.signature = signature
+    return table, lines('ter'), lines('conect'), lines('other')
+
+
+def fixed_width_block(data, starts, lengths, width):
+    """
+    (lines, width) array with the first width characters of every line.
+    Characters beyond the end of a line are read as spaces. data (e.g. a
+    memory-mapped file) is not copied, only lines less than width bytes
+    before its end are read from a padded copy of the end.
+    """
+    block = np.empty((len(starts), width), dtype=np.uint8)
+    inside = starts <= len(data) - width
+    if inside.any():
+        windows = np.lib.stride_tricks.sliding_window_view(data, width)
+        block[inside] = windows[starts[inside]]
+    outside = np.flatnonzero(~inside)
+    if len(outside):
+        offset = max(len(data) - width, 0)
+        tail = np.concatenate((data[offset:],
+                               np.full(width, ord(' '), dtype=np.uint8)))
+        windows = np.lib.stride_tricks.sliding_window_view(tail, width)
+        block[outside] = windows[starts[outside] - offset]
+    short = np.flatnonzero(lengths < width)
+    if len(short):
+        offsets = np.arange(width)
+        block[short] = np.where(offsets < lengths[short, None], block[short],
+                                ord(' '))
+    return block
+
+
+def unique_strings(chars, strip=False):
+    """
+    Distinct rows of a (lines, width) character array as a list of bytes
+    (or stripped str if strip) together with the code of every row.
+    Rows are packed into integers, which are much faster to sort than
+    strings.
+    """
+    width = chars.shape[1]
+    packed = np.zeros((len(chars), 8), dtype=np.uint8)
+    packed[:, :width] = chars
+    values, codes = np.unique(packed.view(np.uint64).ravel(),
+                              return_inverse=True)
+    raw = [value.tobytes()[:width] for value in values]
+    if not strip:
+        return raw, codes.ravel()
+    lookup = {}
+    remap = np.array([lookup.setdefault(value.decode().strip(), len(lookup))
+                      for value in raw], dtype=np.int32)
+    return list(lookup), remap[codes.ravel()]
+
+
+def extras_column(data, starts, ends, lengths):
+    """Categorical of everything after column 80 (newline included)"""
+    extras = Categorical(np.zeros(len(starts), dtype=np.int32), ['\n'])
+    for row in np.flatnonzero(lengths > EXTRAS_START):
+        extras[row] = bytes(data[starts[row] + EXTRAS_START:
+                                 ends[row]]).decode()
+    return extras
+
+
+def decode_number(chars, decimals):
+    """
+    Decodes a (lines, width) character array of right-aligned fixed-point
+    numbers with the given number of decimals as integer digit arithmetic.
+    Anything unexpected (exponents, misplaced decimal points, hybrid-36
+    serials, ...) falls back to NumPy's string conversion.
+    """
+    width = chars.shape[1]
+    digits = chars - np.uint8(ord('0'))
+    is_digit = digits < 10
+    exponents = np.arange(width - 1, -1, -1) - (decimals > 0)
+    if decimals:
+        point = width - decimals - 1
+        exponents[point:] += 1
+        is_digit[:, point] = chars[:, point] == ord('.')
+    is_minus = chars == ord('-')
+    if not (is_digit | is_minus | (chars == ord(' ')) |
+            (chars == ord('+'))).all():
+        fallback = np.ascontiguousarray(chars).view(
+            'S{}'.format(width)).ravel()
+        blank = (chars == ord(' ')).all(axis=1)
+        return np.where(blank, b'0', fallback).astype(
+            np.float64 if decimals else np.int64)
+
+    # Digit sums stay far below 2**53, so float arithmetic is exact here
+    weights = 10.0 ** exponents
+    if decimals:
+        weights[point] = 0
+    value = np.where(is_digit, digits, 0).astype(np.float64) @ weights
+    value = np.where(is_minus.any(axis=1), -value, value)
+    return value / 10 ** decimals if decimals else value.astype(np.int64)
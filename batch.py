@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import json
+import os
+import time
+import traceback
+import prep
+import utils
+
+SUMMARY_FIELDS = ['name', 'pdb', 'ligand', 'charge', 'status', 'wall_time',
+                  'error']
+
+
+def read_manifest(file, filename=''):
+    """
+    List of job dicts (pdb, ligand, charge, params, name) read from a CSV
+    file with a header row or a JSON list of objects. params may be a dict
+    of per-job overrides or the name of a JSON file with them. Relative
+    paths are relative to the manifest.
+    """
+    if filename.endswith('.json'):
+        entries = json.load(file)
+    else:
+        entries = [{key: value for key, value in row.items() if value}
+                   for row in csv.DictReader(file)]
+
+    base = os.path.dirname(os.path.abspath(filename))
+    jobs = []
+    names = set()
+    for entry in entries:
+        job = {'pdb': os.path.join(base, entry['pdb']),
+               'ligand': entry['ligand'],
+               'charge': int(entry['charge']),
+               'params': entry.get('params') or {}}
+        if not isinstance(job['params'], dict):
+            with open(os.path.join(base, job['params'])) as f:
+                job['params'] = json.load(f)
+        name = entry.get('name') or os.path.splitext(
+            os.path.basename(entry['pdb']))[0]
+        if name in names:
+            raise ValueError("Duplicate job name {} in manifest. Use the "
+                             "'name' column to tell jobs apart.".format(name))
+        names.add(name)
+        job['name'] = name
+        jobs.append(job)
+    return jobs
+
+
+def run_job(job, output_directory, params=None):
+    """
+    Runs prep.run for job in output_directory/<name>, logging its output
+    to output_directory/<name>.log. Returns a summary dict.
+    """
+    result = {key: job[key] for key in ['name', 'pdb', 'ligand', 'charge']}
+    job_params = utils.merge_dicts_of_dicts(params or {}, job['params'])
+    start = time.time()
+    log_name = os.path.join(output_directory, job['name'] + '.log')
+    with open(log_name, 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            prep.run(job['pdb'], job['ligand'], job['charge'], job_params,
+                     os.path.join(output_directory, job['name']))
+            result['status'] = 'ok'
+            result['error'] = ''
+        except Exception as e:
+            traceback.print_exc(file=log)
+            result['status'] = 'failed'
+            result['error'] = "{}: {}".format(type(e).__name__, e)
+    result['wall_time'] = round(time.time() - start, 2)
+    return result
+
+
+def run_batch(jobs, output_directory, params=None, workers=None):
+    """
+    Runs jobs in a pool of worker processes. Every job gets its own
+    process (and therefore its own working directory). Returns the list
+    of summary dicts in the order of jobs.
+    """
+    output_directory = os.path.abspath(output_directory)
+    os.makedirs(output_directory, exist_ok=True)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(run_job, job, output_directory, params)
+                   for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            print("{name}: {status} ({wall_time:.1f} s)".format(**result))
+        return [future.result() for future in futures]
+
+
+def write_summary(results, file):
+    writer = csv.DictWriter(file, SUMMARY_FIELDS)
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs prep.py for every system listed in a manifest "
+                    "(CSV with pdb,ligand,charge[,params,name] columns or a "
+                    "JSON list of objects with the same keys) in parallel."
+    )
+    parser.add_argument("manifest", help="CSV or JSON manifest file")
+    parser.add_argument("-o", "--output", default="batch",
+                        help="directory for the job directories and summary")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="number of parallel jobs (default: all cores)")
+    parser.add_argument("-p", "--params", type=argparse.FileType(),
+                        help="JSON file with parameters for all jobs")
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        jobs = read_manifest(f, args.manifest)
+    params = None
+    if args.params is not None:
+        params = json.load(args.params)
+        args.params.close()
+
+    start = time.time()
+    results = run_batch(jobs, args.output, params, args.workers)
+    with open(os.path.join(args.output, 'summary.csv'), 'w') as f:
+        write_summary(results, f)
+
+    failed = [result for result in results if result['status'] != 'ok']
+    print("Finished {} jobs ({} failed) in {:.1f} s. Summary written to {}."
+          .format(len(results), len(failed), time.time() - start,
+                  os.path.join(args.output, 'summary.csv')))
+
+
+if __name__ == '__main__':
+    main()
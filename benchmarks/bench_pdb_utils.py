@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of pdb_utils on synthetic structures (see
+benchmarks/synthetic.py) of increasing size.
+
+Every operation is timed (best of --repeat runs) and run once more under
+tracemalloc for its peak memory. Results can be saved as a named baseline
+in benchmarks/baselines and later runs compared against it:
+
+    python -m benchmarks.bench_pdb_utils --save before
+    python -m benchmarks.bench_pdb_utils --compare before
+
+Run from the repository root.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import pdb_utils
+from benchmarks import synthetic
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'baselines')
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+REMOVED_ATOMS = 100
+
+
+def parse(filename, backend):
+    if backend == 'columnar':
+        return pdb_utils.Pdb.from_filename(filename, columnar=True)
+    with open(filename) as f:
+        return pdb_utils.Pdb(f)
+
+
+def owned(pdb, backend):
+    """New Pdb (of backend) with the atoms of pdb and no indices"""
+    return pdb_utils.Pdb(atoms=pdb.atoms, ter=pdb.ter, conect=pdb.conect,
+                         other=pdb.other, columnar=backend == 'columnar')
+
+
+def indexed_copy(pdb):
+    """Copy of pdb with its residue index built"""
+    copy = pdb.copy()
+    copy.residues()
+    return copy
+
+
+def modified_copy(pdb):
+    """Copy of pdb with one atom modified (copies the modified column)"""
+    copy = pdb.copy()
+    pdb_utils.modify_atoms(copy.atoms[:1], 'tempFactor', 0.0)
+    return copy
+
+
+# name: (setup(pdb, filename, backend) -> argument, run(argument),
+#        number of items processed, given the number of atoms)
+OPERATIONS = {
+    'parse': (lambda pdb, filename, backend: (filename, backend),
+              lambda args: parse(*args),
+              lambda n_atoms: n_atoms),
+    'residues': (lambda pdb, filename, backend: owned(pdb, backend),
+                 lambda pdb: pdb.residues(),
+                 lambda n_atoms: n_atoms),
+    'get_residues_by_name': (
+        lambda pdb, filename, backend: indexed_copy(pdb),
+        lambda pdb: [pdb.get_residues_by_name(name)
+                     for name in list(synthetic.RESIDUES) + ['LIG', 'HOH']],
+        lambda n_atoms: n_atoms),
+    'to_file': (lambda pdb, filename, backend: pdb,
+                lambda pdb: pdb.to_file(io.StringIO()),
+                lambda n_atoms: n_atoms),
+    'copy': (lambda pdb, filename, backend: pdb,
+             lambda pdb: pdb.copy(),
+             lambda n_atoms: n_atoms),
+    'copy_modify': (lambda pdb, filename, backend: pdb,
+                    modified_copy,
+                    lambda n_atoms: n_atoms),
+    'remove_atom': (
+        lambda pdb, filename, backend: modified_copy(pdb),
+        lambda pdb: [pdb.remove_atom(pdb.atoms[len(pdb.atoms) // 2])
+                     for _ in range(REMOVED_ATOMS)],
+        lambda n_atoms: REMOVED_ATOMS),
+}
+
+
+def measure(operation, pdb, filename, backend, repeat):
+    """(best wall time in s, peak traced memory in bytes) of operation"""
+    setup, run, _ = OPERATIONS[operation]
+    times = []
+    for _ in range(repeat):
+        argument = setup(pdb, filename, backend)
+        start = time.perf_counter()
+        run(argument)
+        times.append(time.perf_counter() - start)
+    argument = setup(pdb, filename, backend)
+    tracemalloc.start()
+    try:
+        run(argument)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def run_benchmarks(sizes, backends, operations=None, repeat=3,
+                   data_directory=None, log=None):
+    """List of result dicts of operations for every size and backend"""
+    operations = operations or list(OPERATIONS)
+    results = []
+    with tempfile.TemporaryDirectory() as temporary:
+        data_directory = data_directory or temporary
+        os.makedirs(data_directory, exist_ok=True)
+        for size in sizes:
+            filename = os.path.join(data_directory,
+                                    'synthetic_{}.pdb'.format(size))
+            if not os.path.isfile(filename):
+                synthetic.write_synthetic(filename, size)
+            for backend in backends:
+                pdb = parse(filename, backend)
+                for operation in operations:
+                    seconds, peak = measure(operation, pdb, filename,
+                                            backend, repeat)
+                    items = OPERATIONS[operation][2](size)
+                    result = {
+                        'operation': operation,
+                        'backend': backend,
+                        'atoms': size,
+                        'seconds': seconds,
+                        'throughput': items / seconds if seconds else None,
+                        'peak_mb': peak / 2 ** 20
+                    }
+                    results.append(result)
+                    if log is not None:
+                        log(format_result(result))
+    return results
+
+
+def format_result(result):
+    return "{:<22}{:<10}{:>9}{:>12.4f} s{:>14} /s{:>10.1f} MB".format(
+        result['operation'], result['backend'], result['atoms'],
+        result['seconds'],
+        '{:.3g}'.format(result['throughput'])
+        if result['throughput'] else '-', result['peak_mb'])
+
+
+def environment():
+    """Description of the machine and code the results were measured on"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': getattr(pdb_utils.atom_table.np, '__version__', None),
+        'machine': platform.platform(),
+    }
+
+
+def compare(results, baseline, threshold=1.2, min_seconds=0.001):
+    """
+    (report lines, regressions) of results against baseline results.
+    A regression is an operation that takes threshold times the time or
+    memory of the baseline. Operations faster than min_seconds are too
+    noisy to count as slower.
+    """
+    old = {(entry['operation'], entry['backend'], entry['atoms']): entry
+           for entry in baseline}
+    lines = ["{:<22}{:<10}{:>9}{:>10}{:>10}".format(
+        'operation', 'backend', 'atoms', 'time', 'memory')]
+    regressions = []
+    for entry in results:
+        key = (entry['operation'], entry['backend'], entry['atoms'])
+        if key not in old:
+            continue
+        ratios = [entry[field] / old[key][field] if old[key][field] else 1.0
+                  for field in ['seconds', 'peak_mb']]
+        regressed = ((ratios[0] > threshold and
+                      entry['seconds'] >= min_seconds) or
+                     ratios[1] > threshold)
+        if regressed:
+            regressions.append(key)
+        lines.append("{:<22}{:<10}{:>9}{:>9.2f}x{:>9.2f}x{}".format(
+            *key, *ratios, '  REGRESSION' if regressed else ''))
+    return lines, regressions
+
+
+def baseline_path(name):
+    return os.path.join(BASELINES, name + '.json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=lambda text: [
+        int(size) for size in text.split(',')], default=DEFAULT_SIZES,
+        help="comma-separated numbers of atoms")
+    parser.add_argument('--backends', default='list,columnar',
+                        help="comma-separated Pdb backends (list, columnar)")
+    parser.add_argument('--operations',
+                        help="comma-separated operations, of: " +
+                             ', '.join(OPERATIONS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--data', help="directory keeping the synthetic "
+                                       "PDB files between runs")
+    parser.add_argument('--output', help="JSON file for the results")
+    parser.add_argument('--save', metavar='NAME',
+                        help="save the results as baseline NAME")
+    parser.add_argument('--compare', metavar='NAME',
+                        help="compare the results with baseline NAME")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="slowdown counted as a regression")
+    args = parser.parse_args()
+    baseline = None
+    if args.compare:
+        if not os.path.isfile(baseline_path(args.compare)):
+            parser.error("no baseline {} in {}".format(args.compare,
+                                                       BASELINES))
+        with open(baseline_path(args.compare)) as f:
+            baseline = json.load(f)
+
+    backends = args.backends.split(',')
+    if pdb_utils.atom_table.np is None and 'columnar' in backends:
+        print("numpy is not installed, skipping the columnar backend")
+        backends.remove('columnar')
+    results = run_benchmarks(
+        args.sizes, backends,
+        args.operations.split(',') if args.operations else None,
+        args.repeat, args.data, log=print)
+    report = {'environment': environment(), 'results': results}
+    for filename in [args.output,
+                     args.save and baseline_path(args.save)]:
+        if filename:
+            os.makedirs(os.path.dirname(os.path.abspath(filename)),
+                        exist_ok=True)
+            with open(filename, 'w') as f:
+                json.dump(report, f, indent=2)
+    if baseline is not None:
+        lines, regressions = compare(results, baseline['results'],
+                                     args.threshold)
+        print("\nCompared with {} ({})".format(
+            args.compare, baseline['environment'].get('commit')))
+        print('\n'.join(lines))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of prep.py and batch.py with the stand-in tools of
+benchmarks/fake_tools.py, so it runs without AMBER.
+
+Every scenario runs prep (or a batch of prep jobs) as a subprocess and
+reads the timings.json it writes. Reported are the wall time, the time
+spent in the tools and in Python, the pipeline overhead (wall time beyond
+the critical path of tool time) and how well concurrent stages and batch
+workers are used:
+
+    python -m benchmarks.bench_pipeline [--scale 0.5] [--jobs 8 -j 4]
+
+Run from the repository root.
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks import fake_tools
+from benchmarks.bench_pdb_utils import environment
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = (os.path.join(ROOT, 'examples', '1btl_0rn.pdb'), '0RN', -1)
+# Stages of prep that run one after the other, see prep.build_pipeline
+STAGE_PATHS = [['antechamber', 'tleap'], ['reduce', 'propka', 'tleap']]
+# propka31 (fake) instead of the propka Python API, everything rerun
+BASE_PARAMS = {'propka': {'in_process': False},
+               'pipeline': {'incremental': False}}
+SCENARIOS = {
+    'single': {},
+    'sequential': {'pipeline': {'workers': 1}},
+    'stream': {'pipeline': {'stream': True}},
+    'pool': {'tleap': {'pool_workers': 1}},
+    'batch': {},
+}
+
+
+def merge(*params):
+    """Parameter overrides merged like utils.merge_dicts_of_dicts"""
+    merged = {}
+    for overrides in params:
+        for key, values in overrides.items():
+            merged[key] = dict(merged.get(key, {}), **values)
+    return merged
+
+
+def analyse(timings, wall_time):
+    """Metrics of one prep run from its timings.json contents"""
+    stages = timings['stages']
+    tool_time = {}
+    for stage in stages:
+        # Piped or concurrent commands of a stage overlap
+        tool_time[stage['name']] = tool_time.get(stage['name'], 0.0) + min(
+            sum(command['wall_time'] for command in stage['commands']),
+            stage['wall_time'])
+    critical_path = max(sum(tool_time.get(name, 0.0) for name in path)
+                        for path in STAGE_PATHS)
+    return {
+        'wall_time': wall_time,
+        # Interpreter start, imports and reading the input
+        'startup': max(wall_time - timings['wall_time'], 0.0),
+        'tool_time': sum(tool_time.values()),
+        'tool_cpu': sum(stage['child_cpu_time'] for stage in stages),
+        'python_cpu': timings['cpu_time'],
+        'python_steps': sum(step['wall_time'] for stage in stages
+                            for step in stage['steps']),
+        'critical_path': critical_path,
+        'overhead': wall_time - critical_path,
+        # Average number of stages running at the same time
+        'parallelism': (sum(stage['wall_time'] for stage in stages) /
+                        timings['wall_time'] if timings['wall_time']
+                        else 0.0),
+    }
+
+
+def run_prep(directory, env, params, example=EXAMPLE):
+    """analyse of prep.py run on example in directory with params"""
+    os.makedirs(directory, exist_ok=True)
+    params_file = os.path.join(directory, 'params.json')
+    with open(params_file, 'w') as f:
+        json.dump(params, f)
+    pdb, ligand, charge = example
+    # prep works in a directory named after the pdb file next to it
+    shutil.copy(pdb, directory)
+    pdb = os.path.basename(pdb)
+    log = os.path.join(directory, 'prep.log')
+    start = time.monotonic()
+    with open(log, 'w') as f:
+        result = subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'prep.py'), pdb, ligand,
+             str(charge), params_file],
+            cwd=directory, env=env, stdout=f, stderr=subprocess.STDOUT)
+    wall_time = time.monotonic() - start
+    if result.returncode != 0:
+        raise RuntimeError("prep failed, see {}".format(log))
+    name = os.path.splitext(pdb)[0]
+    with open(os.path.join(directory, name, 'timings.json')) as f:
+        return analyse(json.load(f), wall_time)
+
+
+def run_batch(directory, env, params, jobs, workers, example=EXAMPLE):
+    """Metrics of batch.py running jobs copies of example on workers"""
+    os.makedirs(directory, exist_ok=True)
+    pdb, ligand, charge = example
+    manifest = os.path.join(directory, 'manifest.json')
+    with open(manifest, 'w') as f:
+        json.dump([{'pdb': pdb, 'ligand': ligand, 'charge': charge,
+                    'name': 'job_{}'.format(index), 'params': params}
+                   for index in range(jobs)], f)
+    output = os.path.join(directory, 'batch')
+    log = os.path.join(directory, 'batch.log')
+    start = time.monotonic()
+    with open(log, 'w') as f:
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'batch.py'), manifest,
+             '-o', output, '-j', str(workers)],
+            cwd=directory, env=env, stdout=f, stderr=subprocess.STDOUT,
+            check=True)
+    wall_time = time.monotonic() - start
+    with open(os.path.join(output, 'summary.csv')) as f:
+        summary = list(csv.DictReader(f))
+    failed = [entry['name'] for entry in summary if entry['status'] != 'ok']
+    if failed:
+        raise RuntimeError("batch jobs {} failed, see {}"
+                           .format(', '.join(failed), output))
+    runs = []
+    for entry in summary:
+        with open(os.path.join(output, entry['name'], 'timings.json')) as f:
+            runs.append(analyse(json.load(f), float(entry['wall_time'])))
+    job_time = sum(run['wall_time'] for run in runs)
+    return {
+        'wall_time': wall_time,
+        'jobs': jobs,
+        'workers': workers,
+        'jobs_per_minute': 60 * jobs / wall_time,
+        'job_wall_time': job_time / jobs,
+        'job_overhead': sum(run['overhead'] for run in runs) / jobs,
+        # Share of the workers' time spent running jobs
+        'utilisation': job_time / (wall_time * workers),
+        # Average number of tools running at the same time
+        'tool_concurrency': sum(run['tool_time'] for run in runs) / wall_time,
+    }
+
+
+def run_scenarios(scenarios, directory, scale=1.0, profile=None, params=None,
+                  repeat=1, jobs=4, workers=2, log=None):
+    """dict of scenario: metrics (of the fastest of repeat runs)"""
+    env = dict(os.environ, **fake_tools.install(
+        os.path.join(directory, 'amber'), profile, scale))
+    results = {}
+    for scenario in scenarios:
+        scenario_params = merge(BASE_PARAMS, SCENARIOS[scenario],
+                                params or {})
+        runs = []
+        for index in range(repeat):
+            run_directory = os.path.join(directory, '{}_{}'.format(
+                scenario, index))
+            if scenario == 'batch':
+                runs.append(run_batch(run_directory, env, scenario_params,
+                                      jobs, workers))
+            else:
+                runs.append(run_prep(run_directory, env, scenario_params))
+        results[scenario] = min(runs, key=lambda run: run['wall_time'])
+        if log is not None:
+            log(format_metrics(scenario, results[scenario]))
+    return results
+
+
+def format_metrics(scenario, metrics):
+    return "{:<12}".format(scenario) + "  ".join(
+        "{} {}".format(key, '{:.2f}'.format(value)
+                       if isinstance(value, float) else value)
+        for key, value in metrics.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help="comma-separated scenarios, of: " +
+                             ', '.join(SCENARIOS))
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="factor for all delays and CPU times of the "
+                             "fake tools")
+    parser.add_argument('--profile', type=argparse.FileType(),
+                        help="JSON file with tool costs overriding "
+                             "fake_tools.DEFAULT_PROFILE")
+    parser.add_argument('--params', type=argparse.FileType(),
+                        help="JSON file with prep parameters for all runs")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--jobs', type=int, default=4,
+                        help="number of jobs of the batch scenario")
+    parser.add_argument('-j', '--workers', type=int, default=2,
+                        help="batch workers")
+    parser.add_argument('--directory', help="keep the runs in directory")
+    parser.add_argument('--output', help="JSON file for the results")
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(',')
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error("unknown scenarios: " + ', '.join(sorted(unknown)))
+    profile = json.load(args.profile) if args.profile else None
+    params = json.load(args.params) if args.params else None
+    print("{} CPUs".format(os.cpu_count()))
+    with tempfile.TemporaryDirectory() as temporary:
+        results = run_scenarios(scenarios, args.directory or temporary,
+                                args.scale, profile, params, args.repeat,
+                                args.jobs, args.workers, log=print)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': dict(environment(),
+                                           cpus=os.cpu_count()),
+                       'scale': args.scale, 'results': results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
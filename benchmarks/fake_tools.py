@@ -0,0 +1,355 @@
+"""
+Deterministic stand-ins for the AmberTools executables and propka31, to run
+the prep pipeline on a machine without AMBER.
+
+install writes antechamber, parmchk2, pdb4amber, reduce and tleap into
+<home>/bin (used as $AMBERHOME) and propka31 next to them (to be put on
+$PATH). Every tool waits for its configured delay and burns its CPU time,
+then writes output files in the format of the real tool: reduce and
+propka31 return the outputs of tests/test_files, the others derive theirs
+from their input. tleap interprets the commands prep uses (including
+interactive use by tleap_pool) and writes topologies that prmtop.verify
+accepts.
+Only the standard library is used, so tools start as fast as Python can.
+"""
+import json
+import math
+import os
+import shlex
+import stat
+import sys
+import time
+
+TOOLS = ['antechamber', 'parmchk2', 'pdb4amber', 'reduce', 'propka31',
+         'tleap']
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tests', 'test_files')
+# Seconds of waiting (I/O, startup) and CPU time spent by every run of a
+# tool. tleap spends them on every saveamberparm, source_delay on every
+# source command (the force fields a warm tleap_pool worker keeps loaded)
+# and solvate_cpu on solvatecap.
+DEFAULT_PROFILE = {
+    'antechamber': {'delay': 0.2, 'cpu': 1.5},
+    'parmchk2': {'delay': 0.05, 'cpu': 0.05},
+    'pdb4amber': {'delay': 0.2, 'cpu': 0.1},
+    'reduce': {'delay': 0.1, 'cpu': 0.4},
+    'propka31': {'delay': 0.2, 'cpu': 0.8},
+    'tleap': {'delay': 0.05, 'cpu': 0.1, 'source_delay': 0.1,
+              'solvate_cpu': 0.3},
+}
+CONFIG_NAME = 'fake_tools.json'
+# Waters per cubic Angstrom, and the fraction left after removing clashes
+WATER_DENSITY = 0.0334
+WATER_KEPT = 0.6
+SCRIPT = """#!{python}
+# Stand-in for {tool}, see benchmarks/fake_tools.py
+import sys
+sys.path.insert(0, {root!r})
+from benchmarks import fake_tools
+sys.exit(fake_tools.main({tool!r}, sys.argv[1:]))
+"""
+
+
+def install(home, profile=None, scale=1.0):
+    """
+    Writes the fake tools to home/bin with the costs of profile (dict of
+    tool: overrides of DEFAULT_PROFILE) multiplied by scale. Returns the
+    environment variables (AMBERHOME, PATH) to run prep with them.
+    """
+    costs = {tool: dict(values) for tool, values in DEFAULT_PROFILE.items()}
+    for tool, values in (profile or {}).items():
+        costs[tool].update(values)
+    costs = {tool: {key: value * scale for key, value in values.items()}
+             for tool, values in costs.items()}
+    bin_directory = os.path.join(home, 'bin')
+    os.makedirs(bin_directory, exist_ok=True)
+    with open(os.path.join(home, CONFIG_NAME), 'w') as f:
+        json.dump({'costs': costs, 'test_files': TEST_FILES}, f, indent=2)
+    library = os.path.join(home, 'dat', 'leap', 'lib', 'solvents.lib')
+    os.makedirs(os.path.dirname(library), exist_ok=True)
+    write_solvent_library(library)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for tool in TOOLS:
+        path = os.path.join(bin_directory, tool)
+        with open(path, 'w') as f:
+            f.write(SCRIPT.format(python=sys.executable, tool=tool,
+                                  root=root))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return {'AMBERHOME': os.path.abspath(home),
+            'PATH': os.path.abspath(bin_directory) + os.pathsep +
+            os.environ.get('PATH', '')}
+
+
+def write_solvent_library(filename, count=6, spacing=3.1):
+    """
+    OFF library with a TIP3PBOX of count**3 waters on a grid (about the
+    density of water), for the sphere_np template
+    """
+    water = [(0.0, 0.0, 0.0), (0.9572, 0.0, 0.0), (-0.24, 0.9266, 0.0)]
+    lines = ['!!index array str\n', ' "TIP3PBOX"\n',
+             '!entry.TIP3PBOX.unit.atoms table  str name  str type  '
+             'int typex  int resx  int flags  int seq  int elmnt  dbl chg\n']
+    positions = []
+    for index in range(count ** 3):
+        x, y, z = (index // count ** 2, index // count % count,
+                   index % count)
+        for (name, type, element, charge), (dx, dy, dz) in zip(
+                [('O', 'OW', 8, -0.834), ('H1', 'HW', 1, 0.417),
+                 ('H2', 'HW', 1, 0.417)], water):
+            lines.append(' "{}" "{}" 0 {} 131072 {} {} {:f}\n'.format(
+                name, type, index + 1, len(positions) + 1, element, charge))
+            positions.append(' {:f} {:f} {:f}\n'.format(
+                x * spacing + dx, y * spacing + dy, z * spacing + dz))
+    lines.append('!entry.TIP3PBOX.unit.boundbox array dbl\n')
+    lines += [' {:f}\n'.format(value)
+              for value in [1.0, 90.0] + [count * spacing] * 3 + [0.0]]
+    lines.append('!entry.TIP3PBOX.unit.positions table  dbl x  dbl y  '
+                 'dbl z\n')
+    with open(filename, 'w') as f:
+        f.writelines(lines + positions)
+
+
+def load_config(tool):
+    home = os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0])))
+    with open(os.path.join(home, CONFIG_NAME)) as f:
+        config = json.load(f)
+    return config['costs'].get(tool, {}), config['test_files']
+
+
+def spend(delay=0.0, cpu=0.0):
+    """Waits for delay seconds and then keeps the CPU busy for cpu seconds"""
+    time.sleep(delay)
+    end = time.process_time() + cpu
+    while time.process_time() < end:
+        sum(range(1000))
+
+
+def options(args):
+    """dict of -option: value of args"""
+    return {name: value for name, value in zip(args, args[1:])
+            if name.startswith('-')}
+
+
+def main(tool, args):
+    costs, test_files = load_config(tool)
+    return globals()['run_' + tool](args, costs, test_files) or 0
+
+
+def run_antechamber(args, costs, test_files):
+    opts = options(args)
+    spend(costs.get('delay', 0), costs.get('cpu', 0))
+    with open(opts['-i']) as f:
+        names = [line[12:16].strip() for line in f
+                 if line.startswith(('ATOM', 'HETATM'))]
+    lines = ["    0    0    2\n", "\n", "This is a remark line\n",
+             "molecule.res\n",
+             "{:<6}INT  0\n".format(opts.get('-rn', 'MOL')),
+             "CORRECT     OMIT DU   BEG\n", "  0.0000\n"]
+    lines += ["{:>4}  {:<4}  DU    M  {:>3} {:>3} {:>3}     0.000      "
+              "0.000      0.000     0.00000\n".format(
+                  index + 1, name, index, index - 1, index - 2)
+              for index, name in enumerate(['DUMM'] * 3 + names)]
+    lines += ["\n", "\n", "LOOP\n", "\n", "IMPROPER\n", "\n", "DONE\n",
+              "STOP\n"]
+    with open(opts['-o'], 'w') as f:
+        f.writelines(lines)
+    print("Info: Total number of electrons: 0; net charge: {}"
+          .format(opts.get('-nc', 0)))
+
+
+def run_parmchk2(args, costs, test_files):
+    opts = options(args)
+    spend(costs.get('delay', 0), costs.get('cpu', 0))
+    with open(opts['-o'], 'w') as f:
+        f.write("Remark line goes here\nMASS\n\nBOND\n\nANGLE\n\nDIHE\n\n"
+                "IMPROPER\n\nNONBON\n\n\n")
+
+
+def run_pdb4amber(args, costs, test_files):
+    """Splits the input into protein, non-protein residues and waters"""
+    opts = options(args)
+    if '-i' in opts:
+        with open(opts['-i']) as f:
+            lines = f.readlines()
+        output = open(opts['-o'], 'w')
+        prefix = os.path.splitext(opts['-o'])[0]
+    else:
+        lines = sys.stdin.readlines()
+        output = sys.stdout
+        prefix = 'stdout'
+    spend(costs.get('delay', 0), costs.get('cpu', 0))
+    atoms = [line for line in lines if line.startswith(('ATOM', 'HETATM'))]
+    waters = [line for line in atoms if line[17:20] == 'HOH']
+    nonprot = [line for line in atoms
+               if line.startswith('HETATM') and line[17:20] != 'HOH']
+    protein = [line for line in lines
+               if line[17:20] != 'HOH' and not (
+                   '--nohyd' in args and line.startswith(('ATOM', 'HETATM'))
+                   and line[76:78].strip() == 'H')]
+    for suffix, records in [('_water.pdb', waters),
+                            ('_nonprot.pdb', nonprot)]:
+        with open(prefix + suffix, 'w') as f:
+            f.writelines(records + ["END\n"])
+    output.writelines(protein)
+    if output is not sys.stdout:
+        output.close()
+    print("Summary of pdb4amber", file=sys.stderr)
+
+
+def run_reduce(args, costs, test_files):
+    """Writes the reduce output of tests/test_files to stdout"""
+    if args[-1:] == ['-']:
+        sys.stdin.read()
+    spend(costs.get('delay', 0), costs.get('cpu', 0))
+    with open(os.path.join(test_files, 'reduce.pdb')) as f:
+        sys.stdout.write(f.read())
+
+
+def run_propka31(args, costs, test_files):
+    """Writes the propka output of tests/test_files as <input>.pka"""
+    spend(costs.get('delay', 0), costs.get('cpu', 0))
+    with open(os.path.join(test_files, 'propka.pka')) as f:
+        results = f.read()
+    with open(os.path.splitext(args[0])[0] + '.pka', 'w') as f:
+        f.write(results)
+    print("propka3.1 (fake) finished")
+
+
+class Tleap(object):
+    """
+    Interpreter of the tleap commands used by prep's templates. A unit is a
+    list of residues (name, atom names).
+    """
+
+    def __init__(self, costs):
+        self.costs = costs
+        self.units = {}
+        self.log = sys.stdout
+
+    def run(self, line):
+        words = shlex.split(line.replace('{', ' { ').replace('}', ' } '))
+        if not words or words[0].startswith('#'):
+            return True
+        target = None
+        if words[1:2] == ['=']:
+            target, words = words[0], words[2:]
+        command, arguments = words[0].lower(), words[1:]
+        self.log.write("> {}\n".format(line.rstrip('\n')))
+        if command == 'quit':
+            return False
+        try:
+            result = getattr(self, command, self.other)(*arguments)
+        except (OSError, KeyError, ValueError) as e:
+            self.log.write("Error! {}: {}\n".format(command, e))
+            result = None
+        if target is not None:
+            self.units[target] = result
+        self.log.flush()
+        return True
+
+    def other(self, *arguments):
+        pass
+
+    def source(self, filename):
+        spend(self.costs.get('source_delay', 0))
+
+    def logfile(self, filename):
+        if self.log is not sys.stdout:
+            self.log.close()
+        self.log = open(filename, 'w')
+
+    def clearvariables(self):
+        self.units = {}
+
+    def loadpdb(self, filename):
+        residues = []
+        key = None
+        with open(filename) as f:
+            for line in f:
+                if not line.startswith(('ATOM', 'HETATM')):
+                    continue
+                if line[17:27] != key:
+                    key = line[17:27]
+                    residues.append((line[17:20].strip(), []))
+                residues[-1][1].append(line[12:16].strip())
+        return residues
+
+    def combine(self, *arguments):
+        return [residue for name in arguments if name not in '{}'
+                for residue in self.units[name]]
+
+    def solvatecap(self, unit, box, center, radius, closeness):
+        spend(0, self.costs.get('solvate_cpu', 0))
+        waters = int(WATER_DENSITY * WATER_KEPT * 4 / 3 * math.pi *
+                     float(radius) ** 3)
+        self.units[unit] = (self.units[unit] +
+                            [('WAT', ['O', 'H1', 'H2'])] * waters)
+
+    def saveoff(self, unit, filename):
+        with open(filename, 'w') as f:
+            json.dump({unit: self.units[unit]}, f)
+
+    def loadoff(self, filename):
+        with open(filename) as f:
+            self.units.update(json.load(f))
+
+    def savepdb(self, unit, filename):
+        lines = []
+        for index, (name, atoms) in enumerate(self.units[unit]):
+            lines += ["ATOM  %5d %-4s %3s  %4d       0.000   0.000   0.000"
+                      "  1.00  0.00\n" % (len(lines) % 99999 + 1,
+                                          ' ' + atom, name,
+                                          index % 9999 + 1)
+                      for atom in atoms]
+        with open(filename, 'w') as f:
+            f.writelines(lines + ["END\n"])
+
+    def saveamberparm(self, unit, top, rst):
+        spend(self.costs.get('delay', 0), self.costs.get('cpu', 0))
+        residues = self.units[unit]
+        names = [atom for _, atoms in residues for atom in atoms]
+        pointers = [len(names)] + [0] * 10 + [len(residues)] + [0] * 19
+        starts = [1]
+        for _, atoms in residues[:-1]:
+            starts.append(starts[-1] + len(atoms))
+        with open(top, 'w') as f:
+            f.write("%VERSION  VERSION_STAMP = V0001.000\n")
+            write_section(f, 'TITLE', '20a4', [unit], 1, '%-80s')
+            write_section(f, 'POINTERS', '10I8', pointers, 10, '%8d')
+            write_section(f, 'ATOM_NAME', '20a4', names, 20, '%-4s')
+            write_section(f, 'CHARGE', '5E16.8', [0.0] * len(names), 5,
+                          '%16.8E')
+            write_section(f, 'RESIDUE_LABEL', '20a4',
+                          [name for name, _ in residues], 20, '%-4s')
+            write_section(f, 'RESIDUE_POINTER', '10I8', starts, 10, '%8d')
+        with open(rst, 'w') as f:
+            f.write("{}\n{:6d}\n".format(unit, len(names)))
+            values = [0.0] * (3 * len(names))
+            for i in range(0, len(values), 6):
+                f.write(''.join('%12.7f' % value
+                                for value in values[i:i + 6]) + '\n')
+
+
+def write_section(file, name, format, values, per_line, field):
+    file.write("%FLAG {}\n%FORMAT({})\n".format(name, format))
+    for i in range(0, len(values), per_line):
+        file.write(''.join(field % value
+                           for value in values[i:i + per_line]) + '\n')
+    if not values:
+        file.write('\n')
+
+
+def run_tleap(args, costs, test_files):
+    """Runs the file given with -f, then the commands on stdin"""
+    tleap = Tleap(costs)
+    opts = options(args)
+    if '-f' in opts:
+        with open(opts['-f']) as f:
+            for line in f:
+                if not tleap.run(line):
+                    return
+    if sys.stdin is None or sys.stdin.isatty():
+        return
+    for line in sys.stdin:
+        if not tleap.run(line):
+            return
@@ -0,0 +1,101 @@
+"""
+Synthetic PDB files of any size for benchmarks.
+
+A structure is made of chains of amino acid residues (ATOM records, one TER
+per chain) with a ligand (HETATM records with CONECT records) bound to
+every chain, followed by crystal waters. Coordinates follow a random walk,
+so the atoms are spread like in a folded protein rather than on a grid.
+"""
+import random
+import string
+
+# Heavy atoms and hydrogens (as written by reduce) of a few residues
+RESIDUES = {
+    'ALA': ['N', 'CA', 'C', 'O', 'CB', 'H', 'HA', 'HB1', 'HB2', 'HB3'],
+    'GLY': ['N', 'CA', 'C', 'O', 'H', 'HA2', 'HA3'],
+    'SER': ['N', 'CA', 'C', 'O', 'CB', 'OG', 'H', 'HA', 'HB2', 'HB3', 'HG'],
+    'LEU': ['N', 'CA', 'C', 'O', 'CB', 'CG', 'CD1', 'CD2', 'H', 'HA', 'HB2',
+            'HB3', 'HG', 'HD11', 'HD12', 'HD13', 'HD21', 'HD22', 'HD23'],
+    'ASP': ['N', 'CA', 'C', 'O', 'CB', 'CG', 'OD1', 'OD2', 'H', 'HA', 'HB2',
+            'HB3'],
+    'LYS': ['N', 'CA', 'C', 'O', 'CB', 'CG', 'CD', 'CE', 'NZ', 'H', 'HA',
+            'HB2', 'HB3', 'HG2', 'HG3', 'HD2', 'HD3', 'HE2', 'HE3', 'HZ1',
+            'HZ2', 'HZ3'],
+}
+LIGAND = ('LIG', ['C1', 'C2', 'C3', 'C4', 'C5', 'C6', 'O1', 'N1', 'H1',
+                  'H2', 'H3', 'H4'])
+# Bonds of the ring and substituents of LIGAND, as 0-based atom indices
+LIGAND_BONDS = [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 0), (0, 6),
+                (3, 7), (1, 8), (2, 9), (4, 10), (5, 11)]
+CHAIN_IDS = string.ascii_uppercase + string.ascii_lowercase + string.digits
+# Atoms per chain; keeps residue numbers within the 4 digits of resSeq
+CHAIN_ATOMS = 20000
+WATER_FRACTION = 0.08
+ATOM_FORMAT = ("%-6s%5d %-4s %3s %1s%4d    %8.3f%8.3f%8.3f"
+               "  1.00%6.2f          %2s  \n")
+
+
+def synthetic_lines(n_atoms, seed=0):
+    """
+    Lines of a PDB file with about n_atoms atoms (exactly n_atoms for
+    n_atoms >= 100): ATOM, HETATM, TER and CONECT records and END
+    """
+    rng = random.Random(seed)
+    n_waters = int(n_atoms * WATER_FRACTION)
+    n_chains = min(max(1, -(-(n_atoms - n_waters) // CHAIN_ATOMS)),
+                   len(CHAIN_IDS))
+    chain_atoms = [(n_atoms - n_waters) // n_chains] * n_chains
+    chain_atoms[-1] += n_atoms - n_waters - sum(chain_atoms)
+
+    lines = []
+    conect = []
+    serial = 0
+    position = [0.0, 0.0, 0.0]
+
+    def atom(record, name, resName, chainID, resSeq):
+        nonlocal serial
+        serial += 1
+        for axis in range(3):
+            position[axis] = max(-999.0, min(
+                999.0, position[axis] + rng.uniform(-1.5, 1.5)))
+        element = name[0] if name[0] in 'CNOSH' else 'C'
+        lines.append(ATOM_FORMAT % (
+            record, serial % 100000, name if len(name) > 3 else ' ' + name,
+            resName, chainID, resSeq % 10000, position[0], position[1],
+            position[2], rng.uniform(5.0, 40.0), element))
+        return serial
+
+    names = sorted(RESIDUES)
+    for chain, n_chain_atoms in zip(CHAIN_IDS, chain_atoms):
+        protein_atoms = max(0, n_chain_atoms - len(LIGAND[1]))
+        resSeq = 0
+        written = 0
+        while written < protein_atoms:
+            resSeq += 1
+            resName = rng.choice(names)
+            for name in RESIDUES[resName][:protein_atoms - written]:
+                atom('ATOM', name, resName, chain, resSeq)
+                written += 1
+        serial += 1
+        lines.append("TER   %5d      %3s %1s%4d%54s\n"
+                     % (serial % 100000, resName, chain, resSeq % 10000, ''))
+        ligand_atoms = n_chain_atoms - written
+        first = serial + 1
+        for name in LIGAND[1][:ligand_atoms]:
+            atom('HETATM', name, LIGAND[0], chain, resSeq + 1)
+        for i, j in LIGAND_BONDS:
+            if max(i, j) < ligand_atoms:
+                conect.append((first + i, first + j))
+
+    for index in range(n_waters):
+        atom('HETATM', 'O', 'HOH', 'W', index % 9999 + 1)
+    lines += ["CONECT%5d%5d\n" % (i % 100000, j % 100000)
+              for i, j in conect]
+    lines.append("END\n")
+    return lines
+
+
+def write_synthetic(filename, n_atoms, seed=0):
+    """Writes a synthetic PDB file with n_atoms atoms to filename"""
+    with open(filename, 'w') as f:
+        f.writelines(synthetic_lines(n_atoms, seed))
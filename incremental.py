@@ -0,0 +1,140 @@
+"""
+Make-like incremental execution of protocol stages.
+
+Every stage that runs successfully is recorded in stages.json in the
+working directory with a fingerprint of its inputs (input structures,
+parameters, tool versions and the fingerprints of the stages it requires)
+and digests of the files in its directory. On the next run a stage whose
+fingerprint matches and whose files are unchanged is not run again; its
+function is called with reuse=True to load the existing results instead.
+Because fingerprints include those of the required stages, changing the
+input of one stage invalidates all the stages downstream of it.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+
+MANIFEST = 'stages.json'
+CHUNK_SIZE = 1 << 20
+
+
+def digest(*parts):
+    """Hex digest of JSON-serializable parts"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str)
+                          .encode()).hexdigest()
+
+
+def pdb_digest(pdb):
+    """Hex digest of the PDB file pdb would be written as"""
+    buffer = io.StringIO()
+    pdb.to_file(buffer)
+    return hashlib.sha256(buffer.getvalue().encode()).hexdigest()
+
+
+def file_digest(filename):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def directory_digests(directory):
+    """dict of relative file name: hex digest of all files under directory"""
+    digests = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            digests[os.path.relpath(path, directory)] = file_digest(path)
+    return digests
+
+
+class StageManifest(object):
+
+    def __init__(self, working_directory):
+        self.working_directory = working_directory
+        self.filename = os.path.join(working_directory, MANIFEST)
+        # stage: {'fingerprint': ..., 'directory': ..., 'outputs': {...}}
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(self.filename):
+            with open(self.filename) as f:
+                self.entries = json.load(f)
+
+    def fingerprint(self, stage, inputs, requires=()):
+        """
+        Fingerprint of stage with inputs, given that all the required
+        stages have already been run or reused.
+        """
+        return digest(stage, inputs,
+                      [self.entries[requirement]['fingerprint']
+                       for requirement in requires])
+
+    def is_current(self, stage, fingerprint, directory):
+        """True if stage ran with fingerprint and its files are unchanged"""
+        entry = self.entries.get(stage)
+        return (entry is not None and entry['fingerprint'] == fingerprint and
+                entry['outputs'] == directory_digests(directory))
+
+    def record(self, stage, fingerprint, directory):
+        with self._lock:
+            self.entries[stage] = {
+                'fingerprint': fingerprint,
+                'directory': os.path.relpath(directory,
+                                             self.working_directory),
+                'outputs': directory_digests(directory)}
+            self._save()
+
+    def rewritten(self, filename, old_digest):
+        """
+        Records the new contents of filename, which was rewritten after its
+        stage ran (e.g. by prep.relocate_inputs), for the stages whose
+        outputs were recorded with old_digest for it
+        """
+        with self._lock:
+            changed = False
+            for entry in self.entries.values():
+                if 'directory' not in entry:
+                    continue
+                name = os.path.relpath(filename, os.path.join(
+                    self.working_directory, entry['directory']))
+                if entry['outputs'].get(name) == old_digest:
+                    entry['outputs'][name] = file_digest(filename)
+                    changed = True
+            if changed:
+                self._save()
+
+    def invalidate(self, stage):
+        with self._lock:
+            if self.entries.pop(stage, None) is not None:
+                self._save()
+
+    def _save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.filename)
+
+    def wrap(self, stage, function, directory, inputs, requires=()):
+        """
+        function(*args) run as stage only if its fingerprint changed,
+        otherwise function(*args, reuse=True)
+        """
+        def incremental(*args):
+            fingerprint = self.fingerprint(stage, inputs, requires)
+            if self.is_current(stage, fingerprint, directory):
+                print("Inputs of {} unchanged, reusing {}"
+                      .format(stage, directory))
+                result = function(*args, reuse=True)
+                # The stage may have had to recreate some of its files
+                self.record(stage, fingerprint, directory)
+                return result
+            # Forget the old results first so that a failed run is never
+            # mistaken for a current one
+            self.invalidate(stage)
+            result = function(*args)
+            self.record(stage, fingerprint, directory)
+            return result
+        return incremental
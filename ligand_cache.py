@@ -0,0 +1,161 @@
+"""
+Persistent on-disk cache of antechamber/parmchk2 ligand parameters.
+
+Entries are directories named after a hash of everything that determines
+the parameters: the ligand structure (atom names, elements, rounded
+coordinates and CONECT connectivity), residue name, net charge, charge
+method and the AmberTools installation. Entries are created atomically by
+renaming a fully written temporary directory, so several prep processes
+can share one cache directory. Least recently used entries are evicted
+once the cache grows beyond its size limit.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+COORDINATE_DECIMALS = 2
+TOOLS = ['antechamber', 'sqm', 'parmchk2']
+
+
+def ligand_key(pdb, name, charge, method='bcc', tool_version=''):
+    """Hex digest identifying the parameters generated for ligand pdb"""
+    atoms = sorted([atom['name'], atom['element'],
+                    [round(atom[key], COORDINATE_DECIMALS)
+                     for key in ('x', 'y', 'z')]]
+                   for atom in pdb.atoms)
+    serial_names = {atom['serial']: atom['name'] for atom in pdb.atoms}
+    bonds = sorted(sorted([serial_names[first], serial_names[second]])
+                   for first, second in conect_bonds(pdb.conect)
+                   if first in serial_names and second in serial_names)
+    description = {'atoms': atoms, 'bonds': bonds, 'name': name,
+                   'charge': charge, 'method': method,
+                   'tool_version': tool_version}
+    return hashlib.sha256(json.dumps(description, sort_keys=True)
+                          .encode()).hexdigest()
+
+
+def conect_bonds(conect):
+    """(serial, serial) pairs of all bonds in CONECT lines"""
+    for line in conect:
+        serials = [int(line[i:i+5]) for i in range(6, len(line.rstrip()), 5)]
+        for serial in serials[1:]:
+            yield serials[0], serial
+
+
+def tool_version(amberhome):
+    """
+    Fingerprint of the AmberTools installation (path, size and mtime of
+    the executables involved), which changes whenever AmberTools is
+    updated or rebuilt.
+    """
+    fingerprint = []
+    for tool in TOOLS:
+        path = os.path.realpath(os.path.join(amberhome, 'bin', tool))
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        fingerprint.append([path, stat.st_size, int(stat.st_mtime)])
+    return json.dumps(fingerprint)
+
+
+class LigandCache(object):
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, filenames, destination):
+        """
+        Copies filenames of entry key into destination. Returns False (and
+        copies nothing) if the entry or one of the files is missing.
+        """
+        entry = self.entry_path(key)
+        if not all(os.path.isfile(os.path.join(entry, filename))
+                   for filename in filenames):
+            return False
+        try:
+            for filename in filenames:
+                shutil.copy(os.path.join(entry, filename), destination)
+            os.utime(entry)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            return False
+        return True
+
+    def put(self, key, filenames, source):
+        """
+        Stores filenames from directory source as entry key. If the entry
+        exists already (e.g. stored without the frcmod file), the files it
+        lacks are added to it.
+        """
+        entry = self.entry_path(key)
+        tmp = os.path.join(self.directory, '.tmp-' + uuid.uuid4().hex)
+        os.makedirs(tmp)
+        try:
+            for filename in filenames:
+                shutil.copy(os.path.join(source, filename), tmp)
+            os.rename(tmp, entry)
+        except OSError:
+            # Incomplete copy or another process stored the entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+            self.add_missing(entry, filenames, source)
+        self.evict()
+
+    def add_missing(self, entry, filenames, source):
+        """Copies the filenames entry lacks from directory source into it"""
+        for filename in filenames:
+            path = os.path.join(entry, filename)
+            if os.path.isfile(path):
+                continue
+            # Renamed into place so that readers never see a partial file
+            tmp = os.path.join(entry, '.tmp-' + uuid.uuid4().hex)
+            try:
+                shutil.copy(os.path.join(source, filename), tmp)
+                os.replace(tmp, path)
+            except FileNotFoundError:
+                # Evicted by another process in the meantime
+                return
+
+    def entries(self):
+        """list of (last_used, size, key), least recently used first"""
+        result = []
+        for key in os.listdir(self.directory):
+            entry = self.entry_path(key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, filename))
+                           for filename in os.listdir(entry))
+                result.append((os.path.getmtime(entry), size, key))
+            except FileNotFoundError:
+                continue
+        return sorted(result)
+
+    def evict(self):
+        """Removes least recently used entries until under max_bytes"""
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total <= self.max_bytes:
+                    break
+                # Rename first so that readers never see a partial entry
+                doomed = os.path.join(self.directory,
+                                      '.evicted-' + uuid.uuid4().hex)
+                try:
+                    os.rename(self.entry_path(key), doomed)
+                except FileNotFoundError:
+                    continue
+                shutil.rmtree(doomed, ignore_errors=True)
+                total -= size
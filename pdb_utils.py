@@ -1,68 +1,614 @@
-from itertools import groupby
-from copy import deepcopy
+from operator import itemgetter
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import atom_table
+import spatial
 
 
 class Pdb(object):
 
-    def __init__(self, file=None, atoms=None, ter=[], conect=[], other=[]):
+    def __init__(self, file=None, atoms=None, ter=None, conect=None,
+                 other=None, columnar=False):
+        """
+        file is a file object or any iterable of lines. If columnar is
+        True, atoms are stored in an atom_table.AtomTable (requires numpy)
+        and accessed through dict-like views; None uses the columnar
+        backend whenever numpy is available.
+
+        atoms, ter, conect and other given as arguments are copied (an
+        AtomTable given to the columnar backend is shared like copy() shares
+        it). Both backends store atoms in a sequence with the same methods:
+        an AtomTable or an AtomList. Copies
+        made with copy() and select() of the columnar backend share the
+        columns with this Pdb until either of them modifies them, the list
+        backend copies the atom dicts. Both backends keep track of writes
+        to their atoms (see version).
+        """
 
         if file is None and atoms is None:
             raise ValueError('Either file or atoms must be provided')
 
-        self.atoms = []
-        self.ter = []
-        self.conect = []
-        self.other = []
+        if columnar is None:
+            columnar = atom_table.np is not None
 
         if file is None:
-            self.atoms = deepcopy(atoms)
-            self.ter = ter
-            self.conect = conect
-            self.other = other
+            if not columnar:
+                self._set_atoms(AtomList(atoms))
+            elif isinstance(atoms, atom_table.AtomTable):
+                self.atoms = atoms.view()
+            else:
+                self.atoms = atom_table.AtomTable.from_atoms(atoms)
+            self.ter = [dict(entry) for entry in ter or []]
+            self.conect = list(conect or [])
+            self.other = list(other or [])
+            return
+
+        if columnar:
+            text = file.read() if hasattr(file, 'read') else ''.join(file)
+            self._read_buffer(text.encode())
             return
 
+        records = {'atoms': [], 'ter': [], 'conect': [], 'other': []}
         for line in file:
-            getattr(self, pdb_line_key(line)).append(line)
-        self.atoms = [parse_atom(atom) for atom in self.atoms]
-        self.ter = [parse_ter(ter) for ter in self.ter]
+            records[pdb_line_key(line)].append(line)
+        self.atoms = [parse_atom(atom) for atom in records['atoms']]
+        self.ter = [parse_ter(ter) for ter in records['ter']]
+        self.conect = records['conect']
+        self.other = records['other']
+
+    @classmethod
+    def from_filename(cls, filename, columnar=None, cache=None):
+        """
+        Reads filename. With the columnar backend (default when numpy is
+        available) the file is memory-mapped and decoded column-wise.
+        If cache is a directory, the structure is also written there with
+        to_cache and loaded from there as long as filename is unchanged.
+        """
+        if columnar is None:
+            columnar = atom_table.np is not None
+        if not columnar:
+            with open(filename) as f:
+                return cls(f)
+        if cache is not None:
+            cached = os.path.join(cache, cache_name(filename))
+            if os.path.isfile(cached):
+                try:
+                    return cls.from_cache(cached)
+                except ValueError:
+                    pass  # Other format version, replace it
+            pdb = cls.from_filename(filename, columnar=True)
+            os.makedirs(cache, exist_ok=True)
+            pdb.to_cache(cached)
+            return pdb
+
+        pdb = cls.__new__(cls)
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                pdb._read_buffer(b'')
+                return pdb
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                pdb._read_buffer(buffer)
+        return pdb
+
+    @classmethod
+    def from_cache(cls, filename):
+        """
+        Loads a Pdb written by to_cache. The atom columns are memory-mapped
+        (see atom_table.read_cache), nothing is parsed.
+        """
+        pdb = cls.__new__(cls)
+        pdb.atoms, metadata = atom_table.read_cache(filename)
+        pdb.ter = metadata['ter']
+        pdb.conect = metadata['conect']
+        pdb.other = metadata['other']
+        return pdb
+
+    def to_cache(self, filename):
+        """
+        Writes atoms, TER, CONECT and other records to filename in the binary
+        format of atom_table.write_cache (requires numpy). The file is
+        replaced atomically, so concurrent readers never see a partial one.
+        """
+        table = self._atoms
+        if not isinstance(table, atom_table.AtomTable):
+            table = atom_table.AtomTable.from_atoms(table)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                atom_table.write_cache(f, table, {'ter': self.ter,
+                                                  'conect': self.conect,
+                                                  'other': self.other})
+            os.replace(tmp, filename)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def _read_buffer(self, buffer, topology=None):
+        self.atoms, ter, self.conect, self.other = \
+            atom_table.parse_pdb_buffer(buffer, topology=topology)
+        self.ter = [parse_ter(line) for line in ter]
+
+    @property
+    def atoms(self):
+        """
+        Atoms of the structure: an AtomTable, which copies its columns on
+        write by itself, or an AtomList of atom dicts. Atoms assigned to a
+        list-backend Pdb are copied unless they are its own.
+        """
+        return self._atoms
+
+    @atoms.setter
+    def atoms(self, atoms):
+        current = getattr(self, '_atoms', None)
+        if isinstance(current, atom_table.AtomTable):
+            if not isinstance(atoms, atom_table.AtomTable):
+                # Keep the backend, atoms may be views of (this) AtomTable
+                atoms = atom_table.AtomTable.from_atoms(atoms)
+        elif not isinstance(atoms, atom_table.AtomTable):
+            atoms = AtomList(atoms, getattr(current, 'modifications', None))
+        self._set_atoms(atoms)
+
+    def _set_atoms(self, atoms):
+        self._atoms = atoms
+        self._residue_index = None
+        self._write_order = None
+        self._spatial_index = None
+
+    def _view(self, atoms, ter, conect):
+        """New Pdb with atoms (an AtomTable view or copied atom dicts)"""
+        pdb = Pdb.__new__(Pdb)
+        pdb.atoms = atoms
+        pdb.ter = [dict(entry) for entry in ter]
+        pdb.conect = list(conect)
+        pdb.other = list(self.other)
+        return pdb
+
+    @property
+    def version(self):
+        """Changes whenever the atoms are replaced, modified or removed"""
+        return self._atoms.version
+
+    def residue_index(self):
+        """
+        ResidueIndex of the atoms. It is built once and reused until the
+        atoms are replaced or modified.
+        """
+        atoms = self._atoms
+        version = self.version
+        if (self._residue_index is None or
+                self._residue_index.version != version):
+            self._residue_index = ResidueIndex(atoms)
+            self._residue_index.version = version
+        return self._residue_index
 
     def residues(self):
         """dict of residue_hash: residue_atom_list"""
-        return {k: list(v) for k, v in groupby(self.atoms, residue_hash)}
+        return self.residue_index().by_hash()
+
+    def get_residue(self, chainID, resSeq, iCode, resName):
+        """Atom list of the residue or None if there is no such residue"""
+        return self.residue_index().get((chainID, resSeq, iCode, resName))
 
     def get_residues_by_name(self, residue_name):
-        return [residue for k, residue in self.residues().items()
-                if residue[0]['resName'] == residue_name]
+        return self.residue_index().by_name(residue_name)
+
+    def coordinates(self):
+        """(atoms, 3) NumPy array of atom coordinates"""
+        return self._atoms.coordinates()
+
+    def spatial_index(self):
+        """
+        spatial.CellList of the atom coordinates, built on first use and
+        reused until atoms are replaced, modified or removed.
+        """
+        state = (self.version, len(self._atoms))
+        if self._spatial_index is None or self._spatial_index[0] != state:
+            self._spatial_index = (state,
+                                   spatial.CellList(self.coordinates()))
+        return self._spatial_index[1]
+
+    def atoms_within(self, center, radius):
+        """Atoms within radius (in Angstrom) of center, closest first"""
+        return [self.atoms[i]
+                for i in self.spatial_index().within(center, radius)]
+
+    def nearest_atoms(self, point, k=1):
+        """The k atoms closest to point, closest first"""
+        return [self.atoms[i] for i in self.spatial_index().nearest(point, k)]
+
+    def residues_within(self, center, radius):
+        """dict of residue_key: residue_atom_list of residues with at least
+        one atom within radius of center"""
+        return self._residues_of(self.atoms_within(center, radius))
+
+    def residues_in_contact(self, atoms, radius):
+        """
+        dict of residue_key: residue_atom_list of residues with at least one
+        atom within radius of any of atoms (e.g. the atoms of a ligand),
+        not counting the residues atoms belong to.
+        """
+        points = [[atom['x'], atom['y'], atom['z']] for atom in atoms]
+        mask = self.spatial_index().within_any(points, radius)
+        excluded = set(map(residue_key, atoms))
+        residues = self._residues_of(self.atoms[i]
+                                     for i in spatial.np.flatnonzero(mask))
+        return {key: residue for key, residue in residues.items()
+                if key not in excluded}
+
+    def _residues_of(self, atoms):
+        index = self.residue_index()
+        return {key: index.get(key) for key in map(residue_key, atoms)}
+
+    def write_order(self):
+        """
+        Indices into atoms+ter in the order they are written. Computed once
+        and reused until atoms, TER entries or ordering fields change.
+        """
+        # TER entries are plain dicts, their sort keys are part of the state
+        state = (self.version, len(self._atoms),
+                 [tuple(ter[key] for key in WRITE_ORDER_KEYS)
+                  for ter in self.ter])
+        if self._write_order is None or self._write_order[0] != state:
+            # Sort atoms with TER entries by resSeq. TER is always the last.
+            # If some atoms have no index (extra Hs added by reduce) they go
+            # after the "normal" ones.
+            self._write_order = (state, self._atoms.write_order(self.ter))
+        return self._write_order[1]
 
     def to_file(self, file):
-        """Writes atoms, TER and CONECT entries. Ignores all the rest."""
-        DUMP_CALLBACK = {'ATOM': dump_atom,
-                         'HETATM': dump_atom,
-                         'TER': dump_ter}
-        # Sort atoms with TER entries by resSeq. TER is always the last.
-        # If some atoms have no index (extra Hs added by reduce) they go
-        # after the "normal" ones.
-        for entry in sorted(self.atoms+self.ter,
-                            key=lambda x: (x['resSeq'],
-                                           x['record'],
-                                           x['serial'] or 99999999)):
-            file.write(DUMP_CALLBACK[entry['record']](entry))
-        for entry in self.conect:
-            file.write(entry)
+        """
+        Writes atoms, TER and CONECT entries. Ignores all the rest.
+        All records are formatted into one buffer and written at once.
+        """
+        lines = self._atoms.lines()
+        lines += map(dump_ter, self.ter)
+        lines = [lines[i] for i in self.write_order()]
+        file.write(''.join(lines + self.conect))
 
     def to_filename(self, filename):
         with open(filename, 'w') as f:
             self.to_file(f)
 
     def copy(self):
-        return Pdb(atoms=self.atoms, ter=self.ter,
-                   conect=self.conect, other=self.other)
+        """
+        Copy of this Pdb. AtomTable columns are shared until either Pdb
+        modifies them, atom dicts are copied.
+        """
+        return self._view(self._atoms.view(), self.ter, self.conect)
+
+    def where(self, within=None, flag=None, **conditions):
+        """
+        Boolean mask over atoms selecting the atoms that fulfill all the
+        conditions. Every keyword is an atom key with a value to compare
+        with, a set (or list/tuple) of allowed values or a predicate.
+        flag selects atoms with flag in their extras (e.g. 'new' for
+        hydrogens added by reduce) and within=(points, radius) atoms within
+        radius of any of points. The mask is a NumPy array if NumPy is
+        available (combine masks with &, | and ~), a Mask list otherwise.
+        """
+        if flag is not None:
+            conditions['extras'] = lambda extras: flag in extras
+        conditions = {key: condition_function(condition)
+                      for key, condition in conditions.items()}
+
+        mask = self._atoms.mask('record', lambda record: True)
+        for key, condition in conditions.items():
+            mask &= self._atoms.mask(key, condition)
+
+        if within is not None:
+            points, radius = within
+            mask &= self.spatial_index().within_any(points, radius)
+        return mask
+
+    def mask_of(self, atoms):
+        """Boolean mask selecting atoms (atoms or views of this Pdb)"""
+        return self._atoms.mask_of(atoms)
+
+    def select(self, mask):
+        """
+        New Pdb with (copies of) the atoms selected by mask. TER records
+        are dropped and so are CONECT records of atoms that are not
+        selected.
+        """
+        atoms = self._atoms.view(mask)
+        serials = set(map(int, atoms.column('serial')))
+        conect = [line for line in self.conect
+                  if serials.issuperset(conect_serials(line))]
+        return self._view(atoms, [], conect)
+
+    def remove(self, mask):
+        """Removes all atoms selected by mask in one pass"""
+        # Remaining atoms (and views of them) stay valid
+        self._atoms.remove_rows(mask)
+        self._set_atoms(self._atoms)
+
+    def modify(self, mask, key, value):
+        """Sets key to value for all atoms selected by mask"""
+        self._atoms.modify(mask, key, value)
+
+    def modify_atoms(self, atoms, key, value):
+        """
+        Sets key to value for atoms (atoms or views of this Pdb, e.g. a
+        residue).
+        """
+        for atom in atoms:
+            atom[key] = value
 
     def remove_atom(self, atom):
+        atoms = self._atoms
+        index = self._residue_index
+        current = index is not None and index.version == self.version
         try:
-            self.atoms.remove(atom)
+            atoms.remove(atom)
         except ValueError:
-            pass
+            return
+        self._write_order = None
+        self._spatial_index = None
+        if current:
+            # Cheaper to update than to rebuild
+            index.remove(atom)
+            index.version = self.version
+
+
+class Modifications(object):
+    """Version of the atoms of an AtomList, changed by writes to them"""
+
+    __slots__ = ('version',)
+
+    def __init__(self):
+        self.modified()
+
+    def modified(self):
+        self.version = atom_table.next_version()
+
+
+class AtomDict(dict):
+    """Atom dict of an AtomList, writes to it change its version"""
+
+    __slots__ = ('modifications',)
+
+    def __init__(self, atom, modifications):
+        dict.__init__(self, atom)
+        self.modifications = modifications
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.modifications.modified()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.modifications.modified()
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.modifications.modified()
+
+    def pop(self, *args):
+        value = dict.pop(self, *args)
+        self.modifications.modified()
+        return value
+
+    def setdefault(self, key, default=None):
+        value = dict.setdefault(self, key, default)
+        self.modifications.modified()
+        return value
+
+    def clear(self):
+        dict.clear(self)
+        self.modifications.modified()
+
+    def __reduce__(self):
+        # Copies and pickles are plain dicts
+        return dict, (dict(self),)
+
+
+def _modifies(method):
+    """list method of AtomList that changes its version"""
+    def modifying(self, *args):
+        result = method(self, *args)
+        self.modifications.modified()
+        return result
+    modifying.__name__ = method.__name__
+    return modifying
+
+
+class AtomList(list):
+    """
+    Atoms of a list-backend Pdb: AtomDicts sharing their Modifications
+    with the list, so that the Pdb notices any write to them. Atoms (dicts
+    or AtomViews) are copied into AtomDicts unless they are AtomDicts of
+    modifications already. Slices are plain lists of the AtomDicts.
+    """
+
+    __slots__ = ('modifications',)
+
+    def __init__(self, atoms=(), modifications=None):
+        if modifications is None:
+            modifications = Modifications()
+        else:
+            modifications.modified()
+        self.modifications = modifications
+        list.__init__(self, map(self._own, atoms))
+
+    def _own(self, atom):
+        if (isinstance(atom, AtomDict) and
+                atom.modifications is self.modifications):
+            return atom
+        return AtomDict(atom, self.modifications)
+
+    @property
+    def version(self):
+        return self.modifications.version
+
+    def __setitem__(self, index, atoms):
+        if isinstance(index, slice):
+            atoms = list(map(self._own, atoms))
+        else:
+            atoms = self._own(atoms)
+        list.__setitem__(self, index, atoms)
+        self.modifications.modified()
+
+    def __iadd__(self, atoms):
+        self.extend(atoms)
+        return self
+
+    def append(self, atom):
+        list.append(self, self._own(atom))
+        self.modifications.modified()
+
+    def insert(self, index, atom):
+        list.insert(self, index, self._own(atom))
+        self.modifications.modified()
+
+    def extend(self, atoms):
+        list.extend(self, map(self._own, atoms))
+        self.modifications.modified()
+
+    __delitem__ = _modifies(list.__delitem__)
+    remove = _modifies(list.remove)
+    pop = _modifies(list.pop)
+    clear = _modifies(list.clear)
+    reverse = _modifies(list.reverse)
+
+    def sort(self, **kwargs):
+        list.sort(self, **kwargs)
+        self.modifications.modified()
+
+    def _select(self, index):
+        """Atoms selected by index (slice or mask)"""
+        if isinstance(index, slice):
+            return list.__getitem__(self, index)
+        return [atom for atom, selected in zip(self, index) if selected]
+
+    def column(self, key):
+        """Values of key for all atoms"""
+        return [atom[key] for atom in self]
+
+    def mask(self, key, condition):
+        """Boolean mask of atoms whose value of key fulfills condition"""
+        return make_mask(condition(atom[key]) for atom in self)
+
+    def mask_of(self, atoms):
+        """Boolean mask selecting atoms (AtomDicts of this list)"""
+        ids = set(map(id, atoms))
+        return make_mask(id(atom) in ids for atom in self)
+
+    def groups(self, keys):
+        """
+        List of (values, atoms) of the atoms grouped by their values of
+        keys, in order of first appearance
+        """
+        return group_atoms(self, keys)
+
+    def modify(self, mask, key, value):
+        """Sets key to value for all atoms selected by mask"""
+        for atom in self._select(mask):
+            dict.__setitem__(atom, key, value)
+        self.modifications.modified()
+
+    def view(self, index=slice(None)):
+        """New AtomList of copies of the atoms selected by index"""
+        return AtomList(self._select(index))
+
+    def remove_rows(self, index):
+        """Removes the atoms selected by index (slice or mask)"""
+        removed = set(map(id, self._select(index)))
+        self[:] = [atom for atom in self if id(atom) not in removed]
+
+    def coordinates(self):
+        """(atoms, 3) NumPy array of atom coordinates"""
+        return spatial.np.array([[atom['x'], atom['y'], atom['z']]
+                                 for atom in self]).reshape(-1, 3)
+
+    def lines(self):
+        """PDB lines of the atoms"""
+        return list(map(dump_atom, self))
+
+    def write_order(self, ter):
+        """Indices into atoms+ter in the order Pdb.to_file writes them"""
+        keys = [tuple(atom[key] for key in WRITE_ORDER_KEYS)
+                for atom in self]
+        keys += [tuple(entry[key] for key in WRITE_ORDER_KEYS)
+                 for entry in ter]
+        return sorted(range(len(keys)),
+                      key=lambda i: (keys[i][0], keys[i][1],
+                                     keys[i][2] or 99999999))
+
+    def __reduce__(self):
+        # Copies and pickles are plain lists (of plain dicts)
+        return list, (list(self),)
+
+
+class ResidueIndex(object):
+    """
+    Atoms grouped by residue_key, in order of first appearance. Atoms of
+    a residue do not need to be contiguous.
+    """
+
+    def __init__(self, atoms):
+        self.version = None  # Pdb.version the index was built for
+        groups = getattr(atoms, 'groups', None)
+        if groups is None:
+            # Any other sequence of atoms
+            self.residues = dict(group_atoms(atoms, RESIDUE_KEYS))
+        else:
+            self.residues = dict(groups(RESIDUE_KEYS))
+        self.names = {}
+        for key in self.residues:
+            self.names.setdefault(key[3], []).append(key)
+        self._by_hash = None
+
+    def get(self, key):
+        return self.residues.get(key)
+
+    def by_name(self, residue_name):
+        return [self.residues[key] for key in self.names.get(residue_name, [])]
+
+    def by_hash(self):
+        """dict of residue_hash: residue_atom_list"""
+        if self._by_hash is None:
+            self._by_hash = {}
+            for key, residue in self.residues.items():
+                # residue_hash of its atoms
+                hash = '{}_{}_{}'.format(key[0], key[1], key[3])
+                if hash in self._by_hash:
+                    # Residues differing only by iCode share a residue_hash
+                    residue = self._by_hash[hash] + residue
+                self._by_hash[hash] = residue
+        return self._by_hash
+
+    def remove(self, atom):
+        key = residue_key(atom)
+        residue = self.residues.get(key)
+        if residue is None or atom not in residue:
+            return
+        residue.remove(atom)
+        if not residue:
+            del self.residues[key]
+            self.names[key[3]].remove(key)
+        self._by_hash = None
+
+
+RESIDUE_KEYS = ('chainID', 'resSeq', 'iCode', 'resName')
+
+
+def group_atoms(atoms, keys):
+    """
+    List of (values, atoms) of atoms grouped by their values of keys, in
+    order of first appearance
+    """
+    groups = {}
+    for atom in atoms:
+        groups.setdefault(tuple(atom[key] for key in keys), []).append(atom)
+    return list(groups.items())
+
+
+def residue_key(atom):
+    """Tuple uniquely identifying the residue atom belongs to"""
+    return (atom['chainID'], atom['resSeq'], atom['iCode'], atom['resName'])
 
 
 def residue_hash(atom):
@@ -72,10 +618,127 @@ def residue_hash(atom):
 
 
 def modify_atoms(atoms, key, value):
+    """
+    Sets key to value for atoms (an AtomTable, AtomViews or atom dicts).
+    """
+    if isinstance(atoms, atom_table.AtomTable):
+        atoms.modify(slice(None), key, value)
+        return
     for atom in atoms:
+        # AtomViews and AtomDicts update the version of their atoms
         atom[key] = value
 
 
+class Mask(list):
+    """List of booleans supporting elementwise &, | and ~ like NumPy"""
+
+    def __and__(self, other):
+        return Mask(a and b for a, b in zip(self, other))
+
+    def __or__(self, other):
+        return Mask(a or b for a, b in zip(self, other))
+
+    def __invert__(self):
+        return Mask(not a for a in self)
+
+    __rand__ = __and__
+    __ror__ = __or__
+
+
+def make_mask(values):
+    """Boolean NumPy array of values if NumPy is available, else Mask"""
+    if atom_table.np is None:
+        return Mask(values)
+    return atom_table.np.fromiter(values, dtype=bool)
+
+
+def condition_function(condition):
+    """Predicate for a where condition (value, collection or predicate)"""
+    if callable(condition):
+        return condition
+    if isinstance(condition, (set, frozenset, list, tuple)):
+        return set(condition).__contains__
+    return lambda value: value == condition
+
+
+def iter_models(file, models=None, columnar=None):
+    """
+    Generator of (model number, Pdb) of the MODEL/ENDMDL models in file.
+    A file without MODEL records is a single model numbered 1. The file is
+    read as the generator is consumed and only models whose numbers are in
+    models (all if None) are parsed, so files of many frames are streamed
+    in bounded memory. With the columnar backend, models with the same
+    atoms as the model parsed before share its columns (copy-on-write) and
+    only have their own coordinate array. Records before the first MODEL
+    are added to the other list of every model, records after the last
+    ENDMDL (e.g. CONECT) are ignored.
+    """
+    if columnar is None:
+        columnar = atom_table.np is not None
+    header = []
+    topology = None
+    for number, lines in model_lines(file, header):
+        if models is not None and number not in models:
+            continue
+        if not columnar:
+            pdb = Pdb(header + lines)
+        else:
+            pdb = Pdb.__new__(Pdb)
+            pdb._read_buffer(''.join(lines).encode(), topology)
+            pdb.other[:0] = header
+            if (topology is None or
+                    pdb.atoms.signature != topology.signature):
+                # Keep the topology unchanged by modifications of the model
+                topology = pdb.atoms
+                pdb.atoms = topology.view()
+        yield number, pdb
+
+
+def model_lines(file, header):
+    """
+    Generator of (model number, lines) of the models in file. Lines before
+    the first MODEL record are appended to header.
+    """
+    number = None
+    lines = []
+    count = 0
+    for line in file:
+        record = line[:6]
+        if record == 'MODEL ':
+            if number is None and count == 0:
+                header.extend(lines)
+            count += 1
+            fields = line[6:].split()
+            number = int(fields[0]) if fields else count
+            lines = []
+        elif record == 'ENDMDL':
+            if number is not None:
+                yield number, lines
+            number = None
+            lines = []
+        else:
+            lines.append(line)
+    if count == 0:
+        yield 1, lines
+    elif number is not None:
+        # Last model without ENDMDL
+        yield number, lines
+
+
+def cache_name(filename):
+    """Name of the to_cache file of filename in its current version"""
+    stat = os.stat(filename)
+    key = json.dumps([os.path.realpath(filename), stat.st_size,
+                      stat.st_mtime_ns, atom_table.CACHE_VERSION])
+    return hashlib.sha256(key.encode()).hexdigest() + '.pdbc'
+
+
+def conect_serials(conect_line):
+    """Serial numbers of the atoms of a CONECT record"""
+    line = conect_line.rstrip()
+    return [int(line[i:i + 5]) for i in range(6, len(line), 5)]
+
+
 def find_atom(atoms, condition):
     """Return first atom in atoms that fulfills condition"""
     return next(atom for atom in atoms if condition(atom))
@@ -130,16 +793,22 @@ def parse_ter(ter_line):
     }
 
 
+# printf-style equivalents of the PDB format, much faster than str.format.
+# The two atom formats are for names of up to 2 and more than 2 characters.
+ATOM_FORMATS = tuple("%-6s%5d " + name_format + "%-1s%3s %-1s%4d%-1s   "
+                     "%8.3f%8.3f%8.3f%6.2f%6.2f          %2s%2s%s"
+                     for name_format in [" %-3s", "%4s"])
+TER_FORMAT = "%-6s%5d %8s %-1s%4d%-1s%s"
+ATOM_FIELDS = itemgetter(*atom_table.ATOM_KEYS)
+TER_FIELDS = itemgetter('record', 'serial', 'resName', 'chainID', 'resSeq',
+                        'iCode', 'extras')
+WRITE_ORDER_KEYS = ('resSeq', 'record', 'serial')
+
+
 def dump_atom(atom):
-    name_format = "{name:>4}" if len(atom['name']) > 2 else " {name:<3}"
-    return ("{record:6}{serial:5} " + name_format + "{altLoc:1}"
-            "{resName:>3} {chainID:1}{resSeq:4}{iCode:1}"
-            "   {x:8.3f}{y:8.3f}{z:8.3f}{occupancy:6.2f}"
-            "{tempFactor:6.2f}          {element:>2}"
-            "{charge:>2}{extras}").format(**atom)
+    return ATOM_FORMATS[len(atom['name']) > 2] % ATOM_FIELDS(atom)
 
 
 def dump_ter(ter):
-    return ("{record:6}{serial:5} {resName:>8} "
-            "{chainID:1}{resSeq:4}{iCode:1}{extras}"
-            .format(**ter))
+    return TER_FORMAT % TER_FIELDS(ter)
+
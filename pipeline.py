@@ -0,0 +1,150 @@
+"""
+Dependency graph of protocol stages.
+
+Every stage is a function called with the results of the stages it
+requires, in the order they are listed. Pipeline.run submits each stage to
+an executor as soon as all of its requirements have finished, so
+independent stages run concurrently.
+"""
+import concurrent.futures
+import time
+
+
+class Stage(object):
+
+    def __init__(self, name, function, requires=()):
+        self.name = name
+        self.function = function
+        self.requires = tuple(requires)
+
+
+class Pipeline(object):
+
+    def __init__(self):
+        self.stages = {}
+        self.timings = {}  # name: (start, end) of the last run
+
+    def add(self, name, function, requires=()):
+        if name in self.stages:
+            raise ValueError("Stage {} already exists".format(name))
+        self.stages[name] = Stage(name, function, requires)
+
+    def order(self):
+        """Stage names in topological order (ties kept in insertion order)"""
+        order = []
+        visiting = set()
+
+        def visit(name, path):
+            if name in order:
+                return
+            if name not in self.stages:
+                raise ValueError("Unknown stage {} required by {}"
+                                 .format(name, path[-1]))
+            if name in visiting:
+                raise ValueError("Dependency cycle: " +
+                                 " -> ".join(path + [name]))
+            visiting.add(name)
+            for requirement in self.stages[name].requires:
+                visit(requirement, path + [name])
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+        return order
+
+    def describe(self):
+        """Human-readable list of stages and their requirements"""
+        return '\n'.join("{} <- {}".format(
+            name, ', '.join(self.stages[name].requires) or '(none)')
+            for name in self.order())
+
+    def run(self, executor=None):
+        """
+        Runs all stages and returns dict of name: result. Without an
+        executor stages run one after another in this process.
+        """
+        order = self.order()
+        results = {}
+        self.timings = {}
+
+        if executor is None:
+            for name in order:
+                results[name] = self._record(name, timed_call(
+                    self.stages[name].function, self._arguments(name,
+                                                                results)))
+            return results
+
+        running = {}
+        while len(results) < len(order):
+            for name in order:
+                stage = self.stages[name]
+                if (name not in results and name not in running.values() and
+                        all(r in results for r in stage.requires)):
+                    future = executor.submit(timed_call, stage.function,
+                                             self._arguments(name, results))
+                    running[future] = name
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = self._record(name, future.result())
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+        return results
+
+    def _arguments(self, name, results):
+        return [results[requirement]
+                for requirement in self.stages[name].requires]
+
+    def _record(self, name, timed_result):
+        result, start, end = timed_result
+        self.timings[name] = (start, end)
+        return result
+
+    def durations(self):
+        return {name: end - start
+                for name, (start, end) in self.timings.items()}
+
+    def critical_path(self):
+        """
+        (stage names, seconds) of the longest chain of dependent stages of
+        the last run, i.e. the lower bound of its wall-clock time.
+        """
+        durations = self.durations()
+        finish = {}
+        previous = {}
+        for name in self.order():
+            requires = self.stages[name].requires
+            before = max(requires, key=lambda r: finish[r], default=None)
+            previous[name] = before
+            finish[name] = (durations.get(name, 0.0) +
+                            (finish[before] if before else 0.0))
+        if not finish:
+            return [], 0.0
+        last = max(finish, key=finish.get)
+        path = []
+        name = last
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1], finish[last]
+
+    def report(self):
+        """Stage timings and critical path of the last run"""
+        durations = self.durations()
+        lines = ["{:<12}{:>10.1f} s".format(name, durations[name])
+                 for name in self.order() if name in durations]
+        path, length = self.critical_path()
+        lines.append("Critical path: {} ({:.1f} s)"
+                     .format(' -> '.join(path), length))
+        return '\n'.join(lines)
+
+
+def timed_call(function, arguments):
+    """(function(*arguments), start, end) with wall-clock times"""
+    start = time.time()
+    result = function(*arguments)
+    return result, start, time.time()
@@ -1,125 +1,462 @@
 #!/usr/bin/env python3
 import argparse
+import concurrent.futures
+import copy
+import functools
+import incremental
 import json
+import ligand_cache
 import pdb_utils
+import pipeline
+import timing
 import wrappers
 import shutil
 import utils
-import sys
 import os
+import tempfile
 
-parser = argparse.ArgumentParser(
-    description=""
+DESCRIPTION = (
     "Prepares the simulation system by performing the following actions:\n"
     " - ligand parameterisation (with antechamber/prmchk2)\n"
     " - pdb protonation (apart from ligands, they need to "
     "   be protonated already!)\n"
     " - tleap to solvate and write starting parm7/rst7 (top/rst)\n\n"
-    "Is meant to be followed by struct.py",
-    formatter_class=argparse.RawDescriptionHelpFormatter
+    "Is meant to be followed by struct.py"
 )
 
-parser.add_argument("pdb", help="protonated PDB file",
-                    type=argparse.FileType())
-parser.add_argument("ligand",
-                    help="name of the residue to be used as the ligand")
-parser.add_argument("charge", help="charge of the ligand", type=int)
-parser.add_argument("params", help="JSON file with advanced parameters",
-                    type=argparse.FileType(), nargs='?')
-
-args = parser.parse_args()
-
-pdb_name = '.'.join(args.pdb.name.split('.')[:-1])
-ligand_name = args.ligand
-ligand_charge = args.charge
-
-params = {
+DEFAULT_PARAMS = {
     'antechamber': {
-        'ligand': args.ligand,
-        'charge': args.charge,
         'ligand_chainID': "L",
         'ligand_index': 1,
+        'cache': None,
+        'cache_size_mb': 1024,
     },
     'propka': {
         'with_propka': True,
         'ph': 7.0,
         'ph_offset': 0.7,
+        'ph_sweep': [],
+        'in_process': None,
     },
     'tleap': {
         'template': 'sphere',
         'solvent_radius': 20.0,
         'solvent_closeness': 0.75,
-        'include': []
+        'solvent_box': None,
+        'include': [],
+        'sweep': [],
+        'pool_workers': 0,
+        'pool_max_jobs': 100,
+        'pool_timeout': 1800,
+    },
+    'pipeline': {
+        'workers': 2,
+        'scratch': None,
+        'incremental': True,
+        'stream': False,
+        'debug': False,
+        'models': None,
+        'pdb_cache': None,
     }
 }
 
-if args.params is not None:
-    params = utils.merge_dicts_of_dicts(params, json.load(args.params))
-    args.params.close()
 
+def get_params(ligand, charge, overrides=None):
+    """
+    Default parameters updated with overrides. ligand and charge always
+    take precedence over the ones in overrides (e.g. a params file written
+    by the PyMOL plugin, which holds the charge as a float).
+    """
+    params = copy.deepcopy(DEFAULT_PARAMS)
+    if overrides is not None:
+        params = utils.merge_dicts_of_dicts(params, copy.deepcopy(overrides))
+    params['antechamber']['ligand'] = ligand
+    params['antechamber']['charge'] = charge
+    return params
 
-print("Starting PREP protocol in {}/".format(pdb_name))
 
-if os.path.exists(pdb_name):
-    print("It appears you've already (attempted to) run prep.py with {0}. "
-          "Delete folder {0} or rename pdb if you want to run it again."
-          .format(pdb_name))
-    sys.exit()
-utils.set_working_directory(pdb_name)
+def run(pdb_file, ligand_name, ligand_charge, params=None,
+        working_directory=None):
+    """
+    Runs the PREP protocol for pdb_file in working_directory (by default
+    the name of pdb_file without extension). params are overrides of
+    get_params defaults. If working_directory holds a previous run, only
+    the stages whose inputs changed are run again (unless params
+    ['pipeline']['incremental'] is False, which starts from scratch).
+    If params['pipeline']['scratch'] is set, the tools run in a temporary
+    directory under it (e.g. node-local tmpfs) which is copied to
+    working_directory at the end. Timings and resource usage of all stages
+    are written to timings.json in working_directory.
+    If params['pipeline']['models'] is 'all' or a list of model numbers,
+    these MODELs of an ensemble (e.g. NMR models or MD snapshots) are
+    prepped one after the other in working_directory/model_<n>. Models are
+    read from pdb_file only when they are prepped. If params['pipeline']
+    ['pdb_cache'] is a directory, a single structure is cached there in
+    binary form (see pdb_utils.Pdb.to_cache) and not parsed again later.
+    """
+    pdb_name = '.'.join(pdb_file.split('.')[:-1])
+    if working_directory is None:
+        working_directory = pdb_name
+    params = get_params(ligand_name, ligand_charge, params)
 
-pdb = pdb_utils.Pdb(args.pdb)
+    utils.check_file(pdb_file)
 
-ligands = pdb.get_residues_by_name(ligand_name)
-if len(ligands) == 0:
-    raise ValueError("No ligands found")
+    # Reuse ligand parameters across runs if a cache directory is given
+    ligand_params_cache = None
+    if params['antechamber']['cache'] is not None:
+        ligand_params_cache = ligand_cache.LigandCache(
+            params['antechamber']['cache'],
+            params['antechamber']['cache_size_mb'] * 1024 * 1024
+        )
 
-ligand_index = params['antechamber']['ligand_index']
-if ligand_index > len(ligands):
-    raise ValueError("ligand_index is larger than the number of ligands")
+    print("Starting PREP protocol in {}/".format(working_directory))
 
-ligand_atoms = ligands[ligand_index-1]
-if len(ligands) > 1:
-    print("More than one ligand detected. Using coordinates from the ligand"
-          " with chainID={} and resSeq={}"
-          .format(ligand_atoms[0]['chainID'], ligand_atoms[0]['resSeq']))
+    name = os.path.basename(pdb_name)
+    models = params['pipeline']['models']
+    if models is None:
+        timings = timing.Timings()
+        with timings.stage('read'):
+            with timing.step('parse ' + os.path.basename(pdb_file),
+                             pdb_file):
+                pdb = pdb_utils.Pdb.from_filename(
+                    pdb_file, cache=params['pipeline']['pdb_cache'])
+            timing.count(atoms_out=len(pdb.atoms))
+        prep_structure(pdb, name, params, ligand_params_cache,
+                       working_directory, timings)
+    else:
+        with open(pdb_file) as f:
+            ensemble = pdb_utils.iter_models(
+                f, None if models == 'all' else set(models))
+            while True:
+                timings = timing.Timings()
+                with timings.stage('read'):
+                    with timing.step('parse model'):
+                        model = next(ensemble, None)
+                    if model is not None:
+                        timing.count(atoms_out=len(model[1].atoms))
+                if model is None:
+                    break
+                number, pdb = model
+                print("Model {}".format(number))
+                prep_structure(pdb, name, params, ligand_params_cache,
+                               os.path.join(working_directory,
+                                            'model_{}'.format(number)),
+                               timings)
+    print("Finished PREP protocol.")
 
-# Only generate ligand frcmod if it is not found in include paths
-ligand_frcmod = utils.file_in_paths(ligand_name + '.frcmod',
-                                    params['tleap']['include'])
-antechamber = wrappers.AntechamberWrapper(
-    pdb_utils.Pdb(atoms=ligand_atoms), ligand_name, ligand_charge,
-    create_frcmod=ligand_frcmod is None
-)
-if ligand_frcmod is None:
-    params['tleap']['include'].append(antechamber.working_directory)
-
-# Change ligand chain ID to ligand_chainID
-ligand_chainID = params['antechamber']['ligand_chainID']
-pdb_utils.modify_atoms(ligand_atoms, 'chainID', ligand_chainID)
-
-# Run pdb4amber and reduce
-reduceResults = wrappers.Pdb4AmberReduceWrapper(pdb)
-pdb = reduceResults.pdb
-params['tleap']['water_pdb'] = reduceResults.waterPdb
-
-# Run propka31 if requested and found
-if params['propka']['with_propka']:
-    if shutil.which('propka31'):
-        pdb = wrappers.PropkaWrapper(
-            pdb,
-            ph=params['propka']['ph'],
-            ph_offset=params['propka']['ph_offset']
-        ).pdb
+
+def prep_structure(pdb, name, params, ligand_params_cache,
+                   working_directory, timings):
+    """
+    Runs prep_protocol for pdb in working_directory, or in a scratch
+    directory copied there at the end, and writes timings.json
+    """
+    def run_in(directory):
+        try:
+            prep_protocol(pdb, name, params, ligand_params_cache, directory,
+                          timings)
+        finally:
+            timings.write(os.path.join(directory, 'timings.json'))
+
+    if not params['pipeline']['incremental']:
+        utils.make_working_directory(working_directory)
+    os.makedirs(working_directory, exist_ok=True)
+    scratch = params['pipeline']['scratch']
+    if scratch is None:
+        run_in(working_directory)
+    else:
+        os.makedirs(scratch, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=scratch) as directory:
+            shutil.copytree(working_directory, directory, dirs_exist_ok=True)
+            try:
+                run_in(directory)
+            finally:
+                # Also keep the logs of a failed run
+                shutil.rmtree(working_directory)
+                shutil.copytree(directory, working_directory)
+                relocate_inputs(working_directory, directory)
+
+
+def relocate_inputs(working_directory, scratch_directory):
+    """
+    Replaces the paths into scratch_directory in the tleap inputs (.in
+    files) copied to working_directory, e.g. the ligand include paths,
+    so that they can still be run from there. The stage manifest records
+    the relocated files, so the stages remain current for the next run.
+    """
+    new = os.path.abspath(working_directory)
+    old = os.path.abspath(scratch_directory)
+    manifest = incremental.StageManifest(working_directory)
+    for root, _, filenames in os.walk(working_directory):
+        for filename in filenames:
+            if not filename.endswith('.in'):
+                continue
+            path = os.path.join(root, filename)
+            with open(path) as f:
+                contents = f.read()
+            if old in contents:
+                old_digest = incremental.file_digest(path)
+                with open(path, 'w') as f:
+                    f.write(contents.replace(old, new))
+                manifest.rewritten(path, old_digest)
+
+
+def prep_protocol(pdb, name, params, ligand_params_cache=None,
+                  working_directory='.', timings=None):
+    """
+    Runs all the stages of the protocol in working_directory, recording
+    them in timings (timing.Timings) if given. Stages whose results in
+    working_directory are still current are reused.
+    """
+    ligand_name = params['antechamber']['ligand']
+
+    ligands = pdb.get_residues_by_name(ligand_name)
+    if len(ligands) == 0:
+        raise ValueError("No ligands found")
+
+    ligand_index = params['antechamber']['ligand_index']
+    if ligand_index > len(ligands):
+        raise ValueError("ligand_index is larger than the number of ligands")
+
+    ligand_atoms = ligands[ligand_index-1]
+    if len(ligands) > 1:
+        print("More than one ligand detected. Using coordinates from the "
+              "ligand with chainID={} and resSeq={}"
+              .format(ligand_atoms[0]['chainID'], ligand_atoms[0]['resSeq']))
+
+    # Only generate ligand frcmod if it is not found in include paths
+    ligand_frcmod = utils.file_in_paths(ligand_name + '.frcmod',
+                                        params['tleap']['include'])
+    ligand_mask = pdb.mask_of(ligand_atoms)
+    ligand_pdb = pdb.select(ligand_mask)
+    # antechamber gets the ligand atoms only, it perceives the bonds itself
+    ligand_pdb.conect = []
+
+    # Change ligand chain ID to ligand_chainID
+    ligand_chainID = params['antechamber']['ligand_chainID']
+    pdb.modify(ligand_mask, 'chainID', ligand_chainID)
+
+    manifest = incremental.StageManifest(working_directory)
+    protocol = build_pipeline(pdb, ligand_pdb, name, params,
+                              ligand_frcmod is None, ligand_params_cache,
+                              working_directory, timings, manifest)
+    workers = params['pipeline']['workers']
+    if workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            protocol.run(executor)
     else:
-        print("propka31 cannot be found in $PATH.\n"
-              "WARNING: all ASP/GLU will be treated as unprotonated.")
-
-ligand = pdb.get_residues_by_name(ligand_name)[ligand_index-1]
-params['tleap']['name'] = os.path.basename(pdb_name)
-params['tleap']['pdb'] = pdb
-params['tleap']['ligand'] = ligand
-wrappers.TleapWrapper(params['tleap']['template'],
-                      params['tleap']['include'],
-                      reduceResults.nonprot_residues,
-                      params['tleap'])
-print("Finished PREP protocol.")
+        protocol.run()
+    print(protocol.report())
+    return protocol
+
+
+def build_pipeline(pdb, ligand_pdb, name, params, create_frcmod=True,
+                   ligand_params_cache=None, working_directory='.',
+                   timings=None, manifest=None):
+    """
+    pipeline.Pipeline of the protocol stages, each working in its own
+    subdirectory of working_directory and recorded in timings if given.
+    With an incremental.StageManifest, stages only run if their inputs
+    changed. Ligand parameterisation is independent of pdb4amber/reduce
+    and propka, only tleap needs them all.
+    """
+    protocol = pipeline.Pipeline()
+
+    def add(stage, directory, inputs, function, *args, requires=()):
+        directory = os.path.join(working_directory, directory)
+        function = functools.partial(function, directory, *args)
+        if manifest is not None:
+            function = manifest.wrap(stage, function, directory, inputs,
+                                     requires)
+        if timings is not None:
+            function = timings.wrap(stage, function, directory)
+        protocol.add(stage, function, requires)
+
+    amberhome = os.environ.get('AMBERHOME', '')
+    amber_version = ligand_cache.tool_version(amberhome)
+    ligand_key = ligand_cache.ligand_key(
+        ligand_pdb, params['antechamber']['ligand'],
+        params['antechamber']['charge'], 'bcc', amber_version
+    )
+
+    add('antechamber', 'antechamber', [ligand_key, create_frcmod],
+        antechamber_stage, ligand_pdb, params['antechamber'], create_frcmod,
+        ligand_params_cache)
+    add('reduce', 'pdb4amber_reduce',
+        [incremental.pdb_digest(pdb), amber_version], reduce_stage, pdb,
+        params['pipeline']['stream'], params['pipeline']['debug'])
+    propka_version = wrappers.propka_version(
+        params['propka'].get('in_process'))
+    add('propka', 'propka', [params['propka'], propka_version],
+        propka_stage, params['propka'], requires=['reduce'])
+    add('tleap', 'tleap',
+        [name, params['tleap'], params['antechamber'],
+         template_contents(params['tleap']['template']),
+         shutil.which('tleap')],
+        tleap_stage, name, params['antechamber'], params['tleap'],
+        requires=['antechamber', 'reduce', 'propka'])
+    return protocol
+
+
+def template_contents(template):
+    """Contents of the tleap template files (.in and .py) of template"""
+    contents = []
+    for extension in ['.in', '.py']:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'tleap', template + extension)
+        if os.path.isfile(path):
+            with open(path) as f:
+                contents.append(f.read())
+    return contents
+
+
+def antechamber_stage(directory, ligand_pdb, params, create_frcmod, cache,
+                      reuse=False):
+    """Directory to include for the ligand parameters (or None)"""
+    if reuse:
+        return os.path.abspath(directory) if create_frcmod else None
+    antechamber = wrappers.AntechamberWrapper(
+        ligand_pdb, params['ligand'], params['charge'],
+        working_directory=directory, create_frcmod=create_frcmod,
+        cache=cache
+    )
+    return antechamber.working_directory if create_frcmod else None
+
+
+def reduce_stage(directory, pdb, stream=False, debug=False, reuse=False):
+    """wrappers.Pdb4AmberReduceWrapper results for pdb"""
+    return wrappers.Pdb4AmberReduceWrapper(pdb, directory, reuse, stream,
+                                           debug)
+
+
+def propka_stage(directory, params, reduce_results, reuse=False):
+    """
+    Pdb with titratable residues renamed according to propka, or with a
+    pH sweep (params['ph_sweep'] not empty) wrappers.PropkaSweepWrapper
+    with one Pdb per distinct protonation state
+    params['in_process'] chooses between the propka Python API and
+    propka31 as in wrappers.PropkaWrapper.
+    """
+    pdb = reduce_results.pdb
+    found = wrappers.propka_version(params.get('in_process')) is not None
+    # Run propka if requested and found
+    if params['with_propka']:
+        if found and params['ph_sweep']:
+            sweep = wrappers.PropkaSweepWrapper(
+                pdb,
+                params['ph_sweep'],
+                ph_offset=params['ph_offset'],
+                working_directory=directory,
+                reuse=reuse,
+                in_process=params.get('in_process')
+            )
+            with open(os.path.join(directory, 'ph_states.json'), 'w') as f:
+                json.dump(sweep.summary(), f, indent=2)
+            return sweep
+        elif found:
+            pdb = wrappers.PropkaWrapper(
+                pdb,
+                ph=params['ph'],
+                ph_offset=params['ph_offset'],
+                working_directory=directory,
+                reuse=reuse,
+                in_process=params.get('in_process')
+            ).pdb
+        else:
+            print("propka cannot be imported and propka31 cannot be "
+                  "found in $PATH.\n"
+                  "WARNING: all ASP/GLU will be treated as unprotonated.")
+    return pdb
+
+
+def tleap_stage(directory, name, ligand_params, params, ligand_include,
+                reduce_results, pdb, reuse=False):
+    """
+    Runs tleap for pdb, or for every protonation state of a pH sweep in
+    subdirectories state_<n> (numbered as in propka/ph_states.json).
+    If params['sweep'] lists overrides of params (e.g. solvent_radius),
+    the dry system is built once and solvated for each of them, see
+    wrappers.TleapSweepWrapper.
+    With params['pool_workers'] > 0 tleap runs in warm workers that
+    keep the force fields loaded across systems, see tleap_pool. A job
+    running longer than params['pool_timeout'] seconds fails the stage.
+    The sphere_np template solvates with NumPy (see solvent) instead of
+    solvatecap, from the TIP3PBOX of the OFF library params['solvent_box']
+    (by default solvents.lib of $AMBERHOME).
+    """
+    if reuse:
+        return
+    if isinstance(pdb, wrappers.PropkaSweepWrapper):
+        utils.make_working_directory(directory)
+        for index, state in enumerate(pdb.states):
+            tleap_stage(
+                os.path.join(directory, 'state_{}'.format(index + 1)),
+                name, ligand_params, params, ligand_include, reduce_results,
+                state['pdb']
+            )
+        return
+    params = dict(params)
+    params['include'] = list(params['include'])
+    if ligand_include is not None:
+        params['include'].append(ligand_include)
+    ligand = pdb.get_residues_by_name(
+        ligand_params['ligand'])[ligand_params['ligand_index']-1]
+    params['name'] = name
+    params['pdb'] = pdb
+    params['ligand'] = ligand
+    params['water_pdb'] = reduce_results.waterPdb
+    if params['sweep']:
+        wrappers.TleapSweepWrapper(params['template'],
+                                   params['include'],
+                                   reduce_results.nonprot_residues,
+                                   params, params['sweep'],
+                                   working_directory=directory)
+        return
+    wrappers.TleapWrapper(params['template'],
+                          params['include'],
+                          reduce_results.nonprot_residues,
+                          params, working_directory=directory)
+
+
+def model_numbers(text):
+    """'all' or list of model numbers given as comma-separated text"""
+    if text == 'all':
+        return text
+    try:
+        return [int(number) for number in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected comma-separated model numbers or 'all'")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument("pdb", help="protonated PDB file")
+    parser.add_argument("ligand",
+                        help="name of the residue to be used as the ligand")
+    parser.add_argument("charge", help="charge of the ligand", type=int)
+    parser.add_argument("params", help="JSON file with advanced parameters",
+                        type=argparse.FileType(), nargs='?')
+    parser.add_argument("--models", type=model_numbers,
+                        help="prep these MODELs of an ensemble PDB file "
+                             "(comma-separated numbers or 'all')")
+
+    args = parser.parse_args()
+
+    params = None
+    if args.params is not None:
+        params = json.load(args.params)
+        args.params.close()
+    if args.models is not None:
+        params = utils.merge_dicts_of_dicts(
+            params or {}, {'pipeline': {'models': args.models}})
+
+    run(args.pdb, args.ligand, args.charge, params)
+
+
+if __name__ == '__main__':
+    main()
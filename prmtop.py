@@ -0,0 +1,245 @@
+"""
+Lazy readers of the AMBER topology (prmtop) and coordinate (rst7/inpcrd)
+files written by tleap.
+
+Prmtop memory-maps the file and only indexes the offsets of its %FLAG
+sections; a section is decoded into an array when it is first asked for.
+Rst7 decodes the coordinates the same way. verify uses both to check tleap
+output (atom counts, total charge, waters) without reading whole files.
+"""
+import mmap
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# CHARGE is stored in units of e * 18.2223 (sqrt of Coulomb's constant)
+CHARGE_FACTOR = 18.2223
+# Index of counts in the POINTERS section
+POINTER_NAMES = ('NATOM', 'NTYPES', 'NBONH', 'MBONA', 'NTHETH', 'MTHETA',
+                 'NPHIH', 'MPHIA', 'NHPARM', 'NPARM', 'NNB', 'NRES')
+WATER_RESIDUES = ('WAT', 'HOH')
+RST7_WIDTH = 12
+FORMAT = re.compile(rb'\(\s*(\d+)\s*([aAiIeEfF])(\d+)')
+
+
+class Prmtop(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.sections = {}  # name: (type, width, start, end)
+        self._cache = {}
+        self._index()
+
+    def _index(self):
+        buffer = self.buffer
+        flags = []
+        position = buffer.find(b'%FLAG')
+        while position != -1:
+            flags.append(position)
+            position = buffer.find(b'%FLAG', position + 1)
+        for flag, end in zip(flags, flags[1:] + [len(buffer)]):
+            line_end = buffer.find(b'\n', flag, end)
+            name = buffer[flag + len(b'%FLAG'):line_end].strip().decode()
+            start = line_end + 1
+            kind, width = 'a', 80
+            # %FORMAT and %COMMENT lines before the data
+            while buffer[start:start + 1] == b'%':
+                line_end = buffer.find(b'\n', start, end)
+                if line_end == -1:
+                    line_end = end
+                match = FORMAT.search(buffer[start:line_end])
+                if buffer[start:start + 7] == b'%FORMAT' and match:
+                    kind = match.group(2).decode().lower()
+                    width = int(match.group(3))
+                start = line_end + 1
+            self.sections[name] = (kind, width, min(start, end), end)
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def section(self, name):
+        """
+        Values of section name: array of str, int or float (list without
+        numpy), decoded on first use
+        """
+        if name not in self._cache:
+            if name not in self.sections:
+                raise KeyError("{} has no section {}"
+                               .format(self.filename, name))
+            kind, width, start, end = self.sections[name]
+            self._cache[name] = decode_fixed_width(
+                self.buffer[start:end], width, kind)
+        return self._cache[name]
+
+    def pointers(self):
+        """dict of the named counts of the POINTERS section"""
+        return dict(zip(POINTER_NAMES,
+                        (int(value) for value in self.section('POINTERS'))))
+
+    @property
+    def natom(self):
+        return self.pointers()['NATOM']
+
+    @property
+    def nres(self):
+        return self.pointers()['NRES']
+
+    def total_charge(self):
+        """Sum of the atom charges in units of e"""
+        charges = self.section('CHARGE')
+        total = charges.sum() if np is not None else sum(charges)
+        return float(total) / CHARGE_FACTOR
+
+    def residue_sizes(self):
+        """Number of atoms of every residue, in order"""
+        starts = self.section('RESIDUE_POINTER')
+        if np is not None:
+            return np.diff(starts, append=self.natom + 1)
+        return [end - start for start, end in
+                zip(starts, starts[1:] + [self.natom + 1])]
+
+    def count_residues(self, names):
+        """Number of residues with a label in names"""
+        labels = self.section('RESIDUE_LABEL')
+        if np is not None:
+            return int(np.isin(labels, list(names)).sum())
+        names = set(names)
+        return sum(label in names for label in labels)
+
+    def count_atoms(self, names):
+        """Number of atoms in residues with a label in names"""
+        labels = self.section('RESIDUE_LABEL')
+        sizes = self.residue_sizes()
+        if np is not None:
+            return int(sizes[np.isin(labels, list(names))].sum())
+        names = set(names)
+        return sum(size for label, size in zip(labels, sizes)
+                   if label in names)
+
+    def close(self):
+        self.buffer.close()
+
+
+class Rst7(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        title_end = self.buffer.find(b'\n')
+        counts_end = self.buffer.find(b'\n', title_end + 1)
+        counts = self.buffer[title_end + 1:counts_end].split()
+        self.title = self.buffer[:title_end].decode().strip()
+        self.natom = int(counts[0])
+        self.time = float(counts[1]) if len(counts) > 1 else None
+        self._start = counts_end + 1
+        self._coordinates = None
+
+    def coordinates_end(self):
+        """
+        Offset of the end of the coordinates, which fill lines of 6 values,
+        or None if the file is too short to hold them
+        """
+        values = self.natom * 3
+        end = self._start + values * RST7_WIDTH + -(-values // 6)
+        if self.buffer[end - 1:end] == b'\n':
+            return end
+        # Other line endings, find the end line by line
+        end = self._start
+        for _ in range(-(-values // 6)):
+            end = self.buffer.find(b'\n', end) + 1
+            if end == 0:
+                return None
+        return end
+
+    def coordinates(self):
+        """(natom, 3) array (list of lists without numpy) of coordinates"""
+        if self._coordinates is None:
+            end = self.coordinates_end()
+            if end is None:
+                raise ValueError("{} is truncated".format(self.filename))
+            values = decode_fixed_width(self.buffer[self._start:end],
+                                        RST7_WIDTH, 'f')[:self.natom * 3]
+            if np is not None:
+                self._coordinates = values.reshape(-1, 3)
+            else:
+                self._coordinates = [values[i:i + 3]
+                                     for i in range(0, len(values), 3)]
+        return self._coordinates
+
+    def close(self):
+        self.buffer.close()
+
+
+def decode_fixed_width(data, width, kind):
+    """
+    Values of type kind ('a' str, 'i' int, 'e'/'f' float) in fields of
+    width characters filling the lines of data
+    """
+    data = data.replace(b'\r', b'').replace(b'\n', b'')
+    if kind == 'a':
+        # The last field of a line may be shorter than width
+        data = data + b' ' * (-len(data) % width)
+    count = len(data) // width
+    if np is not None:
+        fields = np.frombuffer(data, dtype='S{}'.format(width), count=count)
+        if kind == 'a':
+            return np.char.strip(fields.astype(str))
+        return fields.astype(np.int64 if kind == 'i' else np.float64)
+    convert = {'a': lambda field: field.decode().strip(),
+               'i': int}.get(kind, float)
+    return [convert(data[i:i + width]) for i in range(0, count * width, width)]
+
+
+def verify(prmtop_file, rst7_file, pdb=None, charge_tolerance=0.01):
+    """
+    dict describing the system in prmtop_file and rst7_file (atoms,
+    residues, waters, charge) with a list of 'problems': atom counts that
+    differ between the files or from the non-water atoms of pdb (the
+    structure given to tleap), missing sections or a non-integer total
+    charge, which points to missing or wrong parameters.
+    """
+    prmtop = Prmtop(prmtop_file)
+    rst7 = Rst7(rst7_file)
+    problems = []
+    try:
+        missing = [name for name in ['POINTERS', 'CHARGE', 'RESIDUE_LABEL',
+                                     'RESIDUE_POINTER']
+                   if name not in prmtop]
+        if missing:
+            return {'problems': ["{} has no {} section".format(
+                prmtop_file, ', '.join(missing))]}
+        solute_atoms = prmtop.natom - prmtop.count_atoms(WATER_RESIDUES)
+        report = {
+            'atoms': prmtop.natom,
+            'residues': prmtop.nres,
+            'waters': prmtop.count_residues(WATER_RESIDUES),
+            'solute_atoms': solute_atoms,
+            'charge': round(prmtop.total_charge(), 4),
+            'coordinates': rst7.natom
+        }
+        if rst7.natom != prmtop.natom:
+            problems.append("{} has {} atoms, {} has {}".format(
+                prmtop_file, prmtop.natom, rst7_file, rst7.natom))
+        elif rst7.coordinates_end() is None:
+            problems.append("{} is truncated".format(rst7_file))
+        if abs(report['charge'] - round(report['charge'])) > charge_tolerance:
+            problems.append("Total charge {:.4f} is not an integer"
+                            .format(report['charge']))
+        if pdb is not None:
+            expected = sum(atom['resName'] not in WATER_RESIDUES
+                           for atom in pdb.atoms)
+            if expected != solute_atoms:
+                problems.append(
+                    "tleap changed the number of non-water atoms from {} "
+                    "to {}".format(expected, solute_atoms))
+        report['problems'] = problems
+        return report
+    finally:
+        prmtop.close()
+        rst7.close()
@@ -0,0 +1,184 @@
+"""
+asyncio-based runner for the external tools (antechamber, parmchk2,
+pdb4amber, reduce, propka31, tleap).
+
+The combined stdout/stderr of a command is streamed into its log file while
+the command runs. The child is reaped with os.wait4, which gives its exit
+status together with its own resource usage, so every RunResult reports
+wall time, CPU time and peak memory of the tool. Many commands can run
+concurrently from one event loop (see run_all). stream connects commands
+with pipes and yields the output of the last one line by line.
+"""
+import asyncio
+import collections
+import io
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+
+CHUNK_SIZE = 1 << 16
+
+RunResult = collections.namedtuple('RunResult', [
+    'args',       # command as list of arguments
+    'returncode',  # exit code, negative signal number if killed
+    'wall_time',  # seconds
+    'cpu_time',   # user + system seconds of the child
+    'max_rss',    # peak resident set size of the child in kB
+    'timed_out'   # True if the command was killed after timeout
+])
+
+
+async def run_command(command, output, cwd=None, timeout=None):
+    """
+    Runs command (list of arguments or a string split like a shell would)
+    with stdout and stderr streamed into the file output. The command is
+    killed after timeout seconds or if the coroutine is cancelled.
+    """
+    args = shlex.split(command) if isinstance(command, str) else command
+    loop = asyncio.get_running_loop()
+    with open(output, 'wb') as log:
+        start = time.monotonic()
+        proc = subprocess.Popen(args, cwd=cwd, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                start_new_session=True)
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), proc.stdout)
+        wait = loop.run_in_executor(None, os.wait4, proc.pid, 0)
+
+        async def stream():
+            while True:
+                chunk = await reader.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                log.write(chunk)
+                log.flush()
+            return await asyncio.shield(wait)
+
+        timed_out = False
+        try:
+            _, status, usage = await asyncio.wait_for(stream(), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            _, status, usage = await kill(proc, wait)
+        except asyncio.CancelledError:
+            await kill(proc, wait)
+            raise
+        finally:
+            transport.close()
+
+    # Already reaped by wait4, keeps Popen from waiting for it again
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return RunResult(args, proc.returncode, time.monotonic() - start,
+                     usage.ru_utime + usage.ru_stime, usage.ru_maxrss,
+                     timed_out)
+
+
+async def kill(proc, wait):
+    """Kills the process group of proc and returns the wait4 result"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    return await asyncio.shield(wait)
+
+
+async def run_all(commands, limit=None):
+    """
+    Runs (command, output, cwd) tuples concurrently, at most limit at a
+    time, and returns their RunResults in order.
+    """
+    semaphore = asyncio.Semaphore(limit or len(commands) or 1)
+
+    async def limited(command, output, cwd=None):
+        async with semaphore:
+            return await run_command(command, output, cwd)
+
+    return await asyncio.gather(*[limited(*command) for command in commands])
+
+
+def run(command, output, cwd=None, timeout=None):
+    """Synchronous run_command"""
+    return asyncio.run(run_command(command, output, cwd, timeout))
+
+
+def summarize(results):
+    """
+    dict of tool name: {'calls', 'wall_time', 'cpu_time', 'max_rss'}
+    aggregated over RunResults
+    """
+    summary = {}
+    for result in results:
+        tool = summary.setdefault(os.path.basename(result.args[0]), {
+            'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'max_rss': 0
+        })
+        tool['calls'] += 1
+        tool['wall_time'] += result.wall_time
+        tool['cpu_time'] += result.cpu_time
+        tool['max_rss'] = max(tool['max_rss'], result.max_rss)
+    return summary
+
+
+def stream(commands, input, output, cwd=None, results=None):
+    """
+    Runs commands connected by pipes, the first one reading input (str)
+    on its stdin, and yields the stdout of the last one line by line as it
+    arrives. stderr of all commands goes to the file output. RunResults of
+    the commands are appended to results once the output is exhausted;
+    the commands are killed if the generator is closed before.
+    """
+    commands = [shlex.split(command) if isinstance(command, str) else command
+                for command in commands]
+    procs = []
+    start = time.monotonic()
+    with open(output, 'wb') as log:
+        stdin = subprocess.PIPE
+        for args in commands:
+            procs.append(subprocess.Popen(
+                args, cwd=cwd, stdin=stdin, stdout=subprocess.PIPE,
+                stderr=log, start_new_session=True
+            ))
+            if stdin is not subprocess.PIPE:
+                # Only the next command should hold the read end
+                stdin.close()
+            stdin = procs[-1].stdout
+
+    def feed():
+        try:
+            procs[0].stdin.write(input.encode())
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                procs[0].stdin.close()
+            except BrokenPipeError:
+                pass
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    finished = False
+    try:
+        with io.TextIOWrapper(procs[-1].stdout) as lines:
+            yield from lines
+        finished = True
+    finally:
+        if not finished:
+            for proc in procs:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        writer.join()
+        for args, proc in zip(commands, procs):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            if results is not None:
+                results.append(RunResult(
+                    args, proc.returncode, time.monotonic() - start,
+                    usage.ru_utime + usage.ru_stime, usage.ru_maxrss,
+                    False
+                ))
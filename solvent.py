@@ -0,0 +1,147 @@
+"""
+Solvation of a sphere around a point with NumPy, the equivalent of tleap's
+solvatecap.
+
+A pre-equilibrated water box (TIP3PBOX from AMBER's solvents.lib) is tiled
+over the sphere, the waters with the oxygen outside the sphere are dropped
+and so are the waters clashing with solute atoms: a solvent atom i clashes
+with a solute atom j closer than (r_i + r_j) * closeness, with r the van der
+Waals radii. All water atoms are tested at once against a spatial.CellList
+of the solute.
+"""
+import functools
+import os
+import pdb_utils
+import spatial
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only required for solvation
+    np = None
+
+# Approximate AMBER (ff14SB/GAFF) van der Waals radii (Rmin/2) by element
+VDW_RADII = {'H': 1.1, 'C': 1.908, 'N': 1.824, 'O': 1.6612, 'S': 2.0,
+             'P': 2.1, 'F': 1.75, 'CL': 1.948, 'BR': 2.02, 'I': 2.15,
+             'NA': 1.369, 'K': 1.705, 'MG': 0.7926, 'CA': 1.79, 'ZN': 1.1,
+             'FE': 1.2}
+DEFAULT_RADIUS = 1.908
+# TIP3P radii by element of the water atoms
+WATER_RADII = {'O': 1.7683, 'H': 0.0}
+WATER_NAMES = ('O', 'H1', 'H2')
+SOLVENT_LIBRARY = os.path.join('dat', 'leap', 'lib', 'solvents.lib')
+
+
+class SolventBox(object):
+    """Periodic box of solvent residues, all with the same atoms"""
+
+    def __init__(self, names, coords, lengths):
+        self.names = list(names)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(
+            -1, len(self.names), 3)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.radii = np.array([WATER_RADII.get(name[:1], DEFAULT_RADIUS)
+                               for name in self.names])
+
+    @classmethod
+    def from_library(cls, filename, unit='TIP3PBOX'):
+        """Box of unit in an AMBER OFF library (e.g. solvents.lib)"""
+        if np is None:
+            raise ImportError("Solvation requires numpy")
+        sections = {}
+        section = None
+        prefix = '!entry.{}.unit.'.format(unit)
+        with open(filename) as f:
+            for line in f:
+                if line.startswith('!'):
+                    section = None
+                    if line.startswith(prefix):
+                        section = line[len(prefix):].split()[0]
+                        sections[section] = []
+                elif section is not None:
+                    sections[section].append(line.split())
+        if not {'atoms', 'positions', 'boundbox'} <= set(sections):
+            raise ValueError("{} has no solvent box {}"
+                             .format(filename, unit))
+        atoms = sections['atoms']
+        # Columns: name, type, typex, resx, ...
+        residues = [int(atom[3]) for atom in atoms]
+        size = residues.count(residues[0])
+        names = [atom[0].strip('"') for atom in atoms[:size]]
+        lengths = [float(value[0]) for value in sections['boundbox'][2:5]]
+        return cls(names, [[float(value) for value in position]
+                           for position in sections['positions']], lengths)
+
+
+@functools.lru_cache(maxsize=4)
+def load_box(filename, unit='TIP3PBOX'):
+    """SolventBox.from_library, read once per process"""
+    return SolventBox.from_library(filename, unit)
+
+
+def solvate_sphere(solute_coords, solute_radii, center, radius, closeness,
+                   box):
+    """
+    (waters, names, 3) array of the solvent residues of box filling the
+    sphere of radius around center without clashing with the solute
+    """
+    center = np.asarray(center, dtype=np.float64)
+    oxygens = box.coords[:, 0]
+    base = box.coords - (oxygens.min(axis=0) + oxygens.max(axis=0)) / 2
+
+    # Copies of the box covering the sphere
+    counts = np.ceil(radius / box.lengths + 0.5).astype(np.int64)
+    shifts = np.stack(np.meshgrid(*[np.arange(-count, count + 1)
+                                    for count in counts], indexing='ij'),
+                      axis=-1).reshape(-1, 3) * box.lengths + center
+    distances = np.linalg.norm(base[None, :, 0] + shifts[:, None] - center,
+                               axis=2)
+    copies, residues = np.nonzero(distances <= radius)
+    waters = base[residues] + shifts[copies][:, None]
+
+    solute_coords = np.asarray(solute_coords, dtype=np.float64).reshape(-1, 3)
+    if not len(waters) or not len(solute_coords):
+        return waters
+    solute_radii = np.asarray(solute_radii, dtype=np.float64)
+    cutoff = (solute_radii.max() + box.radii.max()) * closeness
+    cell_list = spatial.CellList(solute_coords, cell_size=max(cutoff, 1.0))
+    water_atoms, solute_atoms, distances = cell_list.pairs(
+        waters.reshape(-1, 3), cutoff)
+    atom_radii = np.tile(box.radii, len(waters))
+    clashes = distances < ((atom_radii[water_atoms] +
+                            solute_radii[solute_atoms]) * closeness)
+    keep = np.ones(len(waters), dtype=bool)
+    keep[water_atoms[clashes] // len(box.names)] = False
+    return waters[keep]
+
+
+def atom_radii(pdb):
+    """van der Waals radii of the atoms of pdb by element"""
+    radii = np.full(len(pdb.coordinates()), DEFAULT_RADIUS)
+    for element, radius in VDW_RADII.items():
+        radii[np.asarray(pdb.where(element=element), dtype=bool)] = radius
+    return radii
+
+
+def write_waters(filename, waters, names=WATER_NAMES, resName='WAT'):
+    """
+    Writes waters as a PDB file. Serial and residue numbers wrap around
+    as the fields are too narrow for large spheres.
+    """
+    formats = [pdb_utils.ATOM_FORMATS[len(name) > 2] for name in names]
+    lines = []
+    for index, water in enumerate(waters.tolist()):
+        resSeq = index % 9999 + 1
+        for offset, (x, y, z) in enumerate(water):
+            serial = (index * len(names) + offset) % 99999 + 1
+            lines.append(formats[offset] % (
+                'ATOM', serial, names[offset], '', resName, '', resSeq, '',
+                x, y, z, 1.0, 0.0, names[offset][:1], '', '\n'))
+    with open(filename, 'w') as f:
+        f.write(''.join(lines) + "TER\nEND\n")
+
+
+def default_library():
+    """solvents.lib of $AMBERHOME"""
+    if 'AMBERHOME' not in os.environ:
+        raise AssertionError("$AMBERHOME not set")
+    return os.path.join(os.environ['AMBERHOME'], SOLVENT_LIBRARY)
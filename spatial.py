@@ -0,0 +1,139 @@
+"""
+Cell-list spatial index over atom coordinates.
+
+Atoms are binned into cubic cells of a fixed size. A radius query only
+looks at the cells overlapping the query sphere and computes distances for
+the atoms in them with array operations.
+"""
+try:
+    import numpy as np
+except ImportError:  # numpy is only required for spatial queries
+    np = None
+
+
+class CellList(object):
+
+    def __init__(self, coords, cell_size=5.0):
+        if np is None:
+            raise ImportError("Spatial queries require numpy")
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        self.cell_size = float(cell_size)
+        if len(self.coords):
+            self.origin = self.coords.min(axis=0)
+            self.shape = (np.floor((self.coords.max(axis=0) - self.origin) /
+                                   self.cell_size).astype(np.int64) + 1)
+        else:
+            self.origin = np.zeros(3)
+            self.shape = np.ones(3, dtype=np.int64)
+        cell_ids = self._cell_ids(self._cells(self.coords))
+        # Atom indices sorted by cell; atoms of cell c are
+        # self.order[self.starts[c]:self.starts[c+1]]
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.starts = np.searchsorted(cell_ids[self.order],
+                                      np.arange(np.prod(self.shape) + 1))
+
+    def __len__(self):
+        return len(self.coords)
+
+    def _cells(self, points):
+        return np.floor((points - self.origin) /
+                        self.cell_size).astype(np.int64)
+
+    def _cell_ids(self, cells):
+        return (cells[..., 0] + self.shape[0] *
+                (cells[..., 1] + self.shape[1] * cells[..., 2]))
+
+    def candidates(self, points, radius):
+        """Indices of atoms in cells overlapping any of the query spheres"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        low = np.maximum(self._cells(points - radius), 0)
+        high = np.minimum(self._cells(points + radius), self.shape - 1)
+        cells = set()
+        for lo, hi in zip(low, high):
+            if (lo > hi).any():
+                continue
+            grid = np.stack(np.meshgrid(*[np.arange(start, stop + 1)
+                                          for start, stop in zip(lo, hi)],
+                                        indexing='ij'), axis=-1)
+            cells.update(self._cell_ids(grid).ravel().tolist())
+        if not cells:
+            return np.zeros(0, dtype=np.int64)
+        cells = np.fromiter(cells, dtype=np.int64, count=len(cells))
+        return np.concatenate([self.order[self.starts[c]:self.starts[c + 1]]
+                               for c in cells])
+
+    def within(self, point, radius):
+        """Indices of atoms within radius of point, sorted by distance"""
+        point = np.asarray(point, dtype=np.float64)
+        candidates = self.candidates(point, radius)
+        distances = np.linalg.norm(self.coords[candidates] - point, axis=1)
+        selected = distances <= radius
+        return candidates[selected][np.argsort(distances[selected],
+                                               kind='stable')]
+
+    def within_any(self, points, radius, chunk_size=4096):
+        """Boolean mask of atoms within radius of any of points"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        mask = np.zeros(len(self), dtype=bool)
+        candidates = self.candidates(points, radius)
+        for start in range(0, len(candidates), chunk_size):
+            chunk = candidates[start:start + chunk_size]
+            distances = np.linalg.norm(self.coords[chunk, None, :] -
+                                       points[None, :, :], axis=2)
+            mask[chunk[(distances <= radius).any(axis=1)]] = True
+        return mask
+
+    def pairs(self, points, radius):
+        """
+        (point indices, atom indices, distances) of all pairs of points and
+        atoms within radius, found for all points at once cell by cell
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        cells = self._cells(points)
+        reach = int(np.ceil(radius / self.cell_size))
+        steps = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'),
+                           axis=-1).reshape(-1, 3)
+        found = ([], [], [])
+        for offset in offsets:
+            neighbours = cells + offset
+            inside = np.flatnonzero(((neighbours >= 0) &
+                                     (neighbours < self.shape)).all(axis=1))
+            ids = self._cell_ids(neighbours[inside])
+            starts = self.starts[ids]
+            counts = self.starts[ids + 1] - starts
+            if not counts.sum():
+                continue
+            # Every point paired with each atom of its neighbour cell
+            point_indices = np.repeat(inside, counts)
+            positions = (np.arange(counts.sum()) +
+                         np.repeat(starts - (np.cumsum(counts) - counts),
+                                   counts))
+            atom_indices = self.order[positions]
+            distances = np.linalg.norm(points[point_indices] -
+                                       self.coords[atom_indices], axis=1)
+            close = distances <= radius
+            for result, values in zip(found, [point_indices, atom_indices,
+                                              distances]):
+                result.append(values[close])
+        if not found[0]:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                    np.zeros(0))
+        return tuple(np.concatenate(result) for result in found)
+
+    def nearest(self, point, k=1):
+        """Indices of the k atoms closest to point, closest first"""
+        k = min(k, len(self))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64)
+        point = np.asarray(point, dtype=np.float64)
+        # Distance from point to the grid plus one cell is a safe start
+        radius = (np.linalg.norm(np.maximum(self.origin - point, 0) +
+                                 np.maximum(point - self.origin -
+                                            self.shape * self.cell_size, 0)) +
+                  self.cell_size)
+        while True:
+            found = self.within(point, radius)
+            if len(found) >= k:
+                return found[:k]
+            radius *= 2
@@ -0,0 +1,194 @@
+import os
+import tempfile
+import threading
+import unittest
+from io import StringIO
+import atom_table
+import pdb_utils
+
+
+@unittest.skipIf(atom_table.np is None, "numpy is not installed")
+class TestAtomTable(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open('tests/test_files/full.pdb') as f:
+            cls.pdb = pdb_utils.Pdb(f)
+        with open('tests/test_files/full.pdb') as f:
+            cls.columnar_pdb = pdb_utils.Pdb(f, columnar=True)
+
+    def test_from_atoms(self):
+        table = self.columnar_pdb.atoms
+        self.assertIsInstance(table, atom_table.AtomTable)
+        self.assertEqual(len(table), 2236)
+        self.assertEqual(table.to_atoms(), self.pdb.atoms)
+        self.assertEqual(table[5], self.pdb.atoms[5])
+        self.assertEqual(len(table.columns['resName'].categories), 22)
+
+    def test_view(self):
+        view = self.columnar_pdb.atoms[0]
+        self.assertEqual(view['name'], "N")
+        self.assertEqual(view['resSeq'], 26)
+        self.assertIsInstance(view['resSeq'], int)
+        self.assertEqual(view['x'], 2.61)
+        with self.assertRaises(KeyError):
+            view['missing']
+
+    def test_modify_view(self):
+        pdb = self.columnar_pdb.copy()
+        pdb.atoms[0]['resName'] = "XXX"
+        pdb.atoms[1]['x'] = 1.5
+        self.assertEqual(pdb.atoms[0]['resName'], "XXX")
+        self.assertEqual(pdb.atoms[1]['x'], 1.5)
+        self.assertEqual(self.columnar_pdb.atoms[0]['resName'], "HIS")
+
+    def test_versions(self):
+        table = self.columnar_pdb.atoms.copy()
+        version = table.version
+        table[0]['x'] = 1.0
+        self.assertGreater(table.version, version)
+        version = table.version
+        table.modify(slice(None, 2), 'resName', 'XXX')
+        table.remove(table[1])
+        self.assertGreater(table.version, version)
+        self.assertLess(self.columnar_pdb.atoms.version, version)
+
+        versions = []
+
+        def count():
+            versions.extend(atom_table.next_version()
+                            for _ in range(10000))
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(versions)), 40000)
+
+    def test_groups(self):
+        table = self.columnar_pdb.atoms.copy()
+        table.remove(table[0])
+        # Into the first residue, after atoms of other residues
+        table[20]['resSeq'] = 26
+        table[20]['resName'] = 'HIS'
+        groups = table.groups(pdb_utils.RESIDUE_KEYS)
+        residues = pdb_utils.ResidueIndex(list(table)).residues
+        self.assertEqual([key for key, _ in groups], list(residues))
+        self.assertEqual(dict(groups), residues)
+        self.assertEqual(len(groups[0][1]), 10)
+        self.assertIs(groups[0][1][-1].table, table)
+        self.assertEqual(table.take(slice(0)).groups(['resName']), [])
+
+    def test_copy_on_write(self):
+        table = self.columnar_pdb.atoms.copy()
+        water = table.isin('resName', {'HOH'})
+        view = table.view(water)
+        self.assertIs(view.columns['resName'], table.columns['resName'])
+        self.assertEqual(len(view), water.sum())
+        view.modify(slice(None), 'resName', 'WAT')
+        view[0]['x'] = 0.0
+        self.assertIsNot(view.columns['resName'], table.columns['resName'])
+        self.assertEqual(set(table.column('resName')[water]), {'HOH'})
+        self.assertNotEqual(table[int(water.argmax())]['x'], 0.0)
+        self.assertIs(view.columns['name'], table.columns['name'])
+
+    def test_masks(self):
+        table = self.columnar_pdb.atoms
+        hetatm = table.isin('record', {'HETATM'})
+        self.assertEqual(hetatm.sum(),
+                         sum(atom['record'] == 'HETATM'
+                             for atom in self.pdb.atoms))
+        self.assertEqual(table.isin('resSeq', [26]).sum(), 10)
+        self.assertEqual(table.contains('name', 'G').sum(),
+                         sum('G' in atom['name'] for atom in self.pdb.atoms))
+
+    def test_modify_and_take(self):
+        table = self.columnar_pdb.atoms.copy()
+        water = table.isin('resName', {'HOH'})
+        table.modify(water, 'chainID', 'W')
+        waters = table.take(water)
+        self.assertEqual(set(waters.column('chainID')), {'W'})
+        self.assertEqual(len(waters), water.sum())
+
+    def test_remove_keeps_views(self):
+        table = self.columnar_pdb.atoms.copy()
+        last = table[20]
+        table.remove(table[10])
+        self.assertEqual(len(table), 2235)
+        self.assertEqual(last, self.pdb.atoms[20])
+        self.assertEqual(table[19], last)
+
+    def test_dump_pdb_to_file(self):
+        result_file = StringIO()
+        self.columnar_pdb.to_file(result_file)
+        with open('tests/test_files/only_atoms.pdb', 'r') as pdb_file:
+            self.assertEqual(pdb_file.read(), result_file.getvalue())
+
+
+@unittest.skipIf(atom_table.np is None, "numpy is not installed")
+class TestParsePdbBuffer(unittest.TestCase):
+
+    def test_from_filename(self):
+        for name in ['full', 'reduce', 'pdb4amber_nonprot']:
+            filename = 'tests/test_files/{}.pdb'.format(name)
+            with open(filename) as f:
+                expected = pdb_utils.Pdb(f)
+            result = pdb_utils.Pdb.from_filename(filename)
+            self.assertIsInstance(result.atoms, atom_table.AtomTable)
+            self.assertEqual(result.atoms.to_atoms(), expected.atoms)
+            self.assertEqual(result.ter, expected.ter)
+            self.assertEqual(result.conect, expected.conect)
+            self.assertEqual(result.other, expected.other)
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pdb = pdb_utils.Pdb.from_filename('tests/test_files/reduce.pdb',
+                                              cache=directory)
+            cached, = os.listdir(directory)
+            self.assertTrue(cached.endswith('.pdbc'))
+            result = pdb_utils.Pdb.from_filename(
+                'tests/test_files/reduce.pdb', cache=directory)
+            self.assertFalse(result.atoms.coords.flags.writeable)
+            self.assertEqual(result.atoms.signature, pdb.atoms.signature)
+            for key in ['ter', 'conect', 'other']:
+                self.assertEqual(getattr(result, key), getattr(pdb, key))
+            expected, written = StringIO(), StringIO()
+            pdb.to_file(expected)
+            result.to_file(written)
+            self.assertEqual(written.getvalue(), expected.getvalue())
+
+            result.modify(result.where(resName='HOH'), 'chainID', 'W')
+            result.atoms[0]['x'] = 0.0
+            self.assertEqual(result.atoms[0]['x'], 0.0)
+            self.assertEqual(len(result.get_residues_by_name('HOH')),
+                             len(pdb.get_residues_by_name('HOH')))
+
+            with open(os.path.join(directory, cached), 'r+b') as f:
+                f.write(b'PDBTEXT!')
+            with self.assertRaisesRegex(ValueError, "not a PDB cache"):
+                pdb_utils.Pdb.from_cache(os.path.join(directory, cached))
+
+    def test_short_lines(self):
+        hetatm = ("HETATM99999  O   HOH W   1      -0.500 1.0e+1  -1.000"
+                  "  0.50  1.00           O   new")
+        table, ter, conect, other = atom_table.parse_pdb_buffer(
+            b"HEADER\r\n"
+            b"ATOM      1  N   HIS A  26       2.610   1.454  10.018\n" +
+            hetatm.encode())
+        self.assertEqual(other, ["HEADER\n"])
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table[0]['element'], "")
+        self.assertEqual(table[0]['occupancy'], 0.0)
+        self.assertEqual(table[1], pdb_utils.parse_atom(hetatm))
+        self.assertEqual(table[1]['y'], 10.0)
+
+    def test_fixed_width_block(self):
+        data = atom_table.np.frombuffer(b"ABCDEF\nGH\nIJKLMNOP", dtype='u1')
+        starts = atom_table.np.array([0, 7, 10, 14])
+        lengths = atom_table.np.array([6, 2, 8, 4])
+        block = atom_table.fixed_width_block(data, starts, lengths, 5)
+        self.assertEqual([bytes(row) for row in block],
+                         [b"ABCDE", b"GH   ", b"IJKLM", b"MNOP "])
+        block = atom_table.fixed_width_block(data[:2], starts[:1],
+                                             lengths[:1] - 4, 5)
+        self.assertEqual(bytes(block[0]), b"AB   ")
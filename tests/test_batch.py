@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+from io import StringIO
+import batch
+import prep
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_read_csv_manifest(self):
+        manifest = StringIO("pdb,ligand,charge,name\n"
+                            "a/1btl.pdb,0RN,-1,\n"
+                            "a/1btl.pdb,0RN,0,neutral\n")
+        jobs = batch.read_manifest(manifest, '/data/manifest.csv')
+        self.assertEqual(jobs, [
+            {'pdb': '/data/a/1btl.pdb', 'ligand': '0RN', 'charge': -1,
+             'params': {}, 'name': '1btl'},
+            {'pdb': '/data/a/1btl.pdb', 'ligand': '0RN', 'charge': 0,
+             'params': {}, 'name': 'neutral'}
+        ])
+
+    def test_read_json_manifest(self):
+        manifest = StringIO('[{"pdb": "/x/1btl.pdb", "ligand": "0RN", '
+                            '"charge": -1, '
+                            '"params": {"propka": {"ph": 5.0}}}]')
+        jobs = batch.read_manifest(manifest, 'manifest.json')
+        self.assertEqual(jobs[0]['params'], {'propka': {'ph': 5.0}})
+        self.assertEqual(jobs[0]['name'], '1btl')
+
+    def test_duplicate_names(self):
+        manifest = StringIO("pdb,ligand,charge\n"
+                            "1btl.pdb,0RN,-1\n"
+                            "1btl.pdb,0RN,0\n")
+        with self.assertRaises(ValueError):
+            batch.read_manifest(manifest, 'manifest.csv')
+
+    @mock.patch('batch.prep.run')
+    def test_run_job(self, mock_run):
+        job = {'pdb': '1btl.pdb', 'ligand': '0RN', 'charge': -1,
+               'params': {'propka': {'ph': 5.0}}, 'name': '1btl'}
+        with tempfile.TemporaryDirectory() as tmp:
+            result = batch.run_job(job, tmp, {'tleap': {'include': []}})
+            mock_run.assert_called_once_with(
+                '1btl.pdb', '0RN', -1,
+                {'propka': {'ph': 5.0}, 'tleap': {'include': []}},
+                os.path.join(tmp, '1btl'))
+            self.assertEqual(result['status'], 'ok')
+
+            mock_run.side_effect = ValueError("No ligands found")
+            result = batch.run_job(job, tmp)
+            self.assertEqual(result['status'], 'failed')
+            self.assertEqual(result['error'], "ValueError: No ligands found")
+            with open(os.path.join(tmp, '1btl.log')) as f:
+                self.assertIn("Traceback", f.read())
+
+    def test_write_summary(self):
+        output = StringIO()
+        batch.write_summary([{'name': '1btl', 'pdb': '1btl.pdb',
+                              'ligand': '0RN', 'charge': -1, 'status': 'ok',
+                              'wall_time': 1.5, 'error': ''}], output)
+        self.assertEqual(output.getvalue().splitlines(), [
+            "name,pdb,ligand,charge,status,wall_time,error",
+            "1btl,1btl.pdb,0RN,-1,ok,1.5,"
+        ])
+
+
+class TestPrepParams(unittest.TestCase):
+
+    def test_get_params(self):
+        params = prep.get_params('0RN', -1, {'propka': {'ph': 5.0}})
+        self.assertEqual(params['propka'],
+                         {'with_propka': True, 'ph': 5.0, 'ph_offset': 0.7,
+                          'ph_sweep': [], 'in_process': None})
+        self.assertEqual(params['antechamber']['ligand'], '0RN')
+        params['tleap']['include'].append('x')
+        self.assertEqual(prep.DEFAULT_PARAMS['tleap']['include'], [])
+
+    def test_get_params_file(self):
+        # Parameters of the PyMOL plugin hold the charge as a float
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'params.json')
+            with open(filename, 'w') as f:
+                json.dump({'antechamber': {'ligand': '0RN', 'charge': -1.0,
+                                           'ligand_index': 2}}, f)
+            with open(filename) as f:
+                params = prep.get_params('0RN', -1, json.load(f))
+        self.assertEqual(params['antechamber']['charge'], -1)
+        self.assertIsInstance(params['antechamber']['charge'], int)
+        self.assertEqual(params['antechamber']['ligand_index'], 2)
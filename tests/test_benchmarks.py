@@ -0,0 +1,112 @@
+import io
+import os
+import tempfile
+import unittest
+import pdb_utils
+import prmtop
+from benchmarks import bench_pdb_utils, bench_pipeline, fake_tools, synthetic
+
+
+class TestSynthetic(unittest.TestCase):
+
+    def test_synthetic_lines(self):
+        lines = synthetic.synthetic_lines(50000)
+        pdb = pdb_utils.Pdb(io.StringIO(''.join(lines)))
+        self.assertEqual(len(pdb.atoms), 50000)
+        self.assertEqual(len(pdb.ter), 3)
+        self.assertEqual(len(pdb.conect), 3 * len(synthetic.LIGAND_BONDS))
+        self.assertEqual(len(pdb.get_residues_by_name('LIG')), 3)
+        self.assertEqual(len(pdb.get_residues_by_name('HOH')),
+                         int(50000 * synthetic.WATER_FRACTION))
+        self.assertEqual({atom['chainID'] for atom in pdb.atoms},
+                         {'A', 'B', 'C', 'W'})
+        self.assertEqual(lines, synthetic.synthetic_lines(50000))
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_run_and_compare(self):
+        results = bench_pdb_utils.run_benchmarks([500], ['list'], repeat=1)
+        self.assertEqual([entry['operation'] for entry in results],
+                         list(bench_pdb_utils.OPERATIONS))
+        self.assertTrue(all(entry['seconds'] >= 0 and entry['peak_mb'] >= 0
+                            for entry in results))
+
+        slower = [dict(entry, seconds=entry['seconds'] * 2 + 0.01)
+                  for entry in results]
+        _, regressions = bench_pdb_utils.compare(slower, results)
+        self.assertEqual(len(regressions), len(results))
+        _, regressions = bench_pdb_utils.compare(results, slower)
+        self.assertEqual(regressions, [])
+
+    @unittest.skipIf(pdb_utils.atom_table.np is None,
+                     "numpy is not installed")
+    def test_columnar_against_list(self):
+        operations = ['residues', 'to_file']
+        results = bench_pdb_utils.run_benchmarks(
+            [20000], ['list', 'columnar'], operations, repeat=3)
+        seconds = {(entry['operation'], entry['backend']): entry['seconds']
+                   for entry in results}
+        for operation in operations:
+            # Generous, timings of shared machines are noisy
+            self.assertLess(seconds[operation, 'columnar'],
+                            2 * seconds[operation, 'list'] + 0.005,
+                            operation)
+
+
+class TestPipelineBenchmark(unittest.TestCase):
+
+    def test_single_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            results = bench_pipeline.run_scenarios(['single'], directory,
+                                                   scale=0.0)
+            metrics = results['single']
+            self.assertGreater(metrics['wall_time'], 0.0)
+            self.assertLessEqual(metrics['critical_path'],
+                                 metrics['wall_time'])
+            tleap = os.path.join(directory, 'single_0', '1btl_0rn', 'tleap')
+            report = prmtop.verify(
+                os.path.join(tleap, '1btl_0rn.sp20.top'),
+                os.path.join(tleap, '1btl_0rn.sp20.rst'))
+            self.assertEqual(report['problems'], [])
+            self.assertGreater(report['waters'], 0)
+
+            # The ligand atoms alone, as prep always wrote them
+            with open(bench_pipeline.EXAMPLE[0]) as f:
+                ligand = pdb_utils.Pdb(f).get_residues_by_name(
+                    bench_pipeline.EXAMPLE[1])[0]
+            expected = io.StringIO()
+            pdb_utils.Pdb(atoms=ligand).to_file(expected)
+            with open(os.path.join(directory, 'single_0', '1btl_0rn',
+                                   'antechamber', 'ligand.pdb')) as f:
+                self.assertEqual(f.read(), expected.getvalue())
+
+    def test_scratch_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            scratch = os.path.join(directory, 'scratch')
+            bench_pipeline.run_scenarios(
+                ['single'], directory, scale=0.0,
+                params={'pipeline': {'scratch': scratch}})
+            prep_directory = os.path.join(directory, 'single_0', '1btl_0rn')
+            with open(os.path.join(prep_directory, 'tleap', 'tleap.in')) as f:
+                tleap_in = f.read()
+            self.assertNotIn(scratch, tleap_in)
+            self.assertIn('loadamberprep ' + os.path.join(
+                os.path.abspath(prep_directory), 'antechamber', '0RN.prepc'),
+                tleap_in)
+
+    def test_scratch_reuse(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Installed once, reinstalling changes the tool versions
+            env = dict(os.environ, **fake_tools.install(
+                os.path.join(directory, 'amber'), scale=0.0))
+            params = bench_pipeline.merge(bench_pipeline.BASE_PARAMS, {
+                'pipeline': {'scratch': os.path.join(directory, 'scratch'),
+                             'incremental': True}})
+            for _ in range(2):
+                bench_pipeline.run_prep(os.path.join(directory, 'prep'), env,
+                                        params)
+            with open(os.path.join(directory, 'prep', 'prep.log')) as f:
+                log = f.read()
+            for stage in ['antechamber', 'reduce', 'propka', 'tleap']:
+                self.assertIn('Inputs of {} unchanged'.format(stage), log)
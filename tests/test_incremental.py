@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+import incremental
+import pdb_utils
+
+
+class TestStageManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.calls = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def stage(self, name, content='output'):
+        directory = os.path.join(self.tmp.name, name)
+
+        def function(*args, reuse=False):
+            self.calls.append((name, reuse))
+            if not reuse:
+                os.makedirs(directory, exist_ok=True)
+                with open(os.path.join(directory, 'out.txt'), 'w') as f:
+                    f.write(content)
+            return name
+        return function, directory
+
+    def run_stages(self, reduce_inputs, tleap_inputs):
+        manifest = incremental.StageManifest(self.tmp.name)
+        reduce, reduce_directory = self.stage('reduce')
+        tleap, tleap_directory = self.stage('tleap')
+        manifest.wrap('reduce', reduce, reduce_directory, reduce_inputs)()
+        manifest.wrap('tleap', tleap, tleap_directory, tleap_inputs,
+                      ['reduce'])('reduce')
+        calls = self.calls
+        self.calls = []
+        return calls
+
+    def test_reuse(self):
+        self.assertEqual(self.run_stages(['a'], {'radius': 20.0}),
+                         [('reduce', False), ('tleap', False)])
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.tmp.name, incremental.MANIFEST)))
+        self.assertEqual(self.run_stages(['a'], {'radius': 20.0}),
+                         [('reduce', True), ('tleap', True)])
+        # Only the stage with changed parameters runs again
+        self.assertEqual(self.run_stages(['a'], {'radius': 25.0}),
+                         [('reduce', True), ('tleap', False)])
+        # Changed upstream inputs invalidate the downstream stages
+        self.assertEqual(self.run_stages(['b'], {'radius': 25.0}),
+                         [('reduce', False), ('tleap', False)])
+
+    def test_changed_outputs(self):
+        self.run_stages(['a'], {})
+        with open(os.path.join(self.tmp.name, 'tleap', 'out.txt'), 'w') as f:
+            f.write('edited')
+        self.assertEqual(self.run_stages(['a'], {}),
+                         [('reduce', True), ('tleap', False)])
+
+    def test_failed_stage(self):
+        manifest = incremental.StageManifest(self.tmp.name)
+        reduce, directory = self.stage('reduce')
+        manifest.wrap('reduce', reduce, directory, ['a'])()
+
+        def fail(reuse=False):
+            raise RuntimeError("reduce failed")
+
+        with self.assertRaises(RuntimeError):
+            manifest.wrap('reduce', fail, directory, ['b'])()
+        manifest = incremental.StageManifest(self.tmp.name)
+        self.assertNotIn('reduce', manifest.entries)
+
+    def test_pdb_digest(self):
+        digests = []
+        for columnar in [False, True]:
+            if columnar and pdb_utils.atom_table.np is None:
+                continue
+            pdb = pdb_utils.Pdb.from_filename(
+                'tests/test_files/only_atoms.pdb', columnar=columnar)
+            digest = incremental.pdb_digest(pdb)
+            digests.append(digest)
+            self.assertEqual(incremental.pdb_digest(pdb.copy()), digest)
+            pdb_utils.modify_atoms(pdb.atoms[:1], 'x', 0.0)
+            self.assertNotEqual(incremental.pdb_digest(pdb), digest)
+        self.assertEqual(len(set(digests)), 1)
@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+import ligand_cache
+import pdb_utils
+import wrappers
+
+
+class TestLigandKey(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open('tests/test_files/pdb4amber_nonprot.pdb') as f:
+            cls.pdb = pdb_utils.Pdb(f)
+
+    def test_order_and_rounding(self):
+        key = ligand_cache.ligand_key(self.pdb, '0RN', -1)
+        for columnar in [False, True]:
+            if columnar and pdb_utils.atom_table.np is None:
+                continue
+            shuffled = pdb_utils.Pdb.from_filename(
+                'tests/test_files/pdb4amber_nonprot.pdb', columnar=columnar)
+            shuffled.atoms = shuffled.atoms[::-1]
+            self.assertEqual(shuffled.atoms[0], self.pdb.atoms[-1])
+            pdb_utils.modify_atoms(shuffled.atoms[:1], 'x',
+                                   shuffled.atoms[0]['x'] + 0.001)
+            self.assertNotEqual(shuffled.atoms[0], self.pdb.atoms[-1])
+            self.assertEqual(ligand_cache.ligand_key(shuffled, '0RN', -1),
+                             key)
+
+    def test_key_changes(self):
+        key = ligand_cache.ligand_key(self.pdb, '0RN', -1)
+        self.assertNotEqual(ligand_cache.ligand_key(self.pdb, '0RN', 0), key)
+        self.assertNotEqual(
+            ligand_cache.ligand_key(self.pdb, '0RN', -1, method='gas'), key)
+        self.assertNotEqual(
+            ligand_cache.ligand_key(self.pdb, '0RN', -1, tool_version='x'),
+            key)
+        bonded = self.pdb.copy()
+        bonded.conect = ["CONECT    1    2\n"]
+        self.assertNotEqual(ligand_cache.ligand_key(bonded, '0RN', -1), key)
+
+    def test_conect_bonds(self):
+        self.assertEqual(
+            list(ligand_cache.conect_bonds(["CONECT 2034 2035 2036" +
+                                            " " * 20 + "\n"])),
+            [(2034, 2035), (2034, 2036)])
+
+
+class TestLigandCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'source')
+        self.destination = os.path.join(self.tmp.name, 'destination')
+        os.makedirs(self.source)
+        os.makedirs(self.destination)
+        for filename in ['XXX.prepc', 'XXX.frcmod']:
+            with open(os.path.join(self.source, filename), 'w') as f:
+                f.write(filename * 100)
+        self.cache = ligand_cache.LigandCache(
+            os.path.join(self.tmp.name, 'cache'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_put_get(self):
+        files = ['XXX.prepc', 'XXX.frcmod']
+        self.assertFalse(self.cache.get('key', files, self.destination))
+        self.cache.put('key', files, self.source)
+        self.cache.put('key', files, self.source)
+        self.assertTrue(self.cache.get('key', files, self.destination))
+        self.assertEqual(sorted(os.listdir(self.destination)), sorted(files))
+        self.assertFalse(self.cache.get('key', ['XXX.off'], self.destination))
+        self.assertEqual(len(self.cache.entries()), 1)
+
+    def test_put_adds_missing_files(self):
+        self.cache.put('key', ['XXX.prepc'], self.source)
+        files = ['XXX.prepc', 'XXX.frcmod']
+        self.assertFalse(self.cache.get('key', files, self.destination))
+        self.cache.put('key', files, self.source)
+        self.assertTrue(self.cache.get('key', files, self.destination))
+        self.assertEqual(sorted(os.listdir(self.cache.entry_path('key'))),
+                         sorted(files))
+
+    def test_lru_eviction(self):
+        files = ['XXX.prepc', 'XXX.frcmod']
+        for i, key in enumerate(['a', 'b', 'c']):
+            self.cache.put(key, files, self.source)
+            os.utime(self.cache.entry_path(key), (i, i))
+        # Using 'a' makes 'b' and 'c' the least recently used entries
+        self.cache.get('a', files, self.destination)
+        # Each entry takes 1900 bytes
+        self.cache.max_bytes = 4000
+        self.cache.put('d', files, self.source)
+        self.assertEqual(sorted(key for _, _, key in self.cache.entries()),
+                         ['a', 'd'])
+
+
+class TestAntechamberWrapperCache(unittest.TestCase):
+
+    @mock.patch('wrappers.utils')
+    @mock.patch('wrappers.os')
+    def test_cache_hit(self, mock_os, mock_utils):
+        mock_os.environ = {'AMBERHOME': ""}
+        mock_os.path.abspath.return_value = '/work/antechamber'
+        cache = mock.MagicMock()
+        cache.get.return_value = True
+        pdb = mock.MagicMock()
+        pdb.atoms = []
+        pdb.conect = []
+        with mock.patch('wrappers.print'):
+            antechamber = wrappers.AntechamberWrapper(pdb, 'XXX', 1,
+                                                      cache=cache)
+        self.assertTrue(antechamber.from_cache)
+        mock_utils.run_in_shell.assert_not_called()
+        cache.get.assert_called_once_with(
+            mock.ANY, ['XXX.prepc', 'XXX.frcmod'], '/work/antechamber')
+
+    @mock.patch('wrappers.utils')
+    @mock.patch('wrappers.os')
+    def test_cache_miss(self, mock_os, mock_utils):
+        mock_os.environ = {'AMBERHOME': ""}
+        mock_os.path.abspath.return_value = '/work/antechamber'
+        cache = mock.MagicMock()
+        cache.get.return_value = False
+        pdb = mock.MagicMock()
+        pdb.atoms = []
+        pdb.conect = []
+        antechamber = wrappers.AntechamberWrapper(pdb, 'XXX', 1,
+                                                  create_frcmod=False,
+                                                  cache=cache)
+        self.assertFalse(antechamber.from_cache)
+        self.assertEqual(mock_utils.run_in_shell.call_count, 1)
+        cache.put.assert_called_once_with(mock.ANY, ['XXX.prepc'],
+                                          '/work/antechamber')
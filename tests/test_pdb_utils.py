@@ -1,6 +1,7 @@
 import unittest
 from io import StringIO
 import pdb_utils
+from benchmarks import synthetic
 
 
 class TestPdb(unittest.TestCase):
@@ -76,6 +77,59 @@ class TestPdb(unittest.TestCase):
         self.assertIsNot(self.pdb.atoms, pdb_copy.atoms)
         self.assertEqual(self.pdb.atoms, pdb_copy.atoms)
 
+    def test_copy_on_write(self):
+        pdb = self.pdb.copy()
+        pdb_copy = pdb.copy()
+        pdb_utils.modify_atoms(pdb_copy.atoms[:1], 'resName', "XXX")
+        pdb_copy.atoms[1]['x'] = 999.0
+        pdb_copy.ter[0]['resSeq'] = 1
+        self.assertEqual(pdb.atoms[0]['resName'], "HIS")
+        self.assertNotEqual(pdb.atoms[1]['x'], 999.0)
+        self.assertEqual(pdb.ter[0]['resSeq'], 290)
+        self.assertEqual(pdb_copy.atoms[0]['resName'], "XXX")
+        self.assertEqual(pdb_copy.atoms[1]['x'], 999.0)
+
+        for pdb in backends('tests/test_files/full.pdb'):
+            pdb_copy = pdb.copy()
+            pdb_copy.atoms[0]['x'] = 999.0
+            self.assertNotEqual(pdb.atoms[0]['x'], 999.0)
+            selected = pdb.select(pdb.where(resName='SO4'))
+            selected.atoms[0]['x'] = 999.0
+            self.assertFalse(any(pdb.where(resName='SO4', x=999.0)))
+
+    def test_select_records(self):
+        for pdb in backends('tests/test_files/full.pdb'):
+            sulfate = pdb.select(pdb.where(resName='SO4', resSeq=291))
+            self.assertEqual(len(sulfate.atoms), 5)
+            self.assertEqual(sulfate.ter, [])
+            self.assertEqual([line[:11] for line in sulfate.conect],
+                             ['CONECT {}'.format(serial)
+                              for serial in range(2034, 2039)])
+            copy = pdb.copy()
+            self.assertEqual(copy.ter, pdb.ter)
+            self.assertEqual(copy.conect, pdb.conect)
+            self.assertEqual(len(copy.conect), 7)
+
+    def test_copy_on_write_residues(self):
+        pdb = self.pdb.copy()
+        pdb_copy = pdb.copy()
+        residues = pdb_copy.residues()
+        pdb_utils.modify_atoms(residues['A_122_LEU'], 'chainID', 'B')
+        pdb_utils.modify_atoms(residues['A_123_CYS'], 'chainID', 'B')
+        pdb_copy.modify_atoms(residues['A_124_SER'][:1], 'chainID', 'B')
+        self.assertEqual(len(pdb_copy.residues()['B_122_LEU']), 8)
+        self.assertEqual(len(pdb_copy.residues()['B_123_CYS']), 6)
+        self.assertEqual(len(pdb_copy.residues()['B_124_SER']), 1)
+        self.assertEqual(len(pdb.residues()['A_122_LEU']), 8)
+        self.assertEqual(len(pdb.residues()['A_123_CYS']), 6)
+        self.assertNotIn('B_124_SER', pdb.residues())
+
+        shuffled = pdb.copy()
+        shuffled.atoms = shuffled.atoms[::-1]
+        pdb_utils.modify_atoms(shuffled.atoms[:1], 'x', 0.0)
+        self.assertEqual(shuffled.atoms[0]['x'], 0.0)
+        self.assertNotEqual(pdb.atoms[-1]['x'], 0.0)
+
     def test_remove_atom(self):
         pdb_copy = self.pdb.copy()
         pdb_copy.remove_atom(pdb_copy.atoms[10])
@@ -85,3 +139,312 @@ class TestPdb(unittest.TestCase):
         self.assertEqual(pdb_utils.find_atom(self.pdb.atoms,
                                              lambda x: x['resName'] == 'VAL'),
                          self.pdb.residues()['A_31_VAL'][0])
+
+    def test_residue_key(self):
+        self.assertEqual(pdb_utils.residue_key(self.parsed_atom),
+                         ("A", 36, "", "ARG"))
+
+    def test_get_residue(self):
+        self.assertEqual(len(self.pdb.get_residue("A", 122, "", "LEU")), 8)
+        self.assertIsNone(self.pdb.get_residue("A", 122, "", "TRP"))
+
+    def test_residue_index_cached(self):
+        pdb = self.pdb.copy()
+        index = pdb.residue_index()
+        self.assertIs(pdb.residue_index(), index)
+        pdb_utils.modify_atoms(pdb.get_residue("A", 31, "", "VAL"),
+                               'resName', 'ALA')
+        self.assertIsNot(pdb.residue_index(), index)
+        self.assertIsNotNone(pdb.get_residue("A", 31, "", "ALA"))
+        pdb.atoms = pdb.atoms[:10]
+        self.assertEqual(len(pdb.residues()), 1)
+
+    def test_atom_writes_refresh_caches(self):
+        pdb = self.pdb.copy()
+        pdb.residues()
+        order = pdb.write_order()
+        pdb.atoms[0]['resName'] = 'XXX'
+        self.assertEqual(len(pdb.get_residues_by_name('XXX')), 1)
+        pdb.atoms[0]['resSeq'] = 1000
+        self.assertIsNot(pdb.write_order(), order)
+        self.assertEqual(pdb.write_order()[-1], 0)
+        pdb.atoms.reverse()
+        self.assertEqual(pdb.write_order()[-1], len(pdb.atoms) - 1)
+        pdb.atoms.append(dict(pdb.atoms[0], resName='YYY'))
+        self.assertEqual(len(pdb.get_residues_by_name('YYY')), 1)
+
+    @unittest.skipIf(pdb_utils.atom_table.np is None,
+                     "numpy is not installed")
+    def test_modified_views_refresh_caches(self):
+        pdb = pdb_utils.Pdb.from_filename('tests/test_files/full.pdb',
+                                          columnar=True)
+        other = pdb.copy()
+        index = other.residue_index()
+        sulfate = pdb.get_residues_by_name('SO4')[0]
+        for atom in sulfate:
+            atom['resName'] = 'XXX'
+        self.assertEqual(pdb.get_residues_by_name('SO4'), [])
+        self.assertEqual(len(pdb.get_residues_by_name('XXX')), 1)
+        self.assertIn('A_{}_XXX'.format(sulfate[0]['resSeq']),
+                      pdb.residues())
+        self.assertIs(other.residue_index(), index)
+        self.assertEqual(len(other.get_residues_by_name('SO4')), 1)
+
+    def test_pdb_modify_atoms(self):
+        for pdb in backends('tests/test_files/full.pdb'):
+            copy = pdb.copy()
+            index = pdb.residue_index()
+            order = pdb.write_order()
+            copy.modify_atoms(copy.get_residues_by_name('SO4')[0],
+                              'resSeq', 9999)
+            self.assertEqual(len(copy.get_residues_by_name('SO4')), 1)
+            self.assertEqual(copy.get_residues_by_name('SO4')[0][0]
+                             ['resSeq'], 9999)
+            self.assertNotEqual(copy.write_order(), order)
+            self.assertIs(pdb.residue_index(), index)
+            self.assertIs(pdb.write_order(), order)
+            self.assertNotEqual(pdb.get_residues_by_name('SO4')[0][0]
+                                ['resSeq'], 9999)
+
+    def test_non_contiguous_residues(self):
+        atoms = [pdb_utils.parse_atom(self.atom_string),
+                 dict(self.parsed_atom, resSeq=37),
+                 dict(self.parsed_atom, name="HG3")]
+        pdb = pdb_utils.Pdb(atoms=atoms)
+        self.assertEqual(len(pdb.residues()['A_36_ARG']), 2)
+        self.assertEqual(len(pdb.get_residues_by_name('ARG')), 2)
+
+    def test_remove_atom_updates_residues(self):
+        pdb = self.pdb.copy()
+        residue = pdb.get_residue("A", 31, "", "VAL")
+        pdb.remove_atom(residue[0])
+        self.assertEqual(len(pdb.residues()['A_31_VAL']), 6)
+
+    def test_dump_ter(self):
+        self.assertEqual(pdb_utils.dump_ter(self.pdb.ter[0]),
+                         "TER    2033      TRP A 290" + " " * 54 + "\n")
+
+    def test_write_order_cached(self):
+        for pdb in backends('tests/test_files/full.pdb'):
+            order = pdb.write_order()
+            self.assertIs(pdb.write_order(), order)
+            self.assertEqual(order[0], 0)
+            pdb_utils.modify_atoms(pdb.atoms[:1], 'resSeq', 9999)
+            self.assertEqual(pdb.atoms[0]['resSeq'], 9999)
+            self.assertIsNot(pdb.write_order(), order)
+            self.assertEqual(pdb.write_order()[-1], 0)
+
+            pdb.ter[0]['resSeq'] = 1
+            written = StringIO()
+            pdb.to_file(written)
+            fresh = pdb_utils.Pdb(atoms=pdb.atoms, ter=pdb.ter,
+                                  conect=pdb.conect)
+            expected = StringIO()
+            fresh.to_file(expected)
+            self.assertEqual(written.getvalue(), expected.getvalue())
+            self.assertTrue(written.getvalue().startswith('TER'))
+
+    def test_backends_write_the_same(self):
+        lines = synthetic.synthetic_lines(3000)
+        # Atoms without serial, after TER records of lower residue numbers
+        lines[5] = lines[5][:6] + '    0' + lines[5][11:]
+        lines.insert(0, "TER    9999      ALA A   1\n")
+        for filename in ['tests/test_files/full.pdb',
+                         'tests/test_files/reduce.pdb', None]:
+            outputs = []
+            for columnar in [False, True]:
+                if columnar and pdb_utils.atom_table.np is None:
+                    continue
+                if filename is None:
+                    pdb = pdb_utils.Pdb(lines, columnar=columnar)
+                else:
+                    pdb = pdb_utils.Pdb.from_filename(filename,
+                                                      columnar=columnar)
+                output = StringIO()
+                pdb.to_file(output)
+                outputs.append(output.getvalue())
+            self.assertEqual(len(set(outputs)), 1, filename)
+
+    def test_slices_share_atoms(self):
+        for pdb in backends('tests/test_files/full.pdb'):
+            first = pdb.atoms[:2]
+            self.assertEqual(len(first), 2)
+            self.assertEqual(first[1], pdb.atoms[1])
+            pdb_utils.modify_atoms(first, 'x', 123.0)
+            self.assertEqual([atom['x'] for atom in pdb.atoms[:3]],
+                             [123.0, 123.0, 4.419])
+            pdb.atoms = pdb.atoms[::-1]
+            self.assertEqual(pdb.atoms[-1]['x'], 123.0)
+            self.assertEqual(len(pdb.residues()), 463)
+
+    def test_backends_have_one_interface(self):
+        for pdb in backends('tests/test_files/full.pdb'):
+            atoms = pdb.atoms
+            waters = atoms.mask('resName', {'HOH'}.__contains__)
+            self.assertEqual(sum(waters), 199)
+            self.assertEqual(list(atoms.mask_of(atoms[:2]))[:3],
+                             [True, True, False])
+            self.assertEqual(atoms.lines()[0], pdb_utils.dump_atom(atoms[0]))
+            self.assertEqual(len(atoms.groups(pdb_utils.RESIDUE_KEYS)), 463)
+            view = atoms.view(waters)
+            view.modify(slice(None), 'resName', 'WAT')
+            self.assertEqual(sum(atoms.mask('resName', {'WAT'}.__contains__)),
+                             0)
+            atoms.remove_rows(waters)
+            self.assertEqual(len(atoms), 2236 - 199)
+            self.assertEqual(atoms.coordinates().shape, (2236 - 199, 3))
+
+    @unittest.skipIf(pdb_utils.atom_table.np is None,
+                     "numpy is not installed")
+    def test_pdb_from_atom_table(self):
+        pdb = pdb_utils.Pdb.from_filename('tests/test_files/full.pdb',
+                                          columnar=True)
+        for columnar in [True, None]:
+            copy = pdb_utils.Pdb(atoms=pdb.atoms, ter=pdb.ter,
+                                 columnar=columnar)
+            self.assertIsInstance(copy.atoms, pdb_utils.atom_table.AtomTable)
+            copy.atoms[0]['x'] = 999.0
+            self.assertNotEqual(pdb.atoms[0]['x'], 999.0)
+        copy = pdb_utils.Pdb(atoms=pdb.atoms, ter=pdb.ter)
+        self.assertIsInstance(copy.atoms, pdb_utils.AtomList)
+        self.assertEqual(copy.atoms, pdb.atoms)
+
+
+def backends(filename):
+    """filename read with every available Pdb backend"""
+    pdbs = []
+    for columnar in [False, True]:
+        if columnar and pdb_utils.atom_table.np is None:
+            continue
+        pdbs.append(pdb_utils.Pdb.from_filename(filename, columnar=columnar))
+    return pdbs
+
+
+class TestSelection(unittest.TestCase):
+
+    def make_pdbs(self):
+        return backends('tests/test_files/reduce.pdb')
+
+    def test_where(self):
+        for pdb in self.make_pdbs():
+            expected = [atom['resName'] in {'ASP', 'GLU'} and
+                        atom['chainID'] == 'A' and 'new' in atom['extras']
+                        for atom in pdb.atoms]
+            mask = pdb.where(resName={'ASP', 'GLU'}, chainID='A', flag='new')
+            self.assertEqual(list(mask), expected)
+            mask = pdb.where(resSeq=lambda resSeq: resSeq < 10)
+            self.assertEqual(sum(mask), sum(atom['resSeq'] < 10
+                                            for atom in pdb.atoms))
+            self.assertEqual(
+                list(pdb.where(record='HETATM') | pdb.where(flag='new')),
+                [atom['record'] == 'HETATM' or 'new' in atom['extras']
+                 for atom in pdb.atoms])
+
+    def test_where_within(self):
+        for pdb in self.make_pdbs():
+            ligand = pdb.get_residues_by_name('0RN')[0]
+            points = [[atom['x'], atom['y'], atom['z']] for atom in ligand]
+            mask = pdb.where(within=(points, 4.0), record='ATOM')
+            residues = pdb.residues_in_contact(ligand, 4.0)
+            self.assertEqual(
+                set(map(pdb_utils.residue_key,
+                        pdb.select(mask).atoms)),
+                {key for key, atoms in residues.items()
+                 if atoms[0]['record'] == 'ATOM'})
+
+    def test_remove_select_modify(self):
+        for pdb in self.make_pdbs():
+            n_atoms = len(pdb.atoms)
+            kept = pdb.atoms[0]
+            mask = pdb.where(flag='new')
+            selected = pdb.select(mask)
+            self.assertEqual(len(selected.atoms), sum(mask))
+            self.assertTrue(all('new' in atom['extras']
+                                for atom in selected.atoms))
+
+            residues = pdb.residues()
+            pdb.remove(mask)
+            self.assertEqual(len(pdb.atoms), n_atoms - sum(mask))
+            self.assertEqual(pdb.atoms[0], kept)
+            self.assertNotEqual(pdb.residues(), residues)
+
+            pdb.modify(pdb.where(resName='ASP'), 'resName', 'ASH')
+            self.assertNotIn('A_189_ASP', pdb.residues())
+            self.assertIn('A_189_ASH', pdb.residues())
+
+            residue = pdb.residues()['A_189_ASH']
+            pdb.remove(pdb.mask_of(residue[:2]))
+            self.assertEqual(pdb.residues()['A_189_ASH'], residue[2:])
+
+    def test_mask(self):
+        mask = pdb_utils.Mask([True, True, False])
+        self.assertEqual(mask & [True, False, False], [True, False, False])
+        self.assertEqual(mask | [False, False, True], [True, True, True])
+        self.assertEqual(~mask, [False, False, True])
+
+
+class TestModels(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open('tests/test_files/only_atoms.pdb') as f:
+            lines = f.readlines()[:40]
+        header = "HEADER    ENSEMBLE\n"
+        models = []
+        for number in range(1, 4):
+            atoms = [line[:30] + "%8.3f" % (float(line[30:38]) + number) +
+                     line[38:] if line.startswith('ATOM') else line
+                     for line in lines]
+            models.append("MODEL     %4d\n%sENDMDL\n"
+                          % (number, ''.join(atoms)))
+        cls.lines = lines
+        cls.ensemble = header + ''.join(models) + "END\n"
+
+    def test_iter_models(self):
+        for columnar in [False, True]:
+            models = list(pdb_utils.iter_models(StringIO(self.ensemble),
+                                                columnar=columnar))
+            self.assertEqual([number for number, _ in models], [1, 2, 3])
+            for number, pdb in models:
+                self.assertEqual(len(pdb.atoms), 40)
+                self.assertEqual(pdb.other, ["HEADER    ENSEMBLE\n"])
+                self.assertAlmostEqual(
+                    pdb.atoms[0]['x'],
+                    float(self.lines[0][30:38]) + number)
+            if columnar:
+                first, second = models[0][1].atoms, models[1][1].atoms
+                self.assertIs(first.columns['name'], second.columns['name'])
+                self.assertIsNot(first.coords, second.coords)
+                first[0]['resName'] = "XXX"
+                self.assertEqual(second[0]['resName'], "HIS")
+
+    def test_models_differing_besides_coordinates(self):
+        lines = self.ensemble.splitlines(True)
+        second = lines.index("MODEL        2\n")
+        lines[second + 1] = ('HETATM' + lines[second + 1][6:60] + ' 55.50' +
+                             lines[second + 1][66:])
+        lines[second + 2] = lines[second + 2].rstrip('\n') + ' flag\n'
+        ensembles = []
+        for columnar in [False, True]:
+            models = list(pdb_utils.iter_models(StringIO(''.join(lines)),
+                                                columnar=columnar))
+            atoms = models[1][1].atoms
+            self.assertEqual(atoms[0]['record'], 'HETATM')
+            self.assertEqual(atoms[0]['tempFactor'], 55.5)
+            self.assertEqual(atoms[1]['extras'], ' flag\n')
+            self.assertEqual(models[2][1].atoms[0]['record'], 'ATOM')
+            self.assertEqual(models[2][1].atoms[1]['extras'], '\n')
+            ensembles.append([list(map(dict, pdb.atoms))
+                              for _, pdb in models])
+        self.assertEqual(ensembles[0], ensembles[1])
+
+    def test_select_models(self):
+        models = pdb_utils.iter_models(StringIO(self.ensemble), models={2})
+        self.assertEqual([number for number, _ in models], [2])
+
+    def test_single_model(self):
+        models = list(pdb_utils.iter_models(StringIO(''.join(self.lines))))
+        self.assertEqual(len(models), 1)
+        self.assertEqual(models[0][0], 1)
+        self.assertEqual(models[0][1].atoms,
+                         pdb_utils.Pdb(self.lines).atoms)
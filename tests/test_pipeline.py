@@ -0,0 +1,77 @@
+import concurrent.futures
+import time
+import unittest
+import pipeline
+
+
+def sleep_and_return(seconds, value, *args):
+    time.sleep(seconds)
+    return value + sum(args)
+
+
+def fail(*args):
+    raise RuntimeError("stage failed")
+
+
+class TestPipeline(unittest.TestCase):
+
+    def make_pipeline(self, ligand_time=0.2, reduce_time=0.1):
+        protocol = pipeline.Pipeline()
+        protocol.add('tleap', lambda a, b: a + b,
+                     requires=['antechamber', 'propka'])
+        protocol.add('antechamber',
+                     lambda: sleep_and_return(ligand_time, 1))
+        protocol.add('reduce', lambda: sleep_and_return(reduce_time, 10))
+        protocol.add('propka', lambda reduce: reduce + 100,
+                     requires=['reduce'])
+        return protocol
+
+    def test_order(self):
+        protocol = self.make_pipeline()
+        self.assertEqual(protocol.order(),
+                         ['antechamber', 'reduce', 'propka', 'tleap'])
+        self.assertEqual(protocol.describe().splitlines(), [
+            "antechamber <- (none)",
+            "reduce <- (none)",
+            "propka <- reduce",
+            "tleap <- antechamber, propka"
+        ])
+
+    def test_invalid_graphs(self):
+        protocol = pipeline.Pipeline()
+        protocol.add('a', fail, requires=['b'])
+        protocol.add('b', fail, requires=['a'])
+        with self.assertRaisesRegex(ValueError, "cycle"):
+            protocol.order()
+        protocol = pipeline.Pipeline()
+        protocol.add('a', fail, requires=['missing'])
+        with self.assertRaisesRegex(ValueError, "Unknown stage missing"):
+            protocol.order()
+        with self.assertRaises(ValueError):
+            protocol.add('a', fail)
+
+    def test_serial_run(self):
+        protocol = self.make_pipeline(0.0, 0.0)
+        results = protocol.run()
+        self.assertEqual(results, {'antechamber': 1, 'reduce': 10,
+                                   'propka': 110, 'tleap': 111})
+
+    def test_concurrent_run(self):
+        protocol = self.make_pipeline(0.3, 0.2)
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            results = protocol.run(executor)
+        self.assertLess(time.time() - start, 0.45)
+        self.assertEqual(results['tleap'], 111)
+        path, length = protocol.critical_path()
+        self.assertEqual(path, ['antechamber', 'tleap'])
+        self.assertGreaterEqual(length, 0.3)
+        self.assertIn("Critical path: antechamber -> tleap",
+                      protocol.report())
+
+    def test_failure(self):
+        protocol = self.make_pipeline(0.0, 0.0)
+        protocol.add('broken', fail, requires=['reduce'])
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            with self.assertRaisesRegex(RuntimeError, "stage failed"):
+                protocol.run(executor)
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+import prmtop
+
+NAMES = ['NA', 'CL', 'O', 'H1', 'H2', 'O', 'H1', 'H2']
+CHARGES = [1.0, -1.0, -0.834, 0.417, 0.417, -0.834, 0.417, 0.417]
+LABELS = ['NA', 'CL', 'WAT', 'WAT']
+RESIDUE_POINTERS = [1, 2, 3, 6]
+
+
+def section(name, format, values, per_line, field):
+    lines = ["%FLAG {}\n".format(name), "%FORMAT({})\n".format(format)]
+    for i in range(0, len(values), per_line):
+        lines.append(''.join(field % value
+                             for value in values[i:i + per_line]) + '\n')
+    return ''.join(lines)
+
+
+def write_files(directory, charges=CHARGES, natom=8):
+    pointers = [natom, 2, 4, 0, 2, 0, 0, 0, 0, 0, 6, 4] + [0] * 19
+    top = os.path.join(directory, 'test.top')
+    with open(top, 'w') as f:
+        f.write("%VERSION  VERSION_STAMP = V0001.000  DATE = 01/01/20\n")
+        f.write(section('TITLE', '20a4', ['test'], 1, '%-80s'))
+        f.write(section('POINTERS', '10I8', pointers, 10, '%8d'))
+        f.write(section('ATOM_NAME', '20a4', NAMES, 20, '%-4s'))
+        f.write("%FLAG CHARGE\n%COMMENT in units of e * 18.2223\n")
+        f.write(section('CHARGE', '5E16.8',
+                        [charge * prmtop.CHARGE_FACTOR for charge in charges],
+                        5, '%16.8E').split('\n', 1)[1])
+        f.write(section('RESIDUE_LABEL', '20a4', LABELS, 20, '%-4s'))
+        f.write(section('RESIDUE_POINTER', '10I8', RESIDUE_POINTERS, 10,
+                        '%8d'))
+    rst = os.path.join(directory, 'test.rst')
+    with open(rst, 'w') as f:
+        f.write("test\n{:6d}\n".format(natom))
+        coordinates = [float(i % 1000) for i in range(natom * 3)]
+        for i in range(0, len(coordinates), 6):
+            f.write(''.join('%12.7f' % value
+                            for value in coordinates[i:i + 6]) + '\n')
+    return top, rst
+
+
+class TestPrmtop(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.top, self.rst = write_files(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_sections(self):
+        top = prmtop.Prmtop(self.top)
+        try:
+            self.assertEqual(set(top.sections),
+                             {'TITLE', 'POINTERS', 'ATOM_NAME', 'CHARGE',
+                              'RESIDUE_LABEL', 'RESIDUE_POINTER'})
+            self.assertEqual(top.natom, 8)
+            self.assertEqual(top.nres, 4)
+            self.assertEqual(list(top.section('ATOM_NAME')), NAMES)
+            self.assertEqual(list(top.section('RESIDUE_LABEL')), LABELS)
+            self.assertAlmostEqual(top.total_charge(), 0.0, places=6)
+            self.assertEqual(list(top.residue_sizes()), [1, 1, 3, 3])
+            self.assertEqual(top.count_residues(['WAT']), 2)
+            with self.assertRaises(KeyError):
+                top.section('BOND_FORCE_CONSTANT')
+        finally:
+            top.close()
+
+    def test_rst7(self):
+        rst = prmtop.Rst7(self.rst)
+        try:
+            self.assertEqual(rst.natom, 8)
+            coordinates = rst.coordinates()
+            self.assertEqual(len(coordinates), 8)
+            self.assertEqual(list(coordinates[7]), [21.0, 22.0, 23.0])
+        finally:
+            rst.close()
+
+    def test_verify(self):
+        pdb = type('Pdb', (), {})()
+        pdb.atoms = [{'resName': name} for name in ['NA', 'CL', 'HOH']]
+        report = prmtop.verify(self.top, self.rst, pdb)
+        self.assertEqual(report['atoms'], 8)
+        self.assertEqual(report['waters'], 2)
+        self.assertEqual(report['solute_atoms'], 2)
+        self.assertEqual(report['problems'], [])
+
+        charges = CHARGES[:1] + [-0.5] + CHARGES[2:]
+        write_files(self.directory.name, charges)
+        pdb.atoms.append({'resName': 'XXX'})
+        problems = prmtop.verify(self.top, self.rst, pdb)['problems']
+        self.assertEqual(problems, [
+            "Total charge 0.5000 is not an integer",
+            "tleap changed the number of non-water atoms from 3 to 2"])
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+import runner
+import utils
+
+
+class TestRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmp.name, 'command.out')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_output(self):
+        with open(self.output) as f:
+            return f.read()
+
+    def test_output_and_status(self):
+        result = utils.run_in_shell(
+            "sh -c 'echo out; echo err >&2; exit 3'", self.output)
+        self.assertEqual(result.args, ['sh', '-c',
+                                       'echo out; echo err >&2; exit 3'])
+        self.assertEqual(result.returncode, 3)
+        self.assertFalse(result.timed_out)
+        self.assertEqual(sorted(self.read_output().split()), ['err', 'out'])
+
+    def test_resource_usage(self):
+        result = runner.run(
+            [sys.executable, '-c',
+             'import time\nt = time.process_time()\n'
+             'while time.process_time() - t < 0.2: pass\n'
+             'x = bytearray(50 * 1024 * 1024)'],
+            self.output, cwd=self.tmp.name)
+        self.assertEqual(result.returncode, 0)
+        self.assertGreaterEqual(result.cpu_time, 0.2)
+        self.assertGreaterEqual(result.wall_time, result.cpu_time * 0.9)
+        self.assertGreater(result.max_rss, 50 * 1024)
+
+    def test_cwd(self):
+        runner.run(['pwd'], self.output, cwd=self.tmp.name)
+        self.assertEqual(self.read_output().strip(),
+                         os.path.realpath(self.tmp.name))
+
+    def test_timeout(self):
+        start = time.monotonic()
+        result = runner.run(['sh', '-c', 'echo started; sleep 10'],
+                            self.output, timeout=0.3)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertTrue(result.timed_out)
+        self.assertLess(result.returncode, 0)
+        self.assertEqual(self.read_output(), "started\n")
+
+    def test_cancel(self):
+        async def cancelled():
+            task = asyncio.ensure_future(
+                runner.run_command(['sleep', '10'], self.output))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            await task
+
+        start = time.monotonic()
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancelled())
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_run_all(self):
+        commands = [(['sh', '-c', 'sleep 0.3; echo {}'.format(i)],
+                     os.path.join(self.tmp.name, '{}.out'.format(i)))
+                    for i in range(4)]
+        start = time.monotonic()
+        results = asyncio.run(runner.run_all(commands))
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual([result.returncode for result in results],
+                         [0] * 4)
+        summary = runner.summarize(results)
+        self.assertEqual(list(summary), ['sh'])
+        self.assertEqual(summary['sh']['calls'], 4)
+
+    def test_make_working_directory(self):
+        cwd = os.getcwd()
+        directory = os.path.join(self.tmp.name, 'stage')
+        os.makedirs(directory)
+        open(os.path.join(directory, 'old.out'), 'w').close()
+        utils.make_working_directory(directory)
+        self.assertEqual(os.listdir(directory), [])
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_stream(self):
+        results = []
+        lines = runner.stream(["sh -c 'cat; echo message >&2'",
+                               "tr a-z A-Z"],
+                              "first\nsecond\n", self.output,
+                              self.tmp.name, results)
+        self.assertEqual(next(lines), "FIRST\n")
+        self.assertEqual(list(lines), ["SECOND\n"])
+        self.assertEqual(self.read_output(), "message\n")
+        self.assertEqual([result.returncode for result in results], [0, 0])
+
+    def test_stream_closed(self):
+        results = []
+        lines = runner.stream(['yes'], "", self.output, results=results)
+        self.assertEqual(next(lines), "y\n")
+        lines.close()
+        self.assertLess(results[0].returncode, 0)
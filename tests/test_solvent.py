@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+import pdb_utils
+import solvent
+
+SPACING = 3.1
+COUNT = 6
+# Water with the oxygen at the origin
+WATER = [[0.0, 0.0, 0.0], [0.9572, 0.0, 0.0], [-0.24, 0.9266, 0.0]]
+
+
+def write_library(filename):
+    """OFF library with a TIP3PBOX of waters on a grid"""
+    positions = [[x * SPACING + dx, y * SPACING + dy, z * SPACING + dz]
+                 for x in range(COUNT) for y in range(COUNT)
+                 for z in range(COUNT) for dx, dy, dz in WATER]
+    lines = ['!!index array str\n', ' "TIP3PBOX"\n',
+             '!entry.TIP3PBOX.unit.atoms table  str name  str type  '
+             'int typex  int resx  int flags  int seq  int elmnt  dbl chg\n']
+    for index in range(COUNT ** 3):
+        for name, type, element, charge in [('O', 'OW', 8, -0.834),
+                                            ('H1', 'HW', 1, 0.417),
+                                            ('H2', 'HW', 1, 0.417)]:
+            lines.append(' "{}" "{}" 0 {} 131072 {} {} {:f}\n'.format(
+                name, type, index + 1, index * 3 + 1, element, charge))
+    lines.append('!entry.TIP3PBOX.unit.boundbox array dbl\n')
+    lines += [' {:f}\n'.format(value)
+              for value in [1.0, 90.0] + [COUNT * SPACING] * 3 + [0.0]]
+    lines.append('!entry.TIP3PBOX.unit.positions table  dbl x  dbl y  '
+                 'dbl z\n')
+    lines += [' {:f} {:f} {:f}\n'.format(*position)
+              for position in positions]
+    lines.append('!entry.TIP3PBOX.unit.residues table  str name  int seq\n')
+    with open(filename, 'w') as f:
+        f.writelines(lines)
+
+
+@unittest.skipIf(solvent.np is None, "numpy is not installed")
+class TestSolvent(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.library = os.path.join(self.directory.name, 'solvents.lib')
+        write_library(self.library)
+        self.box = solvent.SolventBox.from_library(self.library)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_from_library(self):
+        self.assertEqual(self.box.names, ['O', 'H1', 'H2'])
+        self.assertEqual(self.box.coords.shape, (COUNT ** 3, 3, 3))
+        self.assertEqual(self.box.lengths.tolist(), [COUNT * SPACING] * 3)
+        self.assertEqual(self.box.radii.tolist(), [1.7683, 0.0, 0.0])
+        with self.assertRaises(ValueError):
+            solvent.SolventBox.from_library(self.library, 'OPCBOX')
+
+    def test_solvate_sphere(self):
+        np = solvent.np
+        center = np.array([1.0, 2.0, 3.0])
+        waters = solvent.solvate_sphere([], [], center, 12.0, 0.75, self.box)
+        oxygens = waters[:, 0]
+        self.assertTrue((np.linalg.norm(oxygens - center, axis=1)
+                         <= 12.0).all())
+        # Copies of the box continue the grid, nothing missing or doubled
+        expected = np.mgrid[-5:6, -5:6, -5:6].reshape(3, -1).T * SPACING
+        expected = expected + (oxygens[0] - center) % SPACING + center
+        self.assertEqual(
+            len(oxygens),
+            (np.linalg.norm(expected - center, axis=1) <= 12.0).sum())
+        distances = np.linalg.norm(oxygens[:, None] - oxygens[None], axis=2)
+        self.assertAlmostEqual(distances[distances > 0].min(), SPACING)
+
+        solute = [center, center + [4.0, 0.0, 0.0]]
+        radii = [1.908, 1.1]
+        solvated = solvent.solvate_sphere(solute, radii, center, 12.0, 0.75,
+                                          self.box)
+        self.assertLess(len(solvated), len(waters))
+        for point, radius in zip(solute, radii):
+            distances = np.linalg.norm(solvated - point, axis=2)
+            self.assertTrue((distances >=
+                             (radius + self.box.radii) * 0.75).all())
+
+    def test_write_waters(self):
+        waters = solvent.solvate_sphere([], [], [0, 0, 0], 8.0, 0.75,
+                                        self.box)
+        filename = os.path.join(self.directory.name, 'solvent.pdb')
+        solvent.write_waters(filename, waters)
+        with open(filename) as f:
+            pdb = pdb_utils.Pdb(f)
+        self.assertEqual(len(pdb.atoms), waters.size // 3)
+        self.assertEqual(len(pdb.residues()), len(waters))
+        self.assertEqual([atom['name'] for atom in pdb.atoms[:3]],
+                         ['O', 'H1', 'H2'])
+        self.assertEqual(pdb.atoms[3]['resSeq'], 2)
+        self.assertAlmostEqual(pdb.atoms[0]['x'], waters[0, 0, 0], places=3)
+
+    def test_sphere_np_template(self):
+        from tleap import sphere_np
+        with open('tests/test_files/only_atoms.pdb') as f:
+            pdb = pdb_utils.Pdb(f)
+        ligand = pdb.atoms[100]
+        params = {'name': 'XXX', 'include': "", 'pdb': pdb,
+                  'water_pdb': pdb.select(pdb.where(resName='HOH')),
+                  'ligand': [ligand], 'solvent_radius': 10.0,
+                  'solvent_closeness': 0.75, 'solvent_box': self.library}
+        waters = sphere_np.prepare(params, self.directory.name)
+        with open(os.path.join(self.directory.name, 'solvent.pdb')) as f:
+            self.assertEqual(len(pdb_utils.Pdb(f).atoms), waters.size // 3)
+        distances = solvent.np.linalg.norm(
+            waters[:, :1] - pdb.coordinates(), axis=2)
+        self.assertGreaterEqual(distances.min(), 1.7683 * 0.75)
+
+        with open('tleap/sphere_np.in') as f:
+            commands = sphere_np.run(params, f.read()).splitlines()
+        self.assertIn("solvent = loadpdb solvent.pdb", commands)
+        self.assertFalse(any(line.startswith('solvatecap')
+                             for line in commands))
@@ -0,0 +1,72 @@
+import unittest
+import pdb_utils
+import spatial
+
+
+@unittest.skipIf(spatial.np is None, "numpy is not installed")
+class TestCellList(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open('tests/test_files/full.pdb') as f:
+            cls.pdb = pdb_utils.Pdb(f)
+        cls.coords = cls.pdb.coordinates()
+        cls.center = cls.coords[100]
+
+    def brute_force_within(self, point, radius):
+        distances = spatial.np.linalg.norm(self.coords - point, axis=1)
+        return set(spatial.np.flatnonzero(distances <= radius).tolist())
+
+    def test_within(self):
+        cell_list = spatial.CellList(self.coords, cell_size=3.0)
+        for radius in [0.0, 2.5, 8.0, 100.0]:
+            result = cell_list.within(self.center, radius)
+            self.assertEqual(set(result.tolist()),
+                             self.brute_force_within(self.center, radius))
+        self.assertEqual(len(cell_list.within([1000, 0, 0], 5.0)), 0)
+
+    def test_within_any(self):
+        cell_list = spatial.CellList(self.coords)
+        points = self.coords[[10, 500, 1500]]
+        expected = set.union(*[self.brute_force_within(point, 4.0)
+                               for point in points])
+        mask = cell_list.within_any(points, 4.0, chunk_size=7)
+        self.assertEqual(set(spatial.np.flatnonzero(mask).tolist()),
+                         expected)
+
+    def test_pairs(self):
+        cell_list = spatial.CellList(self.coords, cell_size=2.0)
+        points = self.coords[[10, 500, 1500]] + 0.5
+        point_indices, atom_indices, distances = cell_list.pairs(points, 3.5)
+        for index, point in enumerate(points):
+            self.assertEqual(
+                set(atom_indices[point_indices == index].tolist()),
+                self.brute_force_within(point, 3.5))
+        self.assertTrue((distances <= 3.5).all())
+        self.assertEqual(len(cell_list.pairs([[1000, 0, 0]], 5.0)[0]), 0)
+
+    def test_nearest(self):
+        cell_list = spatial.CellList(self.coords)
+        distances = spatial.np.linalg.norm(self.coords - [50, 50, 50], axis=1)
+        self.assertEqual(cell_list.nearest([50, 50, 50], 3).tolist(),
+                         spatial.np.argsort(distances)[:3].tolist())
+        self.assertEqual(cell_list.nearest(self.center)[0], 100)
+
+    def test_pdb_queries(self):
+        for columnar in [False, True]:
+            pdb = pdb_utils.Pdb.from_filename('tests/test_files/full.pdb',
+                                              columnar=columnar)
+            self.assertIs(pdb.spatial_index(), pdb.spatial_index())
+            self.assertEqual(pdb.atoms_within(self.center, 0.1),
+                             [self.pdb.atoms[100]])
+            self.assertEqual(pdb.nearest_atoms(self.center, 1),
+                             [self.pdb.atoms[100]])
+
+            ligand = pdb.get_residues_by_name('SO4')[0]
+            contacts = pdb.residues_in_contact(ligand, 4.0)
+            self.assertNotIn(pdb_utils.residue_key(ligand[0]), contacts)
+            self.assertIn(('A', 70, '', 'SER'), contacts)
+            self.assertEqual(len(contacts[('A', 70, '', 'SER')]), 6)
+
+            pdb_utils.modify_atoms(pdb.atoms[100:101], 'x', 1000.0)
+            self.assertEqual(pdb.atoms_within(self.center, 0.1), [])
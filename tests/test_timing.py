@@ -0,0 +1,64 @@
+import concurrent.futures
+import json
+import os
+import tempfile
+import unittest
+import timing
+import utils
+
+
+class TestTiming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_stage(self):
+        timings = timing.Timings()
+        filename = os.path.join(self.tmp.name, 'input.pdb')
+        with timings.stage('reduce', self.tmp.name) as record:
+            with timing.step('write input.pdb', filename):
+                with open(filename, 'w') as f:
+                    f.write('ATOM\n' * 10)
+            utils.run_in_shell("sh -c 'echo done'",
+                               os.path.join(self.tmp.name, 'sh.out'))
+            timing.count(atoms_in=10)
+        self.assertIsNone(timing.current())
+        self.assertGreater(record.wall_time, 0.0)
+        self.assertEqual(len(record.commands), 1)
+        self.assertEqual(record.counts, {'atoms_in': 10})
+        self.assertEqual(record.steps[0]['name'], 'write input.pdb')
+        self.assertEqual(record.steps[0]['size'], 50)
+        self.assertEqual(record.files, {'input.pdb': 50, 'sh.out': 5})
+
+        output = os.path.join(self.tmp.name, 'timings.json')
+        timings.write(output)
+        with open(output) as f:
+            data = json.load(f)
+        self.assertEqual([stage['name'] for stage in data['stages']],
+                         ['reduce'])
+        self.assertEqual(data['stages'][0]['commands'][0]['args'],
+                         ['sh', '-c', 'echo done'])
+        self.assertEqual(data['tools']['sh']['calls'], 1)
+
+    def test_outside_stage(self):
+        with timing.step('parse'):
+            timing.count(atoms_in=1)
+        self.assertIsNone(timing.current())
+
+    def test_threads(self):
+        timings = timing.Timings()
+
+        def stage(value):
+            timing.count(value=value)
+            return value
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(
+                lambda i: timings.wrap(str(i), stage)(i), range(8)))
+        self.assertEqual(results, list(range(8)))
+        self.assertEqual(sorted((record.name, record.counts['value'])
+                                for record in timings.stages),
+                         sorted((str(i), i) for i in range(8)))
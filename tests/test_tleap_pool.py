@@ -0,0 +1,150 @@
+import os
+import stat
+import sys
+import tempfile
+import unittest
+import tleap_pool
+
+# Minimal interactive tleap: runs -f file, then commands from stdin
+FAKE_TLEAP = """#!{python}
+import shlex, sys, time
+log = sys.stdout
+
+def run(line):
+    global log
+    words = shlex.split(line)
+    if not words:
+        return
+    start = 2 if words[1:2] == ['='] else 0
+    command, arguments = words[start], words[start + 1:]
+    if command == 'logFile':
+        if log is not sys.stdout:
+            log.close()
+        log = open(arguments[0], 'w')
+    elif command == 'loadpdb':
+        try:
+            open(arguments[0]).close()
+        except OSError:
+            log.write('Error! Could not open file ' + arguments[0] + '\\n')
+    elif command == 'saveamberparm':
+        for name in arguments[1:]:
+            open(name, 'w').close()
+    elif command == 'crash':
+        sys.exit(3)
+    elif command == 'hang':
+        time.sleep(600)
+    elif command == 'quit':
+        sys.exit(0)
+    log.write('> ' + line + '\\n')
+    log.flush()
+
+with open(sys.argv[2]) as f:
+    for line in f:
+        run(line)
+for line in sys.stdin:
+    run(line)
+"""
+
+JOB = """source leaprc.gaff
+# comment
+mol = loadpdb input.pdb
+saveamberparm mol out.top out.rst
+quit
+"""
+
+
+class TestTleapPool(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.tleap = os.path.join(self.directory.name, 'tleap')
+        with open(self.tleap, 'w') as f:
+            f.write(FAKE_TLEAP.format(python=sys.executable))
+        os.chmod(self.tleap, os.stat(self.tleap).st_mode | stat.S_IEXEC)
+        self.jobs = []
+        for index in range(3):
+            job = os.path.join(self.directory.name, 'job {}'.format(index))
+            os.makedirs(job)
+            open(os.path.join(job, 'input.pdb'), 'w').close()
+            self.jobs.append(job)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_split_setup(self):
+        setup, commands = tleap_pool.split_setup(JOB)
+        self.assertEqual(setup, "source leaprc.gaff\n")
+        self.assertEqual(
+            tleap_pool.job_commands(commands, '/work'),
+            ["mol = loadpdb input.pdb",
+             "saveamberparm mol /work/out.top /work/out.rst"])
+        self.assertEqual(
+            tleap_pool.job_commands(commands, self.jobs[0])[0],
+            'mol = loadpdb "{}"'.format(os.path.join(self.jobs[0],
+                                                     'input.pdb')))
+
+    def test_worker(self):
+        setup, commands = tleap_pool.split_setup(JOB)
+        worker = tleap_pool.TleapWorker(setup, self.tleap)
+        try:
+            pid = worker.process.pid
+            for job in self.jobs:
+                log = os.path.join(job, 'tleap.log')
+                result = worker.run(commands, job, log)
+                self.assertEqual(result.returncode, 0)
+                self.assertTrue(os.path.isfile(os.path.join(job, 'out.top')))
+                with open(log) as f:
+                    self.assertIn("clearVariables", f.read())
+            self.assertEqual(worker.process.pid, pid)
+
+            os.remove(os.path.join(self.jobs[0], 'input.pdb'))
+            result = worker.run(commands, self.jobs[0], log)
+            self.assertEqual(result.returncode, 1)
+            self.assertTrue(worker.failed)
+        finally:
+            worker.close()
+        self.assertFalse(os.path.exists(worker.directory))
+
+    def test_pool_recycles_workers(self):
+        setup, commands = tleap_pool.split_setup(JOB)
+        pool = tleap_pool.TleapPool(setup, size=1, max_jobs=2,
+                                    command=self.tleap)
+        try:
+            for job in self.jobs[:2]:
+                pool.run(commands, job, os.path.join(job, 'tleap.log'))
+            # Retired after max_jobs
+            self.assertEqual(list(pool._idle.queue), [None])
+            pool.run(commands, self.jobs[2],
+                     os.path.join(self.jobs[2], 'tleap.log'))
+            worker, = pool._idle.queue
+            self.assertEqual(worker.jobs, 1)
+
+            result = pool.run("crash\n", self.jobs[2],
+                              os.path.join(self.jobs[2], 'crash.log'))
+            self.assertEqual(result.returncode, 3)
+            self.assertEqual(list(pool._idle.queue), [None])
+            self.assertEqual(worker.process.returncode, 3)
+        finally:
+            pool.close()
+
+    def test_pool_timeout(self):
+        setup, commands = tleap_pool.split_setup(JOB)
+        pool = tleap_pool.TleapPool(setup, size=1, command=self.tleap,
+                                    timeout=0.5)
+        try:
+            pool.run(commands, self.jobs[0],
+                     os.path.join(self.jobs[0], 'tleap.log'))
+            worker, = pool._idle.queue
+            with self.assertRaises(TimeoutError):
+                pool.run("hang\n", self.jobs[1],
+                         os.path.join(self.jobs[1], 'tleap.log'))
+            self.assertIsNotNone(worker.process.poll())
+            # Replaced by a new worker, which runs the next job
+            replacement, = pool._idle.queue
+            self.assertIsNot(replacement, worker)
+            self.assertIsNone(replacement.process.poll())
+            result = pool.run(commands, self.jobs[2],
+                              os.path.join(self.jobs[2], 'tleap.log'))
+            self.assertEqual(result.returncode, 0)
+        finally:
+            pool.close()
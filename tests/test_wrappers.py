@@ -1,3 +1,6 @@
+import os
+import posixpath
+import tempfile
 import unittest
 import unittest.mock as mock
 import wrappers
@@ -17,11 +20,19 @@ def iterable_mock_open(_mock=None, read_data=''):
     return mock_open
 
 
+def pdb_text(pdb):
+    output = StringIO()
+    pdb.to_file(output)
+    return output.getvalue()
+
+
 def setup_mock(mock_os, mock_os_path):
     mock_os_path.exists.return_value = False
     mock_os_path.isfile.return_value = True
     mock_os.environ = {'AMBERHOME': ""}
     mock_os.getcwd.return_value = '.'
+    mock_os_path.join.side_effect = posixpath.join
+    mock_os_path.abspath.side_effect = lambda path: path
 
 
 class TestAntechamberWrapper(unittest.TestCase):
@@ -38,10 +49,11 @@ class TestAntechamberWrapper(unittest.TestCase):
         mock_utils.run_in_shell.assert_has_calls([
             mock.call("/bin/antechamber -i ligand.pdb -fi pdb "
                       "-o XXX.prepc -fo prepc -rn XXX -c bcc -nc 1",
-                      'antechamber.out'),
+                      'antechamber/antechamber.out', 'antechamber'),
             mock.call(("/bin/parmchk2 -i XXX.prepc -f prepc -o XXX.frcmod"),
-                      'parmchk2.out')
+                      'antechamber/parmchk2.out', 'antechamber')
         ])
+        pdb.to_filename.assert_called_once_with('antechamber/ligand.pdb')
 
 
 class TestPdb4AmberReduceWrapper(unittest.TestCase):
@@ -71,6 +83,47 @@ class TestPdb4AmberReduceWrapper(unittest.TestCase):
         self.assertEqual(len(result.pdb.atoms), 4080)
         self.assertEqual(result.nonprot_residues, {'0RN'})
 
+    @mock.patch('wrappers.utils')
+    @mock.patch.dict('wrappers.os.environ', {'AMBERHOME': '/amber'})
+    def test_pdb4amber_reduce_stream(self, mock_utils):
+        with open('tests/test_files/full.pdb') as f:
+            pdb = pdb_utils.Pdb(f)
+
+        def stream_in_shell(commands, input, output, cwd):
+            for suffix in ['_nonprot.pdb', '_water.pdb']:
+                with open(os.path.join(cwd, 'stdout' + suffix), 'w') as f:
+                    with open('tests/test_files/pdb4amber_nonprot.pdb') as g:
+                        f.write(g.read())
+            with open('tests/test_files/reduce.pdb') as f:
+                yield from f.readlines()
+        mock_utils.stream_in_shell.side_effect = stream_in_shell
+
+        with tempfile.TemporaryDirectory() as tmp:
+            result = wrappers.Pdb4AmberReduceWrapper(pdb, tmp, stream=True)
+            self.assertEqual(sorted(os.listdir(tmp)),
+                             ['pdb4amber_nonprot.pdb', 'pdb4amber_water.pdb'])
+        commands, input = mock_utils.stream_in_shell.call_args[0][:2]
+        self.assertEqual(commands,
+                         ["/amber/bin/pdb4amber --nohyd --dry",
+                          "/amber/bin/reduce -build -nuclear -"])
+        self.assertEqual(input, pdb_text(pdb))
+        mock_utils.run_in_shell.assert_not_called()
+        self.assertEqual(len(result.pdb.atoms), 4080)
+        self.assertEqual(result.nonprot_residues, {'0RN'})
+
+        # Same backend and structure as parsing reduce.pdb from the file
+        with tempfile.TemporaryDirectory() as tmp:
+            with open('tests/test_files/reduce.pdb') as f:
+                with open(os.path.join(tmp, 'reduce.pdb'), 'w') as g:
+                    g.write(f.read())
+            for suffix in ['_nonprot.pdb', '_water.pdb']:
+                with open(os.path.join(tmp, 'pdb4amber' + suffix), 'w') as f:
+                    with open('tests/test_files/pdb4amber_nonprot.pdb') as g:
+                        f.write(g.read())
+            reused = wrappers.Pdb4AmberReduceWrapper(pdb, tmp, reuse=True)
+        self.assertIs(type(result.pdb.atoms), type(reused.pdb.atoms))
+        self.assertEqual(pdb_text(result.pdb), pdb_text(reused.pdb))
+
     def test_get_renamed_histidines(self):
         renamed_histidines = {'A_262_HIS': 'HIE',
                               'A_1_HIS': 'HIE',
@@ -124,7 +177,7 @@ class TestPropkaWrapper(unittest.TestCase):
             mock_open = iterable_mock_open(read_data=f.read())
 
         with mock.patch('wrappers.open', mock_open):
-            result = wrappers.PropkaWrapper(pdb)
+            result = wrappers.PropkaWrapper(pdb, in_process=False)
         residues = result.pdb.residues()
 
         self.assertEqual(len(result.prot_list), 1)
@@ -133,6 +186,97 @@ class TestPropkaWrapper(unittest.TestCase):
         self.assertIn('A_189_ASH', residues)
         self.assertEqual(len(residues['A_189_ASH']), 12)
 
+    @unittest.skipIf(not wrappers.propka_api_available(),
+                     "propka >= 3.2 is not installed")
+    def test_run_propka(self):
+        with open('tests/test_files/reduce.pdb') as f:
+            pdb = pdb_utils.Pdb(f)
+        with open('tests/test_files/propka.pka') as f:
+            self.assertEqual(wrappers.run_propka(pdb),
+                             wrappers.parse_propka_output(f))
+
+    @unittest.skipIf(not wrappers.propka_api_available(),
+                     "propka >= 3.2 is not installed")
+    @mock.patch('wrappers.utils')
+    @mock.patch('wrappers.print')
+    def test_propka_in_process(self, mock_print, mock_utils):
+        with open('tests/test_files/reduce.pdb') as f:
+            pdb = pdb_utils.Pdb(f)
+        with tempfile.TemporaryDirectory() as tmp:
+            result = wrappers.PropkaWrapper(pdb, working_directory=tmp)
+            mock_utils.run_in_shell.assert_not_called()
+            self.assertEqual(os.listdir(tmp), ['pka.json'])
+            reused = wrappers.PropkaWrapper(pdb, working_directory=tmp,
+                                            reuse=True)
+        self.assertEqual(result.prot_list, reused.prot_list)
+        self.assertEqual([entry['resSeq'] for entry in result.prot_list],
+                         [189])
+
+    @mock.patch('wrappers.shutil.which')
+    @mock.patch('wrappers.utils')
+    @mock.patch('wrappers.print')
+    def test_propka_old_api(self, mock_print, mock_utils, mock_which):
+        # propka 3.1: propka.run.single(pdbfile, optargs) writes a .pka file
+        # and the package has no __version__
+        def single(pdbfile, optargs=None):
+            raise AssertionError("propka 3.1 API called")
+        old_propka = mock.Mock(spec=['run'])
+        old_propka.run = mock.Mock(spec=['single'])
+        old_propka.run.single = single
+        mock_which.return_value = '/usr/bin/propka31'
+
+        with open('tests/test_files/reduce.pdb') as f:
+            pdb = pdb_utils.Pdb(f)
+        with open('tests/test_files/propka.pka') as f:
+            pka = f.read()
+
+        def run_in_shell(command, output, directory):
+            with open(os.path.join(directory, 'input.pka'), 'w') as f:
+                f.write(pka)
+        mock_utils.run_in_shell.side_effect = run_in_shell
+        mock_utils.make_working_directory.side_effect = os.makedirs
+
+        with mock.patch('wrappers.propka', old_propka):
+            self.assertFalse(wrappers.propka_api_available())
+            self.assertEqual(wrappers.propka_version(), '/usr/bin/propka31')
+            self.assertIsNone(wrappers.propka_version(in_process=True))
+            with tempfile.TemporaryDirectory() as tmp:
+                result = wrappers.PropkaWrapper(
+                    pdb, working_directory=os.path.join(tmp, 'propka'))
+            with self.assertRaises(ImportError):
+                wrappers.PropkaWrapper(pdb, in_process=True)
+        self.assertEqual(mock_utils.run_in_shell.call_args[0][0],
+                         "propka31 input.pdb")
+        self.assertEqual([entry['resSeq'] for entry in result.prot_list],
+                         [189])
+
+    @mock.patch('wrappers.utils')
+    @mock.patch('wrappers.print')
+    def test_propka_sweep(self, mock_print, mock_utils):
+        with open('tests/test_files/reduce.pdb') as f:
+            pdb = pdb_utils.Pdb(f)
+        with open('tests/test_files/propka.pka') as f:
+            propka_results = wrappers.parse_propka_output(f)
+        with mock.patch('wrappers.get_propka_results') as mock_results:
+            mock_results.return_value = propka_results
+            sweep = wrappers.PropkaSweepWrapper(pdb, [9.0, 7.0, 6.0, 5.0])
+        mock_results.assert_called_once()
+        self.assertEqual([state['phs'] for state in sweep.states],
+                         [[5.0, 6.0, 7.0], [9.0]])
+        self.assertEqual(sweep.ph_states, {5.0: 0, 6.0: 0, 7.0: 0, 9.0: 1})
+        self.assertEqual(sweep.summary()['states'][0]['protonated'],
+                         ['A_189_ASP'])
+
+        # Same structures as separate runs at every pH
+        for ph in [5.0, 9.0]:
+            with mock.patch('wrappers.get_propka_results') as mock_results:
+                mock_results.return_value = propka_results
+                single = wrappers.PropkaWrapper(pdb, ph=ph)
+            state = sweep.states[sweep.ph_states[ph]]
+            self.assertEqual(state['pdb'].atoms, single.pdb.atoms)
+            self.assertEqual(state['prot_list'], single.prot_list)
+            self.assertEqual(state['deprot_list'], single.deprot_list)
+
 
 class TestTleapWrapper(unittest.TestCase):
 
@@ -200,3 +344,77 @@ class TestTleapWrapper(unittest.TestCase):
         generated_input.seek(0)
         with open('tests/test_files/sphere.in') as f:
             self.assertEqual(generated_input.read(), f.read())
+
+    def test_sphere_sweep_inputs(self):
+        from tleap import sphere
+        with open('tleap/sphere.in') as f:
+            template = f.read()
+        params = {'name': 'XXX', 'include': "loadoff XXX.off",
+                  'solvent_radius': 20.0, 'solvent_closeness': 0.75,
+                  'ligand': [{'name': "CA", 'resSeq': 1}]}
+        single = sphere.run(dict(params), template).splitlines()
+        build = sphere.build(dict(params), template).splitlines()
+        solvate = sphere.solvate(dict(params), template,
+                                 '../XXX.dry.off').splitlines()
+        self.assertEqual(build[-2:], ["saveoff mol_xwat XXX.dry.off", "quit"])
+        self.assertEqual(build[:-2], single[:len(build) - 2])
+        self.assertEqual(solvate[:4], single[:4])
+        self.assertEqual(solvate[4], "loadoff ../XXX.dry.off")
+        self.assertEqual(solvate[-4:], single[-4:])
+        self.assertNotIn("mol = loadpdb input.pdb", solvate)
+
+    @mock.patch('builtins.print')
+    @mock.patch('wrappers.utils.run_all_in_shell')
+    @mock.patch('wrappers.utils.run_in_shell')
+    @mock.patch('wrappers.get_tleap_includes')
+    def test_tleap_sweep(self, mock_includes, mock_run, mock_run_all,
+                         mock_print):
+        mock_includes.return_value = ""
+        result = mock.MagicMock(returncode=0, wall_time=1.0)
+
+        def build(command, output, cwd):
+            open(os.path.join(cwd, 'XXX.dry.off'), 'w').close()
+            return result
+
+        def solvate(commands, limit):
+            for _, _, cwd in commands:
+                with open(os.path.join(cwd, 'tleap.in')) as f:
+                    for line in f:
+                        if line.startswith('saveamberparm'):
+                            for name in line.split()[2:]:
+                                open(os.path.join(cwd, name), 'w').close()
+            return [result] * len(commands)
+
+        mock_run.side_effect = build
+        mock_run_all.side_effect = solvate
+        params = {'name': 'XXX', 'pdb': mock.MagicMock(),
+                  'water_pdb': mock.MagicMock(),
+                  'solvent_radius': 20.0, 'solvent_closeness': 0.75,
+                  'ligand': [{'name': "CA", 'resSeq': 1}]}
+        with tempfile.TemporaryDirectory() as directory:
+            sweep = wrappers.TleapSweepWrapper(
+                'sphere', params=params,
+                variants=[{}, {'solvent_radius': 25.0},
+                          {'solvent_closeness': 1.0}],
+                working_directory=directory)
+            summary = sweep.summary()
+            self.assertEqual([entry['directory'] for entry in summary],
+                             ['sp20_c0.75', 'sp25_c0.75', 'sp20_c1'])
+            self.assertTrue(all(entry['ok'] for entry in summary))
+            self.assertEqual(list(summary[1]['outputs']),
+                             ['XXX.sp25.top', 'XXX.sp25.rst'])
+            self.assertTrue(os.path.isfile(
+                os.path.join(directory, 'sweep.json')))
+
+    def test_unique_variants(self):
+        params = {'solvent_radius': 20.0, 'solvent_closeness': 0.75}
+        variants = wrappers.unique_variants(
+            params, [{}, {'solvent_radius': 25}, {'solvent_radius': 20.0},
+                     {'solvent_radius': 25.0}])
+        self.assertEqual([name for name, _ in variants],
+                         ['sp20_c0.75', 'sp25_c0.75'])
+        self.assertEqual(variants[1][1]['solvent_radius'], 25)
+        with self.assertRaises(ValueError):
+            wrappers.unique_variants(
+                params, [{'solvent_radius': 25.0},
+                         {'solvent_radius': 25.0, 'template': 'other'}])
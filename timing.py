@@ -0,0 +1,155 @@
+"""
+Timing and resource instrumentation of prep runs.
+
+Timings.stage wraps a protocol stage and records its wall time, the CPU
+time of the thread running it, the external commands it ran (with their
+own CPU time and peak memory from runner.RunResult), the Python-side steps
+timed with step() and the sizes of the files left in its directory.
+The stage being recorded is kept per thread, so wrappers only call the
+module functions step, count and record_command, which do nothing outside
+of a recorded stage. Timings.write dumps everything as JSON.
+"""
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+import runner
+
+_current = threading.local()
+
+
+class StageRecord(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.commands = []  # runner.RunResult of every command
+        self.steps = []     # dicts of Python-side steps
+        self.counts = {}    # e.g. atoms_in, atoms_out
+        self.files = {}     # file name: size in bytes
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'start': self.start,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'child_cpu_time': sum(c.cpu_time for c in self.commands),
+            'child_max_rss': max([c.max_rss for c in self.commands],
+                                 default=0),
+            'commands': [c._asdict() for c in self.commands],
+            'steps': self.steps,
+            'counts': self.counts,
+            'files': self.files
+        }
+
+
+class Timings(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, directory=None):
+        """
+        Records the enclosed block as stage name. Sizes of the files in
+        directory are recorded when the block finishes.
+        """
+        record = StageRecord(name)
+        previous = getattr(_current, 'record', None)
+        _current.record = record
+        record.start = time.time() - self.start
+        start = time.monotonic()
+        cpu_start = time.thread_time()
+        try:
+            yield record
+        finally:
+            record.wall_time = time.monotonic() - start
+            record.cpu_time = time.thread_time() - cpu_start
+            _current.record = previous
+            if directory is not None:
+                record.files = file_sizes(directory)
+            with self._lock:
+                self.stages.append(record)
+
+    def wrap(self, name, function, directory=None):
+        """function recorded as stage name whenever it is called"""
+        def timed(*args, **kwargs):
+            with self.stage(name, directory):
+                return function(*args, **kwargs)
+        return timed
+
+    def to_dict(self):
+        stages = sorted(self.stages, key=lambda record: record.start)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return {
+            'wall_time': time.time() - self.start,
+            'cpu_time': usage.ru_utime + usage.ru_stime,
+            'max_rss': usage.ru_maxrss,
+            'stages': [record.to_dict() for record in stages],
+            'tools': runner.summarize(command for record in stages
+                                      for command in record.commands)
+        }
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def current():
+    """StageRecord being recorded in this thread or None"""
+    return getattr(_current, 'record', None)
+
+
+@contextlib.contextmanager
+def step(name, filename=None):
+    """
+    Times the enclosed Python-side step of the current stage. The size of
+    filename (read or written by the step) is recorded with it.
+    """
+    record = current()
+    if record is None:
+        yield
+        return
+    start = time.monotonic()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        entry = {'name': name,
+                 'wall_time': time.monotonic() - start,
+                 'cpu_time': time.thread_time() - cpu_start}
+        if filename is not None and os.path.isfile(filename):
+            entry['file'] = os.path.basename(filename)
+            entry['size'] = os.path.getsize(filename)
+        record.steps.append(entry)
+
+
+def count(**counts):
+    """Records counts (e.g. atoms_in=...) for the current stage"""
+    record = current()
+    if record is not None:
+        record.counts.update(counts)
+
+
+def record_command(result):
+    """Adds runner.RunResult of a command to the current stage"""
+    record = current()
+    if record is not None:
+        record.commands.append(result)
+
+
+def file_sizes(directory):
+    """dict of relative file name: size of all files under directory"""
+    sizes = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            sizes[os.path.relpath(path, directory)] = os.path.getsize(path)
+    return sizes
@@ -1,4 +1,8 @@
 import os
+import prmtop
+
+# Everything after this line of the template only solvates mol_xwat
+SOLVATION_MARKER = '##### Up to here'
 
 
 def run(params, template):
@@ -6,12 +10,58 @@ def run(params, template):
     return template.format(**params)
 
 
-def check(params):
-    top_file = "{name}.sp{solvent_radius:.0f}.top".format(**params)
-    rst_file = "{name}.sp{solvent_radius:.0f}.rst".format(**params)
-    if os.path.isfile(top_file) and os.path.isfile(rst_file):
-        print("Generated topology (prmtop) file {}".format(top_file))
-        print("Generated coordinate (inpcrd) file {}".format(rst_file))
-    else:
-        print("Something went wrong, check {}/tleap.log."
-              .format(params['name']))
+def build(params, template):
+    """
+    tleap input building the dry system with crystal waters once and
+    saving it as unit mol_xwat to the library {name}.dry.off
+    """
+    setup, build, _ = split_template(template)
+    return run(params, setup + build +
+               "saveoff mol_xwat {name}.dry.off\nquit\n")
+
+
+def solvate(params, template, library):
+    """tleap input solvating mol_xwat loaded from library with params"""
+    setup, _, solvation = split_template(template)
+    return run(dict(params, library=library),
+               setup + "loadoff {library}\n" + solvation)
+
+
+def split_template(template):
+    """(force field setup, dry system build, solvation) parts of template"""
+    setup, rest = template.split('{include}\n', 1)
+    build, solvation = rest.split(SOLVATION_MARKER, 1)
+    # Drop the rest of the marker line
+    return setup + '{include}\n', build, solvation.split('\n', 1)[1]
+
+
+def outputs(params):
+    """Names of the topology and coordinate files written for params"""
+    return ("{name}.sp{solvent_radius:.0f}.top".format(**params),
+            "{name}.sp{solvent_radius:.0f}.rst".format(**params))
+
+
+def check(params, working_directory='.'):
+    """
+    Verifies the topology and coordinates written by tleap (see
+    prmtop.verify) and returns the report, None if they are missing
+    """
+    top_file, rst_file = outputs(params)
+    top_path = os.path.join(working_directory, top_file)
+    rst_path = os.path.join(working_directory, rst_file)
+    if not (os.path.isfile(top_path) and os.path.isfile(rst_path)):
+        print("Something went wrong, check {}."
+              .format(os.path.join(working_directory, 'tleap.log')))
+        return None
+    print("Generated topology (prmtop) file {}".format(top_file))
+    print("Generated coordinate (inpcrd) file {}".format(rst_file))
+    try:
+        report = prmtop.verify(top_path, rst_path, params.get('pdb'))
+    except (ValueError, IndexError, OSError) as e:
+        report = {'problems': ["Cannot read {}: {}".format(top_file, e)]}
+    if 'atoms' in report:
+        print("{atoms} atoms, {waters} waters, total charge {charge:.3f}"
+              .format(**report))
+    for problem in report['problems']:
+        print("WARNING: " + problem)
+    return report
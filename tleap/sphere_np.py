@@ -0,0 +1,38 @@
+"""
+Same system as the sphere template, but the sphere of water is computed
+with NumPy by the solvent module instead of tleap's solvatecap. tleap only
+loads the waters from solvent.pdb, written by prepare before it runs.
+The topology has no solvent cap information (IFCAP).
+"""
+import os
+import solvent
+import timing
+# The sphere template functions work unchanged on this template
+from .sphere import (run, build, solvate, split_template,  # noqa: F401
+                     outputs, check)
+
+SOLVENT_FILE = 'solvent.pdb'
+
+
+def prepare(params, working_directory='.'):
+    """
+    Writes the waters filling the sphere of params['solvent_radius']
+    around the first ligand atom (the center of solvatecap in the sphere
+    template) that do not clash with the protein, ligand and crystal waters
+    """
+    box = solvent.load_box(params.get('solvent_box') or
+                           solvent.default_library())
+    structures = [params['pdb'], params['water_pdb']]
+    center = [params['ligand'][0][key] for key in ['x', 'y', 'z']]
+    filename = os.path.join(working_directory, SOLVENT_FILE)
+    with timing.step('solvate sphere', filename):
+        waters = solvent.solvate_sphere(
+            solvent.np.concatenate([pdb.coordinates()
+                                    for pdb in structures]),
+            solvent.np.concatenate([solvent.atom_radii(pdb)
+                                    for pdb in structures]),
+            center, params['solvent_radius'], params['solvent_closeness'],
+            box)
+        solvent.write_waters(filename, waters, box.names)
+    timing.count(solvent_waters=len(waters))
+    return waters
@@ -0,0 +1,271 @@
+"""
+Pool of long-lived tleap processes.
+
+Starting tleap and sourcing the force fields is a large fixed cost of
+every system. A TleapWorker starts tleap once with the setup commands (the
+source commands a template begins with) and then reads the commands of one
+job after another on its stdin. tleap cannot change its directory, so
+relative file names of a job are made absolute in the job's directory, and
+the output of every job goes to its own log file through logFile. A job is
+finished when tleap has switched to the next log file. After every job
+clearVariables removes its units. Workers are replaced when a job fails,
+when tleap dies and after max_jobs jobs. A job running longer than the
+timeout of the pool kills its worker, which is replaced right away, and
+raises TimeoutError. Libraries and parameters loaded by
+a job (loadoff, loadamberprep, loadamberparams) stay loaded; a later job
+loading the same residues or atom types overrides them.
+"""
+import atexit
+import os
+import queue
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import runner
+
+# Arguments (after the command) that are files read or written by tleap
+LOAD_COMMANDS = {'loadpdb': [0], 'loadoff': [0], 'loadamberprep': [0],
+                 'loadamberparams': [0], 'loadmol2': [0], 'source': [0]}
+SAVE_COMMANDS = {'savepdb': [1], 'saveoff': [1], 'saveamberparm': [1, 2],
+                 'savemol2': [1], 'logfile': [0]}
+POLL_INTERVAL = 0.01
+# Seconds a job may take before its worker is killed
+DEFAULT_TIMEOUT = 1800
+ERROR_MARKER = 'Error!'
+
+
+def split_setup(commands):
+    """(leading source commands, remaining commands) of a tleap input"""
+    lines = commands.splitlines(keepends=True)
+    count = 0
+    while count < len(lines) and lines[count].split()[:1] == ['source']:
+        count += 1
+    return ''.join(lines[:count]), ''.join(lines[count:])
+
+
+def job_commands(commands, directory):
+    """
+    List of the commands of a job run in directory. Comments, empty lines
+    and quit are left out and file names are made absolute.
+    """
+    result = []
+    for line in commands.splitlines():
+        words = line.split()
+        if not words or words[0].startswith('#') or words[0] == 'quit':
+            continue
+        # e.g. mol = loadpdb input.pdb
+        start = 2 if words[1:2] == ['='] else 0
+        command = words[start].lower() if len(words) > start else None
+        arguments = words[start + 1:]
+        for index in LOAD_COMMANDS.get(command, []):
+            # Anything else is found in tleap's search path
+            if (index < len(arguments) and
+                    os.path.exists(os.path.join(directory,
+                                                arguments[index]))):
+                arguments[index] = quote(os.path.join(directory,
+                                                      arguments[index]))
+        for index in SAVE_COMMANDS.get(command, []):
+            if index < len(arguments):
+                arguments[index] = quote(os.path.join(directory,
+                                                      arguments[index]))
+        result.append(' '.join(words[:start + 1] + arguments))
+    return result
+
+
+def quote(path):
+    return '"{}"'.format(path) if ' ' in path else path
+
+
+def process_usage(pid):
+    """(CPU seconds, peak RSS in kB) of a running process, from /proc"""
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu_time = ((int(fields[11]) + int(fields[12])) /
+                    os.sysconf('SC_CLK_TCK'))
+        max_rss = 0
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    max_rss = int(line.split()[1])
+        return cpu_time, max_rss
+    except (OSError, IndexError, ValueError):
+        return 0.0, 0
+
+
+class TleapWorker(object):
+    """tleap process that has run setup and waits for jobs on its stdin"""
+
+    def __init__(self, setup, command='tleap'):
+        self.command = command
+        self.directory = tempfile.mkdtemp(prefix='tleap_worker_')
+        with open(os.path.join(self.directory, 'setup.in'), 'w') as f:
+            f.write(setup)
+        with open(os.path.join(self.directory, 'tleap.out'), 'wb') as out:
+            self.process = subprocess.Popen(
+                shlex.split(command) + ['-f', 'setup.in'],
+                cwd=self.directory, stdin=subprocess.PIPE, stdout=out,
+                stderr=subprocess.STDOUT, start_new_session=True
+            )
+        self.jobs = 0
+        self.failed = False
+
+    def run(self, commands, directory, log, timeout=None):
+        """
+        Runs commands (tleap input) for files in directory with tleap
+        output going to log. Returns a runner.RunResult; a job is failed
+        (non-zero returncode) if tleap died, timed out or reported an error.
+        """
+        directory = os.path.abspath(directory)
+        log = os.path.abspath(log)
+        self.jobs += 1
+        done = os.path.join(self.directory, 'done_{}'.format(self.jobs))
+        lines = (['logFile ' + quote(log)] +
+                 job_commands(commands, directory) +
+                 ['clearVariables', 'logFile ' + quote(done)])
+
+        start = time.monotonic()
+        cpu_start, _ = process_usage(self.process.pid)
+        timed_out = False
+        try:
+            self.process.stdin.write(('\n'.join(lines) + '\n').encode())
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            pass
+        while not os.path.exists(done):
+            if self.process.poll() is not None:
+                break
+            if timeout is not None and time.monotonic() - start > timeout:
+                timed_out = True
+                self.kill()
+                break
+            time.sleep(POLL_INTERVAL)
+        cpu_time, max_rss = process_usage(self.process.pid)
+
+        if self.process.poll() is not None:
+            returncode = self.process.returncode or 1
+        else:
+            returncode = 0
+            if os.path.isfile(log):
+                with open(log, errors='replace') as f:
+                    if any(ERROR_MARKER in line for line in f):
+                        returncode = 1
+            previous = os.path.join(self.directory,
+                                    'done_{}'.format(self.jobs - 1))
+            if os.path.exists(previous):
+                os.remove(previous)
+        self.failed = returncode != 0
+        return runner.RunResult(shlex.split(self.command) + ['(pool)'],
+                                returncode, time.monotonic() - start,
+                                max(cpu_time - cpu_start, 0.0), max_rss,
+                                timed_out)
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write(b'quit\n')
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except (BrokenPipeError, subprocess.TimeoutExpired):
+                self.kill()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+
+
+class TleapPool(object):
+    """
+    At most size TleapWorkers with the same setup, started when needed.
+    run can be called from several threads at once. Jobs taking longer
+    than timeout seconds (None for no limit) are stopped.
+    """
+
+    def __init__(self, setup, size=1, max_jobs=100, command='tleap',
+                 timeout=DEFAULT_TIMEOUT):
+        self.setup = setup
+        self.max_jobs = max_jobs
+        self.command = command
+        self.timeout = timeout
+        # None stands for a worker that has not been started yet
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(None)
+
+    def run(self, commands, directory, log, timeout=None):
+        """
+        TleapWorker.run on an idle worker. If the job takes longer than
+        timeout (by default the timeout of the pool), the worker is killed
+        and replaced by a new one and TimeoutError is raised.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        worker = self._idle.get()
+        try:
+            if worker is None:
+                worker = TleapWorker(self.setup, self.command)
+            result = worker.run(commands, directory, log, timeout)
+            if result.timed_out:
+                worker.close()
+                worker = None
+                worker = TleapWorker(self.setup, self.command)
+            elif worker.failed or worker.jobs >= self.max_jobs:
+                worker.close()
+                worker = None
+        except BaseException:
+            if worker is not None:
+                worker.close()
+                worker = None
+            raise
+        finally:
+            self._idle.put(worker)
+        if result.timed_out:
+            raise TimeoutError("tleap job in {} timed out after {:.0f} s"
+                               .format(directory, result.wall_time))
+        return result
+
+    def close(self):
+        """Stops the idle workers"""
+        workers = []
+        while True:
+            try:
+                workers.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for worker in workers:
+            if worker is not None:
+                worker.close()
+            self._idle.put(None)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(setup, size=1, max_jobs=100, timeout=DEFAULT_TIMEOUT):
+    """
+    Pool for setup shared by everything run in this process (e.g. all the
+    jobs of a batch worker), closed when the process exits
+    """
+    key = (setup, size, max_jobs, timeout)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = TleapPool(setup, size, max_jobs, timeout=timeout)
+        return _pools[key]
+
+
+@atexit.register
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -1,6 +1,8 @@
+import asyncio
 import os
 import shutil
-import subprocess
+import runner
+import timing
 
 
 def check_file(name, message=None):
@@ -8,11 +10,14 @@ def check_file(name, message=None):
         raise FileNotFoundError(message or "File " + name + " not found.")
 
 
-def set_working_directory(working_directory):
+def make_working_directory(working_directory):
+    """
+    Creates an empty working_directory (removing the old one if present).
+    The current directory of the process is not changed.
+    """
     if os.path.exists(working_directory):
         shutil.rmtree(working_directory)
     os.makedirs(working_directory)
-    os.chdir(working_directory)
 
 
 def file_in_paths(filename, path_list):
@@ -28,12 +33,41 @@ def merge_dicts_of_dicts(dict1, dict2):
             for key in set(dict1.keys()) | set(dict2.keys())}
 
 
-def run_in_shell(command, output):
+def run_in_shell(command, output, cwd=None, timeout=None):
+    """
+    Runs given command in directory cwd, streaming both STDOUT and STDERR to
+    the output file. Waits for the command to finish and returns its
+    runner.RunResult (exit status, wall/CPU time and peak memory), which
+    is also recorded in the timing stage being run.
+    The command is split like a shell would do it but not run in a shell,
+    so it cannot use redirections or pipes.
+    """
+    result = runner.run(command, output, cwd, timeout)
+    timing.record_command(result)
+    if result.timed_out:
+        print("WARNING: {} timed out after {:.0f} s."
+              .format(command, result.wall_time))
+    return result
+
+
+def run_all_in_shell(commands, limit=None):
+    """
+    Runs (command, output, cwd) tuples like run_in_shell, concurrently with
+    at most limit at a time. Returns their RunResults in order.
+    """
+    results = asyncio.run(runner.run_all(commands, limit))
+    for result in results:
+        timing.record_command(result)
+    return results
+
+
+def stream_in_shell(commands, input, output, cwd=None):
     """
-    Runs given command in the shell, redirecting both STDOUT and STDERR to
-    the output file. Waits for the command to finish.
+    Generator of the output lines of commands connected by pipes and fed
+    input, see runner.stream. Their stderr goes to the output file and
+    their RunResults are recorded in the timing stage being run.
     """
-    with open(output, 'w') as f:
-        proc = subprocess.Popen(command, shell=True, stdout=f,
-                                stderr=subprocess.STDOUT)
-        proc.wait()
+    results = []
+    yield from runner.stream(commands, input, output, cwd, results)
+    for result in results:
+        timing.record_command(result)
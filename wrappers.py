@@ -1,8 +1,20 @@
+import concurrent.futures
+import inspect
+import io
+import json
 import os
 import shutil
+import ligand_cache
 import pdb_utils
+import timing
+import tleap_pool
 import utils
-import tleap
+
+try:
+    import propka
+    import propka.run
+except ImportError:
+    propka = None
 
 
 def get_amberhome():
@@ -14,77 +26,184 @@ def get_amberhome():
 class AntechamberWrapper(object):
 
     def __init__(self, pdb, name, charge=0,
-                 working_directory="antechamber", create_frcmod=True):
+                 working_directory="antechamber", create_frcmod=True,
+                 cache=None):
+        """
+        cache is an optional ligand_cache.LigandCache. If it holds
+        parameters for this ligand, antechamber and parmchk2 are not run.
+        """
 
         amberhome = get_amberhome()
-        utils.set_working_directory(working_directory)
-        pdb.to_filename('ligand.pdb')
+        directory = os.path.abspath(working_directory)
+        utils.make_working_directory(directory)
+        ligand_filename = os.path.join(directory, 'ligand.pdb')
+        with timing.step('write ligand.pdb', ligand_filename):
+            pdb.to_filename(ligand_filename)
+        timing.count(atoms_in=len(pdb.atoms))
+        self.working_directory = directory
+
+        filenames = [name + '.prepc']
+        if create_frcmod:
+            filenames.append(name + '.frcmod')
+        if cache is not None:
+            key = ligand_cache.ligand_key(
+                pdb, name, charge, 'bcc', ligand_cache.tool_version(amberhome)
+            )
+            self.from_cache = cache.get(key, filenames, directory)
+            if self.from_cache:
+                print("Using cached parameters for ligand {}".format(name))
+                return
+        else:
+            self.from_cache = False
 
         antechamber_command = (amberhome + "/bin/antechamber " +
                                "-i ligand.pdb -fi pdb -o {name}.prepc "
                                "-fo prepc -rn {name} -c bcc -nc {charge}"
                                .format(name=name, charge=charge))
-        utils.run_in_shell(antechamber_command, 'antechamber.out')
-        utils.check_file(name + '.prepc',
+        utils.run_in_shell(antechamber_command,
+                           os.path.join(directory, 'antechamber.out'),
+                           directory)
+        utils.check_file(os.path.join(directory, name + '.prepc'),
                          "Antechamber failed to generate {name}.prepc file"
                          .format(name=name))
 
-        self.working_directory = os.getcwd()
         if create_frcmod:
             parmck_command = (amberhome + "/bin/parmchk2 " +
                               "-i {name}.prepc -f prepc -o {name}.frcmod"
                               .format(name=name))
-            utils.run_in_shell(parmck_command, 'parmchk2.out')
+            utils.run_in_shell(parmck_command,
+                               os.path.join(directory, 'parmchk2.out'),
+                               directory)
             # TODO: check for ATTN warnings
 
-        os.chdir('..')
-
-
-class Pdb4AmberReduceWrapper(object):
-
-    def __init__(self, pdb, working_directory="pdb4amber_reduce"):
-
-        amberhome = get_amberhome()
-        utils.set_working_directory(working_directory)
-        pdb.to_filename('input.pdb')
-
-        pdb4amber_command = (amberhome + "/bin/pdb4amber "
-                             "-i input.pdb -o pdb4amber.pdb --nohyd --dry")
-        utils.run_in_shell(pdb4amber_command, 'pdb4amber.out')
+        if cache is not None:
+            cache.put(key, filenames, directory)
 
-        reduce_command = (amberhome + "/bin/reduce "
-                          "-build -nuclear pdb4amber.pdb")
-        utils.run_in_shell(reduce_command, 'reduce.pdb')
 
-        with open('reduce.pdb') as f:
-            self.pdb = pdb_utils.Pdb(f)
+# pdb4amber writing to stdout names its side files stdout_*.pdb
+PDB4AMBER_STDOUT = 'stdout'
 
-        renamed_histidines = get_renamed_histidines(self.pdb)
-        residues = self.pdb.residues()
 
-        for res_hash, res_name in renamed_histidines.items():
-            pdb_utils.modify_atoms(residues.get(res_hash, []),
-                                   'resName', res_name)
-
-        # Remove hydrogens on HETATMs
-        self.pdb.atoms = [atom for atom in self.pdb.atoms
-                          if (atom['record'] != 'HETATM' or
-                              'new' not in atom['extras'])]
+class Pdb4AmberReduceWrapper(object):
 
-        # Remove hydrogens added by reduce to non-protein residues
-        with open('pdb4amber_nonprot.pdb') as f:
-            self.nonprotPdb = pdb_utils.Pdb(f)
+    def __init__(self, pdb, working_directory="pdb4amber_reduce",
+                 reuse=False, stream=False, debug=False):
+        """
+        If stream is True, pdb is piped into pdb4amber, its output piped
+        into reduce and the output of reduce parsed as it arrives, without
+        writing input.pdb, pdb4amber.pdb and reduce.pdb (unless debug is
+        True). If reuse is True, pdb4amber and reduce are not run and
+        their output already in working_directory is processed.
+        """
+
+        directory = os.path.abspath(working_directory)
+        reduce_filename = os.path.join(directory, 'reduce.pdb')
+        if reuse and not os.path.isfile(reduce_filename):
+            # Streamed run, reduce output is not available
+            reuse = False
+        if not reuse:
+            amberhome = get_amberhome()
+            utils.make_working_directory(directory)
+
+        if not reuse and stream:
+            with timing.step('pdb4amber | reduce'):
+                self.pdb = stream_pdb4amber_reduce(pdb, amberhome, directory,
+                                                   debug)
+        else:
+            if not reuse:
+                input_filename = os.path.join(directory, 'input.pdb')
+                with timing.step('write input.pdb', input_filename):
+                    pdb.to_filename(input_filename)
+
+                pdb4amber_command = (amberhome + "/bin/pdb4amber "
+                                     "-i input.pdb -o pdb4amber.pdb "
+                                     "--nohyd --dry")
+                utils.run_in_shell(pdb4amber_command,
+                                   os.path.join(directory, 'pdb4amber.out'),
+                                   directory)
+
+                reduce_command = (amberhome + "/bin/reduce "
+                                  "-build -nuclear pdb4amber.pdb")
+                utils.run_in_shell(reduce_command, reduce_filename,
+                                   directory)
+
+            with timing.step('parse reduce.pdb', reduce_filename):
+                with open(reduce_filename) as f:
+                    self.pdb = pdb_utils.Pdb(f, columnar=None)
+        reduced_atoms = len(self.pdb.atoms)
+
+        with timing.step('rename histidines'):
+            renamed_histidines = get_renamed_histidines(self.pdb)
+            residues = self.pdb.residues()
+
+            for res_hash, res_name in renamed_histidines.items():
+                self.pdb.modify_atoms(residues.get(res_hash, []),
+                                      'resName', res_name)
+
+        nonprot_filename = os.path.join(directory, 'pdb4amber_nonprot.pdb')
+        with timing.step('parse pdb4amber_nonprot.pdb', nonprot_filename):
+            with open(nonprot_filename) as f:
+                self.nonprotPdb = pdb_utils.Pdb(f, columnar=None)
         self.nonprot_residues = set(atom['resName']
                                     for atom in self.nonprotPdb.atoms)
-        self.pdb.atoms = [atom for atom in self.pdb.atoms
-                          if (atom['resName'] not in self.nonprot_residues or
-                              'new' not in atom['extras'])]
 
-        # store crystalline waters
-        with open('pdb4amber_water.pdb') as f:
-            self.waterPdb = pdb_utils.Pdb(f)
+        with timing.step('filter hydrogens'):
+            # Remove hydrogens added by reduce to HETATMs and non-protein
+            # residues
+            self.pdb.remove(self.pdb.where(flag='new') &
+                            (self.pdb.where(record='HETATM') |
+                             self.pdb.where(resName=self.nonprot_residues)))
 
-        os.chdir('..')
+        # store crystalline waters
+        water_filename = os.path.join(directory, 'pdb4amber_water.pdb')
+        with timing.step('parse pdb4amber_water.pdb', water_filename):
+            with open(water_filename) as f:
+                self.waterPdb = pdb_utils.Pdb(f, columnar=None)
+
+        timing.count(atoms_in=len(pdb.atoms), atoms_reduced=reduced_atoms,
+                     atoms_out=len(self.pdb.atoms),
+                     water_atoms=len(self.waterPdb.atoms))
+
+
+def stream_pdb4amber_reduce(pdb, amberhome, directory, debug=False):
+    """
+    Pdb parsed from the output of pdb4amber (reading pdb from stdin) piped
+    into reduce, without intermediate files. The output is read as it is
+    produced, but the columnar backend only parses it once all of it has
+    been read. Messages of both go to pdb4amber_reduce.log.
+    pdb4amber names its side files after its output, they are renamed to
+    pdb4amber_nonprot.pdb and pdb4amber_water.pdb. With debug, the input
+    and the output of reduce are also written to input.pdb and reduce.pdb.
+    """
+    buffer = io.StringIO()
+    pdb.to_file(buffer)
+    commands = [amberhome + "/bin/pdb4amber --nohyd --dry",
+                amberhome + "/bin/reduce -build -nuclear -"]
+    lines = utils.stream_in_shell(
+        commands, buffer.getvalue(),
+        os.path.join(directory, 'pdb4amber_reduce.log'), directory
+    )
+    if debug:
+        with open(os.path.join(directory, 'input.pdb'), 'w') as f:
+            f.write(buffer.getvalue())
+        with open(os.path.join(directory, 'reduce.pdb'), 'w') as f:
+            result = pdb_utils.Pdb(tee(lines, f), columnar=None)
+    else:
+        result = pdb_utils.Pdb(lines, columnar=None)
+
+    for suffix in ['_nonprot.pdb', '_water.pdb']:
+        side_file = os.path.join(directory, PDB4AMBER_STDOUT + suffix)
+        if os.path.isfile(side_file):
+            os.replace(side_file,
+                       os.path.join(directory, 'pdb4amber' + suffix))
+    return result
+
+
+def tee(lines, file):
+    """Yields lines, writing them to file on the way"""
+    for line in lines:
+        file.write(line)
+        yield line
 
 
 def get_renamed_histidines(pdb):
@@ -117,45 +236,28 @@ DEPROT_DICT = {'CYS': 'CYM', 'LYS': 'LYN'}
 class PropkaWrapper(object):
 
     def __init__(self, pdb, ph=7.0, ph_offset=0.7,
-                 working_directory="propka"):
-
-        utils.set_working_directory(working_directory)
-        pdb.to_filename('input.pdb')
-
-        utils.run_in_shell("propka31 input.pdb", "propka31.out")
-        with open('input.pka') as f:
-            propka_results = parse_propka_output(f)
-
-        self.pdb = pdb.copy()
-        residues = self.pdb.residues()
+                 working_directory="propka", reuse=False, in_process=None):
+        """
+        If in_process is True, propka is run through its Python API in this
+        process and its results are stored in pka.json; otherwise propka31
+        is run on input.pdb. None uses the Python API if it is available
+        (see propka_api_available). If reuse is True, propka is not run and
+        the results already in working_directory are used.
+        """
+
+        propka_results = get_propka_results(pdb, working_directory, reuse,
+                                            in_process)
 
         self.prot_pka = ph + ph_offset
         self.deprot_pka = ph - ph_offset
-        self.prot_list = []
-        self.deprot_list = []
-
-        for hash, pka_entry in propka_results.items():
-            if hash not in residues:
-                continue
-
-            if prot_residue(pka_entry, self.prot_pka):
-                pdb_utils.modify_atoms(residues[hash],
-                                       'resName',
-                                       PROT_DICT[pka_entry['resName']])
-                self.prot_list.append(pka_entry)
-
-            if deprot_residue(pka_entry, self.deprot_pka):
-                pdb_utils.modify_atoms(residues[hash],
-                                       'resName',
-                                       DEPROT_DICT[pka_entry['resName']])
-                self.deprot_list.append(pka_entry)
-
-                # Need to remove hydrogens added by reduce on deprotonated
-                # residues - else top-file creation will fail.
-                self.pdb.remove_atom(pdb_utils.find_atom(
-                    residues[hash],
-                    lambda atom: 'new' in atom['extras']
-                ))
+        self.prot_list, self.deprot_list = protonation_changes(
+            propka_results, pdb.residues(), ph, ph_offset
+        )
+        self.pdb = protonate(pdb, self.prot_list, self.deprot_list)
+
+        timing.count(atoms_in=len(pdb.atoms), atoms_out=len(self.pdb.atoms),
+                     protonated=len(self.prot_list),
+                     deprotonated=len(self.deprot_list))
 
         PRINT_PKA_FORMAT = "{resName:>6}{resSeq:>4}{chainID:>2}{pKa:>9.2f}"
 
@@ -177,7 +279,206 @@ class PropkaWrapper(object):
             for pka_entry in self.deprot_list:
                 print(PRINT_PKA_FORMAT.format(**pka_entry))
 
-        os.chdir('..')
+
+class PropkaSweepWrapper(object):
+
+    def __init__(self, pdb, phs, ph_offset=0.7, working_directory="propka",
+                 reuse=False, in_process=None):
+        """
+        Runs propka once and protonates pdb for every pH in phs. pH values
+        resulting in the same protonation state share one entry of
+        self.states, a list of dicts with keys phs, pdb, prot_list and
+        deprot_list in order of increasing pH. self.ph_states maps every
+        pH onto the index of its state.
+        """
+
+        propka_results = get_propka_results(pdb, working_directory, reuse,
+                                            in_process)
+        residues = pdb.residues()
+
+        self.states = []
+        self.ph_states = {}
+        state_indices = {}
+        for ph in sorted(set(phs)):
+            prot_list, deprot_list = protonation_changes(
+                propka_results, residues, ph, ph_offset
+            )
+            key = (tuple(map(pdb_utils.residue_hash, prot_list)),
+                   tuple(map(pdb_utils.residue_hash, deprot_list)))
+            if key not in state_indices:
+                state_indices[key] = len(self.states)
+                self.states.append({
+                    'phs': [],
+                    'pdb': protonate(pdb, prot_list, deprot_list),
+                    'prot_list': prot_list,
+                    'deprot_list': deprot_list
+                })
+            self.states[state_indices[key]]['phs'].append(ph)
+            self.ph_states[ph] = state_indices[key]
+
+        timing.count(atoms_in=len(pdb.atoms), phs=len(self.ph_states),
+                     states=len(self.states))
+
+        for index, state in enumerate(self.states):
+            print("Protonation state {} (pH {}): {} protonated, "
+                  "{} deprotonated residues".format(
+                      index + 1, ', '.join(map(str, state['phs'])),
+                      len(state['prot_list']), len(state['deprot_list'])))
+
+    def summary(self):
+        """
+        JSON-serializable description of the states (numbered from 1) and
+        of the state number of every pH
+        """
+        def residues(entries):
+            return [pdb_utils.residue_hash(entry) for entry in entries]
+        return {
+            'states': [{'state': index + 1,
+                        'phs': state['phs'],
+                        'protonated': residues(state['prot_list']),
+                        'deprotonated': residues(state['deprot_list'])}
+                       for index, state in enumerate(self.states)],
+            'ph_states': {str(ph): index + 1
+                          for ph, index in self.ph_states.items()}
+        }
+
+
+def get_propka_results(pdb, working_directory, reuse=False, in_process=None):
+    """
+    propka results for pdb as dict of residue_hash: pKa entry, computed
+    in working_directory as described in PropkaWrapper
+    """
+    if in_process is None:
+        in_process = propka_api_available()
+    elif in_process and not propka_api_available():
+        raise ImportError("Running propka in-process requires propka 3.2 "
+                          "or later")
+    directory = os.path.abspath(working_directory)
+    json_filename = os.path.join(directory, 'pka.json')
+    pka_filename = os.path.join(directory, 'input.pka')
+    if reuse:
+        if os.path.isfile(json_filename):
+            with open(json_filename) as f:
+                return json.load(f)
+        with open(pka_filename) as f:
+            return parse_propka_output(f)
+
+    utils.make_working_directory(directory)
+    if in_process:
+        with timing.step('propka'):
+            propka_results = run_propka(pdb)
+        with open(json_filename, 'w') as f:
+            json.dump(propka_results, f, indent=1)
+        return propka_results
+
+    input_filename = os.path.join(directory, 'input.pdb')
+    with timing.step('write input.pdb', input_filename):
+        pdb.to_filename(input_filename)
+
+    utils.run_in_shell("propka31 input.pdb",
+                       os.path.join(directory, "propka31.out"),
+                       directory)
+    with timing.step('parse input.pka', pka_filename):
+        with open(pka_filename) as f:
+            return parse_propka_output(f)
+
+
+def protonation_changes(propka_results, residues, ph, ph_offset=0.7):
+    """
+    (prot_list, deprot_list) of the pKa entries of residues (dict of
+    residue_hash: atoms) to be protonated and deprotonated at ph
+    """
+    prot_list = []
+    deprot_list = []
+    for hash, pka_entry in propka_results.items():
+        if hash not in residues:
+            continue
+        if prot_residue(pka_entry, ph + ph_offset):
+            prot_list.append(pka_entry)
+        if deprot_residue(pka_entry, ph - ph_offset):
+            deprot_list.append(pka_entry)
+    return prot_list, deprot_list
+
+
+def protonate(pdb, prot_list, deprot_list):
+    """Copy of pdb with the residues of pKa entries renamed"""
+    pdb = pdb.copy()
+    residues = pdb.residues()
+
+    for pka_entry in prot_list:
+        pdb.modify_atoms(residues[pdb_utils.residue_hash(pka_entry)],
+                         'resName', PROT_DICT[pka_entry['resName']])
+
+    # Need to remove one hydrogen added by reduce on deprotonated
+    # residues - else top-file creation will fail.
+    removed = []
+    for pka_entry in deprot_list:
+        atoms = residues[pdb_utils.residue_hash(pka_entry)]
+        pdb.modify_atoms(atoms, 'resName', DEPROT_DICT[pka_entry['resName']])
+        hydrogen = next((atom for atom in atoms if 'new' in atom['extras']),
+                        None)
+        if hydrogen is not None:
+            removed.append(hydrogen)
+    pdb.remove(pdb.mask_of(removed))
+    return pdb
+
+
+def propka_api_available():
+    """
+    True if the importable propka has the Python API used by run_propka:
+    propka.run.single reading a stream without writing a .pka file
+    (propka 3.2 and later). propka 3.1 only provides propka31.
+    """
+    if propka is None:
+        return False
+    try:
+        parameters = inspect.signature(propka.run.single).parameters
+    except (AttributeError, TypeError, ValueError):
+        return False
+    return 'stream' in parameters and 'write_pka' in parameters
+
+
+def propka_version(in_process=None):
+    """
+    Identifies the propka PropkaWrapper uses with in_process: version of
+    the importable propka package for its Python API, else path of
+    propka31. None if that propka cannot be found.
+    """
+    if in_process is None:
+        in_process = propka_api_available()
+    if in_process:
+        if not propka_api_available():
+            return None
+        return 'propka ' + getattr(propka, '__version__', 'unknown')
+    return shutil.which('propka31')
+
+
+def run_propka(pdb):
+    """
+    propka results for pdb (same as parse_propka_output) computed with
+    the propka Python API, without any files
+    """
+    buffer = io.StringIO()
+    pdb.to_file(buffer)
+    buffer.seek(0)
+    molecule = propka.run.single('input.pdb', ['--quiet'], stream=buffer,
+                                 write_pka=False)
+    return propka_summary(molecule)
+
+
+def propka_summary(molecule):
+    """
+    pKa entries of propka's MolecularContainer, selected and rounded the
+    same way as in the summary section of its .pka output
+    """
+    parameters = molecule.version.parameters
+    groups = molecule.conformations['AVR'].groups
+    lines = (group.get_summary_string(parameters.remove_penalised_group)
+             for residue_type in parameters.write_out_order
+             for group in groups if group.residue_type == residue_type)
+    return {pdb_utils.residue_hash(entry): entry
+            for entry in map(line_to_pka_entry, lines)
+            if entry is not None}
 
 
 def parse_propka_output(file):
@@ -215,32 +516,229 @@ class TleapWrapper(object):
     def __init__(self, template_name, include=[], nonprot_residues=[],
                  params={}, working_directory='tleap'):
 
-        utils.set_working_directory(working_directory)
-
-        enlighten_path = os.path.dirname(__import__(__name__).__file__)
-        tleap_module_path = os.path.join(enlighten_path, 'tleap')
-        template_path = os.path.join(tleap_module_path, template_name + '.in')
-        template_contents = None
-        if os.path.isfile(template_path):
-            with open(template_path) as f:
-                template_contents = f.read()
-
+        directory = os.path.abspath(working_directory)
+        utils.make_working_directory(directory)
+        template_module, template_contents = load_tleap_template(
+            template_name)
         params['include'] = get_tleap_includes(include, nonprot_residues)
-        template_module = getattr(
-            __import__('tleap', fromlist=[template_name]),
-            template_name
-        )
-
-        params['pdb'].to_filename('input.pdb')
-        params['water_pdb'].to_filename('water.pdb')
-        with open('tleap.in', 'w') as f:
+        write_tleap_structures(directory, params)
+        if hasattr(template_module, 'prepare'):
+            template_module.prepare(params, directory)
+        with open(os.path.join(directory, 'tleap.in'), 'w') as f:
             f.write(template_module.run(params, template_contents))
-        utils.run_in_shell('tleap -f tleap.in', 'tleap.log')
+        run_tleap(directory, params)
+        if hasattr(template_module, 'check'):
+            template_module.check(params, directory)
+
+
+class TleapSweepWrapper(object):
+    """
+    Runs a template for several variants of params (dicts overriding e.g.
+    solvent_radius and solvent_closeness). The dry system is built by one
+    tleap run and saved as a library, which the variants then solvate in
+    parallel tleap runs in subdirectories of working_directory. The
+    template module has to provide build(params, template) and
+    solvate(params, template, library), see tleap/sphere.py. Templates
+    with prepare(params, directory) (e.g. tleap/sphere_np.py) write the
+    files a tleap run needs besides input.pdb and water.pdb with it.
+    Repeated variants are only run once, see unique_variants.
+    """
 
-        try:
-            template_module.check(params)
-        except AttributeError:
-            pass
+    def __init__(self, template_name, include=[], nonprot_residues=[],
+                 params={}, variants=[], working_directory='tleap',
+                 workers=None):
+
+        self.working_directory = os.path.abspath(working_directory)
+        utils.make_working_directory(self.working_directory)
+        template_module, template_contents = load_tleap_template(
+            template_name)
+        if not hasattr(template_module, 'solvate'):
+            raise ValueError("tleap template {} does not support sweeps"
+                             .format(template_name))
+        params['include'] = get_tleap_includes(include, nonprot_residues)
+        variants = unique_variants(params, variants)
+        write_tleap_structures(self.working_directory, params)
+
+        with open(os.path.join(self.working_directory, 'tleap.in'),
+                  'w') as f:
+            f.write(template_module.build(dict(params), template_contents))
+        result = run_tleap(self.working_directory, params)
+        library = os.path.join(self.working_directory,
+                               '{}.dry.off'.format(params['name']))
+        if result.returncode != 0 or not os.path.isfile(library):
+            raise RuntimeError("tleap could not build the dry system, check "
+                               "{}".format(os.path.join(
+                                   self.working_directory, 'tleap.log')))
+
+        self.variants = []
+        for name, variant_params in variants:
+            directory = os.path.join(self.working_directory, name)
+            os.makedirs(directory)
+            if hasattr(template_module, 'prepare'):
+                template_module.prepare(variant_params, directory)
+            with open(os.path.join(directory, 'tleap.in'), 'w') as f:
+                f.write(template_module.solvate(
+                    dict(variant_params), template_contents,
+                    os.path.relpath(library, directory)))
+            self.variants.append({'params': variant_params,
+                                  'directory': directory})
+        results = run_tleap_all([variant['directory']
+                                 for variant in self.variants],
+                                params, workers)
+
+        for variant, result in zip(self.variants, results):
+            variant['result'] = result
+            outputs = []
+            if hasattr(template_module, 'outputs'):
+                outputs = template_module.outputs(variant['params'])
+            variant['outputs'] = {
+                name: os.path.getsize(os.path.join(variant['directory'],
+                                                   name))
+                for name in outputs
+                if os.path.isfile(os.path.join(variant['directory'], name))
+            }
+            variant['ok'] = (result.returncode == 0 and
+                             len(variant['outputs']) == len(outputs))
+            variant['report'] = None
+            if variant['ok'] and hasattr(template_module, 'check'):
+                variant['report'] = template_module.check(
+                    variant['params'], variant['directory'])
+
+        with open(os.path.join(self.working_directory, 'sweep.json'),
+                  'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        print(self.report())
+
+    def summary(self):
+        """List of dicts describing the outcome of every variant"""
+        return [{
+            'directory': os.path.basename(variant['directory']),
+            'solvent_radius': variant['params'].get('solvent_radius'),
+            'solvent_closeness': variant['params'].get('solvent_closeness'),
+            'ok': variant['ok'],
+            'returncode': variant['result'].returncode,
+            'wall_time': variant['result'].wall_time,
+            'outputs': variant['outputs'],
+            'system': variant['report']
+        } for variant in self.variants]
+
+    def report(self):
+        """Table of the variants for humans"""
+        lines = ["{:<16}{:>8}{:>10}{:>10}{:>9}{:>9}  {}".format(
+            'variant', 'radius', 'closeness', 'time (s)', 'atoms', 'charge',
+            'outputs')]
+        for entry in self.summary():
+            system = entry['system'] or {}
+            if not entry['ok']:
+                outputs = "FAILED, check {}/tleap.log".format(
+                    entry['directory'])
+            else:
+                outputs = ', '.join(list(entry['outputs']) +
+                                    system.get('problems', []))
+            lines.append("{:<16}{:>8}{:>10}{:>10.1f}{:>9}{:>9}  {}".format(
+                entry['directory'], entry['solvent_radius'],
+                entry['solvent_closeness'], entry['wall_time'],
+                system.get('atoms', '-'),
+                '{:.3f}'.format(system['charge']) if 'charge' in system
+                else '-', outputs))
+        return '\n'.join(lines)
+
+
+def run_tleap(directory, params):
+    """
+    Runs tleap.in in directory with output to tleap.log in a one-shot tleap,
+    or in a warm tleap_pool worker if params['pool_workers'] > 0
+    """
+    if not params.get('pool_workers'):
+        return utils.run_in_shell('tleap -f tleap.in',
+                                  os.path.join(directory, 'tleap.log'),
+                                  directory)
+    result = run_in_pool(directory, params)
+    timing.record_command(result)
+    return result
+
+
+def run_tleap_all(directories, params, workers=None):
+    """run_tleap in all directories in parallel, RunResults in order"""
+    if not params.get('pool_workers'):
+        return utils.run_all_in_shell(
+            [('tleap -f tleap.in', os.path.join(directory, 'tleap.log'),
+              directory) for directory in directories],
+            workers
+        )
+    with concurrent.futures.ThreadPoolExecutor(
+            workers or params['pool_workers']) as executor:
+        results = list(executor.map(
+            lambda directory: run_in_pool(directory, params), directories))
+    # Recorded here, the timing stage is only known in this thread
+    for result in results:
+        timing.record_command(result)
+    return results
+
+
+def run_in_pool(directory, params):
+    """RunResult of tleap.in in directory run by a tleap_pool worker"""
+    with open(os.path.join(directory, 'tleap.in')) as f:
+        setup, commands = tleap_pool.split_setup(f.read())
+    pool = tleap_pool.get_pool(
+        setup, params['pool_workers'], params.get('pool_max_jobs', 100),
+        params.get('pool_timeout', tleap_pool.DEFAULT_TIMEOUT))
+    return pool.run(commands, directory, os.path.join(directory, 'tleap.log'))
+
+
+def variant_directory(params):
+    """Name of the subdirectory of a tleap sweep variant"""
+    return 'sp{solvent_radius:g}_c{solvent_closeness:g}'.format(**params)
+
+
+def unique_variants(params, variants):
+    """
+    List of (variant_directory, params updated with variant) of variants,
+    leaving out repeated variants. Raises ValueError if different variants
+    would share a directory.
+    """
+    unique = {}
+    for variant in variants:
+        variant_params = dict(params, **variant)
+        name = variant_directory(variant_params)
+        if name in unique:
+            other_variant, other_params = unique[name]
+            if any(variant_params.get(key) != other_params.get(key)
+                   for key in set(variant) | set(other_variant)):
+                raise ValueError("tleap sweep variants {} and {} differ but "
+                                 "share the directory {}".format(
+                                     other_variant, variant, name))
+            continue
+        unique[name] = (variant, variant_params)
+    return [(name, variant_params)
+            for name, (_, variant_params) in unique.items()]
+
+
+def load_tleap_template(template_name):
+    """(module, contents of the .in file or None) of a tleap template"""
+    enlighten_path = os.path.dirname(__import__(__name__).__file__)
+    tleap_module_path = os.path.join(enlighten_path, 'tleap')
+    template_path = os.path.join(tleap_module_path, template_name + '.in')
+    template_contents = None
+    if os.path.isfile(template_path):
+        with open(template_path) as f:
+            template_contents = f.read()
+    template_module = getattr(
+        __import__('tleap', fromlist=[template_name]),
+        template_name
+    )
+    return template_module, template_contents
+
+
+def write_tleap_structures(directory, params):
+    """Writes params['pdb'] and params['water_pdb'] for tleap"""
+    for name, pdb in [('input.pdb', params['pdb']),
+                      ('water.pdb', params['water_pdb'])]:
+        filename = os.path.join(directory, name)
+        with timing.step('write ' + name, filename):
+            pdb.to_filename(filename)
+    timing.count(atoms_in=len(params['pdb'].atoms),
+                 water_atoms=len(params['water_pdb'].atoms))
 
 
 def get_tleap_includes(include, nonprot_residues):